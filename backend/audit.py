@@ -0,0 +1,272 @@
+"""
+Buffered, asynchronous writer for the audit_logs table.
+
+Requests only append an event to a bounded in-memory ring buffer, so recording
+an audit event never costs a database round trip. A background task flushes the
+buffer as bulk inserts when it reaches AUDIT_BATCH_SIZE events or every
+AUDIT_FLUSH_INTERVAL_SECONDS, whichever comes first. When the buffer is full the
+oldest events are overwritten and counted as dropped.
+
+Every accepted event is also appended to a local spool file. Each flush rotates
+the spool segment and deletes it only after the insert succeeded, so events
+survive a crash or a database outage: segments left behind (by this worker, a
+dead worker or a previous run) are re-inserted on later flushes. Live segments
+are held under flock, which is how workers tell abandoned segments from active
+ones. Inserts are idempotent on the event id, so a replayed segment is harmless.
+
+A batch the database rejects because of its rows (a constraint or data error)
+is split until the offending events are found; those are dropped and counted
+as rejected, and the rest are written, so one bad event cannot hold up the
+spool forever.
+"""
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Awaitable, Callable, Optional
+
+AUDIT_BUFFER_SIZE = int(os.getenv('AUDIT_BUFFER_SIZE', '10000'))
+AUDIT_BATCH_SIZE = int(os.getenv('AUDIT_BATCH_SIZE', '500'))
+AUDIT_FLUSH_INTERVAL_SECONDS = float(os.getenv('AUDIT_FLUSH_INTERVAL_SECONDS', '2'))
+AUDIT_SPOOL_DIR = Path(os.getenv('AUDIT_SPOOL_DIR', Path(tempfile.gettempdir()) / 'bharatprint-audit'))
+AUDIT_SPOOL_MAX_BYTES = int(os.getenv('AUDIT_SPOOL_MAX_BYTES', str(64 * 1024 * 1024)))
+
+
+def is_rejected_row_error(error: Exception) -> bool:
+    """Whether an insert failed because of the rows themselves (SQLSTATE class 22 or 23) rather than the database"""
+    return str(getattr(error, "code", None) or "")[:2] in ("22", "23")
+
+
+class AuditLog:
+    """Ring-buffered audit events, flushed in bulk by a background task"""
+
+    def __init__(
+        self,
+        insert_rows: Callable[[list], Awaitable[None]],
+        capacity: int = AUDIT_BUFFER_SIZE,
+        batch_size: int = AUDIT_BATCH_SIZE,
+        flush_interval: float = AUDIT_FLUSH_INTERVAL_SECONDS,
+        spool_dir: Path = AUDIT_SPOOL_DIR,
+        spool_max_bytes: int = AUDIT_SPOOL_MAX_BYTES
+    ):
+        self.insert_rows = insert_rows
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spool_dir = Path(spool_dir)
+        self.spool_max_bytes = spool_max_bytes
+        self.buffer: deque = deque(maxlen=capacity)
+        self.counters = {"recorded": 0, "written": 0, "dropped": 0, "replayed": 0, "rejected": 0, "flush_failures": 0}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._spool = None
+
+    # ---------- recording (request path) ----------
+
+    def record(
+        self,
+        action: str,
+        user_id: Optional[str] = None,
+        resource_type: Optional[str] = None,
+        resource_id: Optional[str] = None,
+        metadata: Optional[dict] = None,
+        ip_address: Optional[str] = None
+    ):
+        """Queue an audit event; never blocks on the database"""
+        event = {
+            "id": str(uuid.uuid4()),
+            "user_id": user_id,
+            "action": action,
+            "resource_type": resource_type,
+            "resource_id": resource_id,
+            "metadata": metadata,
+            "ip_address": ip_address,
+            "created_at": datetime.now(timezone.utc).isoformat()
+        }
+        if len(self.buffer) == self.buffer.maxlen:
+            # The ring overwrites the oldest event; it is still in the spool segment
+            self.counters["dropped"] += 1
+        self.buffer.append(event)
+        self.counters["recorded"] += 1
+        self._append_to_spool(event)
+
+        # Backpressure: a full batch is flushed right away instead of waiting for the timer
+        if len(self.buffer) >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+
+    def stats(self) -> dict:
+        return {**self.counters, "buffered": len(self.buffer), "capacity": self.buffer.maxlen}
+
+    # ---------- spool segments ----------
+
+    def _open_spool(self):
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+        path = self.spool_dir / f"audit-{os.getpid()}-{uuid.uuid4().hex}.jsonl"
+        self._spool = open(path, "a", encoding="utf-8")
+        fcntl.flock(self._spool.fileno(), fcntl.LOCK_EX)
+
+    def _append_to_spool(self, event: dict):
+        if self._spool is None:
+            return
+        try:
+            self._spool.write(json.dumps(event) + "\n")
+            # Reaches the OS page cache, so a worker crash does not lose it
+            self._spool.flush()
+        except OSError as e:
+            logging.warning(f"Audit spool write failed: {e}")
+
+    def _rotate_spool(self) -> Optional[Path]:
+        """Close the live segment (it now holds exactly the drained events) and start a new one"""
+        if self._spool is None:
+            return None
+        path = Path(self._spool.name)
+        os.fsync(self._spool.fileno())
+        self._spool.close()
+        self._open_spool()
+        return path
+
+    def _abandoned_segments(self) -> list:
+        """Spool segments nobody holds a lock on, oldest first"""
+        live = Path(self._spool.name) if self._spool else None
+        segments = [path for path in self.spool_dir.glob("audit-*.jsonl") if path != live]
+        return sorted(segments, key=lambda path: path.stat().st_mtime if path.exists() else 0)
+
+    def _enforce_spool_limit(self, segments: list) -> list:
+        """Drop the oldest abandoned segments while the spool is over its size limit"""
+        sizes = {path: path.stat().st_size for path in segments if path.exists()}
+        total = sum(sizes.values())
+        kept = []
+        for path in segments:
+            if total > self.spool_max_bytes and path in sizes and self._drop_segment(path):
+                total -= sizes[path]
+            else:
+                kept.append(path)
+        return kept
+
+    def _drop_segment(self, path: Path) -> bool:
+        try:
+            with open(path, encoding="utf-8") as segment:
+                fcntl.flock(segment.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                self.counters["dropped"] += sum(1 for _ in segment)
+                path.unlink(missing_ok=True)
+        except (FileNotFoundError, BlockingIOError):
+            return False
+        logging.warning(f"Audit spool over {self.spool_max_bytes} bytes, dropped {path.name}")
+        return True
+
+    async def _replay_segment(self, path: Path) -> bool:
+        """Insert a segment's events and delete it; False if it stays for a later flush"""
+        try:
+            segment = open(path, encoding="utf-8")
+        except FileNotFoundError:
+            return True
+        with segment:
+            try:
+                fcntl.flock(segment.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return True  # live segment of another worker, or being replayed by one
+            events = []
+            for line in segment:
+                try:
+                    events.append(json.loads(line))
+                except ValueError:
+                    continue  # torn last line from a crash mid-write
+            if not await self._insert(events):
+                return False
+            path.unlink(missing_ok=True)
+        self.counters["replayed"] += len(events)
+        return True
+
+    # ---------- flushing ----------
+
+    async def _insert(self, events: list) -> bool:
+        for start in range(0, len(events), self.batch_size):
+            if not await self._insert_batch(events[start:start + self.batch_size]):
+                return False
+        return True
+
+    async def _insert_batch(self, events: list) -> bool:
+        """Insert a batch, dropping events the database rejects; False while the database is failing"""
+        try:
+            await self.insert_rows(events)
+            self.counters["written"] += len(events)
+            return True
+        except Exception as e:
+            if not is_rejected_row_error(e):
+                self.counters["flush_failures"] += 1
+                logging.warning(f"Audit log flush failed, keeping events in spool: {e}")
+                return False
+            if len(events) == 1:
+                self.counters["rejected"] += 1
+                logging.error(f"Audit event {events[0]['id']} ({events[0]['action']}) rejected, dropping it: {e}")
+                return True
+        # Halve the batch to isolate the bad events; the halves that insert are written
+        middle = len(events) // 2
+        return await self._insert_batch(events[:middle]) and await self._insert_batch(events[middle:])
+
+    async def flush(self):
+        """Write buffered events, then retry any segments left from failures or crashes"""
+        if self.buffer:
+            events = list(self.buffer)
+            self.buffer.clear()
+            segment = self._rotate_spool()
+            if not await self._insert(events):
+                if segment is None:
+                    # No spool to fall back on: keep them in the ring for the next flush
+                    self.buffer.extendleft(reversed(events[-self.buffer.maxlen:]))
+                # Otherwise the rotated segment stays on disk and is retried next time
+                return
+            if segment is not None:
+                segment.unlink(missing_ok=True)
+
+        if self._spool is None:
+            return
+        for path in self._enforce_spool_limit(self._abandoned_segments()):
+            if not await self._replay_segment(path):
+                break
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"Audit log flush loop error: {e}")
+
+    def start(self):
+        """Open the spool and start the flusher (called from the app lifespan)"""
+        try:
+            self._open_spool()
+        except OSError as e:
+            logging.warning(f"Audit spool unavailable ({e}) - events are kept in memory only")
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the flusher and write out whatever is still buffered"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        started = time.monotonic()
+        await self.flush()
+        if self._spool is not None:
+            path = Path(self._spool.name)
+            self._spool.close()
+            self._spool = None
+            if path.exists() and path.stat().st_size == 0:
+                path.unlink(missing_ok=True)
+        logging.info(f"Audit log stopped ({self.stats()['written']} events written, final flush {time.monotonic() - started:.2f}s)")
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Benchmark blob compression on typical print-shop files
+Reports the policy decision, compression ratio and throughput per file
+
+Usage:
+    python bench_compression.py              # synthetic corpus
+    python bench_compression.py ./samples    # your own files
+"""
+
+import io
+import mimetypes
+import random
+import sys
+import time
+import zipfile
+from pathlib import Path
+
+from PIL import Image, ImageDraw
+
+import compression
+
+
+def make_order_sheet() -> bytes:
+    """Plain-text order log, like an exported register"""
+    rng = random.Random(1)
+    names = ["Sharma", "Das", "Baruah", "Gogoi", "Kalita", "Bora", "Saikia", "Deka"]
+    lines = ["date,customer,phone,pages,color,copies,amount"]
+    for i in range(40000):
+        lines.append(
+            f"2026-0{rng.randint(1, 9)}-{rng.randint(10, 28)},{rng.choice(names)},"
+            f"+9198{rng.randint(10000000, 99999999)},{rng.randint(1, 40)},"
+            f"{rng.choice(['bw', 'color'])},{rng.randint(1, 5)},{rng.randint(5, 900)}"
+        )
+    return "\n".join(lines).encode()
+
+
+def make_uncompressed_pdf(pages: int = 200) -> bytes:
+    """PDF with uncompressed text content streams (common from older printer drivers)"""
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for page in range(pages):
+        ops = [b"BT /F1 11 Tf 72 770 Td 14 TL"]
+        for line in range(50):
+            ops.append(f"(Application form page {page + 1} line {line + 1}: name, address, signature) '".encode())
+        ops.append(b"ET")
+        stream = b"\n".join(ops)
+        offsets.append(out.tell())
+        out.write(f"{page + 1} 0 obj << /Length {len(stream)} >> stream\n".encode())
+        out.write(stream + b"\nendstream endobj\n")
+    out.write(b"trailer << /Size %d >>\n%%%%EOF\n" % (pages + 1))
+    return out.getvalue()
+
+
+def make_docx() -> bytes:
+    """DOCX container (deflated XML parts plus an embedded JPEG)"""
+    body = "".join(f"<w:p><w:r><w:t>Clause {i}: the tenant shall pay rent monthly.</w:t></w:r></w:p>" for i in range(8000))
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as docx:
+        docx.writestr("[Content_Types].xml", "<Types/>")
+        docx.writestr("word/document.xml", f"<w:document><w:body>{body}</w:body></w:document>")
+        docx.writestr("word/media/image1.jpeg", make_photo(), compress_type=zipfile.ZIP_STORED)
+    return out.getvalue()
+
+
+def make_scan() -> Image.Image:
+    """A4 page at 150 DPI with text-like strokes and scanner noise"""
+    rng = random.Random(2)
+    img = Image.new("RGB", (1240, 1754), "white")
+    draw = ImageDraw.Draw(img)
+    for y in range(120, 1650, 28):
+        x = 100
+        while x < 1120:
+            width = rng.randint(10, 60)
+            draw.rectangle([x, y, x + width, y + 12], fill=(20, 20, 20))
+            x += width + rng.randint(8, 20)
+    for _ in range(20000):
+        img.putpixel((rng.randrange(1240), rng.randrange(1754)), (rng.randint(180, 255),) * 3)
+    return img
+
+
+def make_photo() -> bytes:
+    rng = random.Random(3)
+    img = Image.frombytes("RGB", (1200, 900), bytes(rng.getrandbits(8) for _ in range(1200 * 900 * 3)))
+    out = io.BytesIO()
+    img.resize((2400, 1800)).save(out, format="JPEG", quality=85)
+    return out.getvalue()
+
+
+def synthetic_corpus() -> list:
+    scan = make_scan()
+    bmp, tiff, png = io.BytesIO(), io.BytesIO(), io.BytesIO()
+    scan.save(bmp, format="BMP")
+    scan.save(tiff, format="TIFF")
+    scan.save(png, format="PNG")
+    return [
+        ("orders.csv", "text/csv", make_order_sheet()),
+        ("form.pdf", "application/pdf", make_uncompressed_pdf()),
+        ("agreement.docx", "application/vnd.openxmlformats-officedocument.wordprocessingml.document", make_docx()),
+        ("scan.bmp", "image/bmp", bmp.getvalue()),
+        ("scan.tiff", "image/tiff", tiff.getvalue()),
+        ("scan.png", "image/png", png.getvalue()),
+        ("photo.jpg", "image/jpeg", make_photo()),
+    ]
+
+
+def directory_corpus(path: Path) -> list:
+    corpus = []
+    for file_path in sorted(path.iterdir()):
+        if file_path.is_file():
+            content_type = mimetypes.guess_type(file_path.name)[0] or "application/octet-stream"
+            corpus.append((file_path.name, content_type, file_path.read_bytes()))
+    return corpus
+
+
+def run(corpus: list):
+    print("=" * 92)
+    print(f"🗜️  Blob compression benchmark (zstd level {compression.COMPRESSION_LEVEL})")
+    print("=" * 92)
+    print(f"{'file':<18}{'type':<26}{'size':>10}{'stored':>10}{'ratio':>8}{'comp MB/s':>11}{'dec MB/s':>10}")
+
+    total_in = total_stored = 0
+    for name, content_type, data in corpus:
+        start = time.perf_counter()
+        compress = compression.should_compress(content_type, compression.probe_sample(data))
+        if compress:
+            stored = compression.compress(data)
+            comp_secs = time.perf_counter() - start
+            start = time.perf_counter()
+            restored = b"".join(compression.iter_decompress(stored))
+            dec_secs = time.perf_counter() - start
+            assert restored == data
+            comp_rate = f"{len(data) / comp_secs / 1e6:.0f}"
+            dec_rate = f"{len(data) / dec_secs / 1e6:.0f}"
+        else:
+            stored = data
+            comp_rate = dec_rate = "skip"
+
+        total_in += len(data)
+        total_stored += len(stored)
+        print(
+            f"{name[:17]:<18}{content_type[:25]:<26}{len(data) / 1e6:>9.2f}M{len(stored) / 1e6:>9.2f}M"
+            f"{len(data) / len(stored):>7.2f}x{comp_rate:>11}{dec_rate:>10}"
+        )
+
+    print("-" * 92)
+    print(f"{'total':<44}{total_in / 1e6:>9.2f}M{total_stored / 1e6:>9.2f}M{total_in / max(total_stored, 1):>7.2f}x")
+
+
+if __name__ == "__main__":
+    if compression.zstandard is None:
+        sys.exit("zstandard is not installed")
+    run(directory_corpus(Path(sys.argv[1])) if len(sys.argv) > 1 else synthetic_corpus())
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Memory benchmark for the upload and download paths
+Uploads and downloads files of a few sizes through the app (in-memory store)
+with tracemalloc on, and reports the per-route allocation peak recorded by the
+memory accounting middleware against a per-route budget. Exits non-zero
+when a route goes over its budget, so a change that starts buffering whole
+files (or copies of them) shows up here.
+
+Usage:
+    python bench_memory.py              # 1MB, 8MB and 32MB files
+    python bench_memory.py 2 45         # custom sizes in MB
+"""
+
+import asyncio
+import os
+import sys
+import uuid
+
+import httpx
+
+import server
+
+MB = 1024 * 1024
+
+# Allowed peak per route: (bytes per file byte, fixed bytes). The in-memory
+# store keeps the uploaded file itself and the multipart parser spools to a
+# temp file, so an upload costs about 1x the file; a download streams in chunks
+# and should not grow with the file at all.
+BUDGETS = {
+    "POST /api/documents/upload": (1.25, 3 * MB),
+    "GET /api/documents/download/{share_link}": (0.1, 3 * MB),
+}
+
+
+def install_mock_backend() -> str:
+    """In-memory users/documents/files and a merchant token"""
+    server.supabase_client = None
+    server.blob_store.supabase = None
+    server.blob_store.objects = None
+    user_id = str(uuid.uuid4())
+    phone = "+919800000000"
+    server.mock_db["users"].append({
+        "id": user_id,
+        "phone_number": phone,
+        "name": "Bench Merchant",
+        "monthly_upload_limit": 10**6,
+        "uploads_used_this_month": 0
+    })
+    return server.create_jwt_token(user_id, phone)
+
+
+async def download(share_link: str) -> int:
+    """GET a download straight through the ASGI app, counting and dropping the body
+
+    httpx's ASGI transport collects the whole response, which would show up in
+    the route's peak as if the server had buffered it.
+    """
+    received = 0
+    requested = False
+
+    async def receive():
+        nonlocal requested
+        if requested:
+            # The client stays connected; the response cancels this wait once it is done
+            await asyncio.Event().wait()
+        requested = True
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        nonlocal received
+        if message["type"] == "http.response.start":
+            assert message["status"] == 200, message["status"]
+        elif message["type"] == "http.response.body":
+            received += len(message.get("body", b""))
+
+    await server.app({
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": f"/api/documents/download/{share_link}", "raw_path": b"", "query_string": b"",
+        "headers": [(b"host", b"bench")], "client": ("127.0.0.1", 0), "server": ("bench", 80)
+    }, receive, send)
+    return received
+
+
+async def measure(client: httpx.AsyncClient, token: str, size: int) -> dict:
+    # Random bytes: incompressible, so the stored blob is as large as the upload
+    content = os.urandom(size)
+    upload = await client.post(
+        "/api/documents/upload",
+        headers={"Authorization": f"Bearer {token}"},
+        files={"file": ("scan.jpg", content, "image/jpeg")},
+        data={"customerName": "Bench", "deleteAfterMinutes": "60"}
+    )
+    assert upload.status_code == 200, upload.text
+    share_link = upload.json()["document"]["sharedLink"].rsplit("/", 1)[-1]
+    del content
+
+    received = await download(share_link)
+    assert received == size
+
+    return {route: stats["maxPeakBytes"] for route, stats in server.memory_accounting.route_stats().items()}
+
+
+async def run(sizes_mb: list) -> bool:
+    token = install_mock_backend()
+    server.memory_accounting.set_tracing(True)
+    over_budget = False
+
+    print(f"{'file':>8}  {'route':<44}{'peak':>9}{'budget':>9}{'peak/size':>11}")
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        for size_mb in sizes_mb:
+            server.memory_accounting.routes.clear()
+            size = size_mb * MB
+            peaks = await measure(client, token, size)
+            for route, (per_byte, fixed) in BUDGETS.items():
+                peak = peaks.get(route, 0)
+                budget = per_byte * size + fixed
+                flag = "" if peak <= budget else "  ✗ over budget"
+                over_budget |= peak > budget
+                print(f"{size_mb:>6}MB  {route:<44}{peak / MB:>7.1f}MB{budget / MB:>7.1f}MB{peak / size:>10.2f}x{flag}")
+
+    server.memory_accounting.set_tracing(False)
+    return not over_budget
+
+
+if __name__ == "__main__":
+    sizes_mb = [int(arg) for arg in sys.argv[1:]] or [1, 8, 32]
+    print("=" * 70)
+    print("🧠 Upload/download memory benchmark (tracemalloc peaks per route)")
+    print("=" * 70)
+    sys.exit(0 if asyncio.run(run(sizes_mb)) else 1)
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Benchmark print-job metadata extraction on large PDFs and scans
+Reports the extracted page count, paper size and colour hint per file, the
+scan throughput, and the throughput of the process pool over the corpus
+
+Usage:
+    python bench_metadata.py              # synthetic corpus
+    python bench_metadata.py ./samples    # your own files
+"""
+
+import io
+import mimetypes
+import os
+import random
+import sys
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from PIL import Image
+
+import file_metadata
+
+A4 = (595.28, 841.89)
+LETTER = (612, 792)
+A3 = (841.89, 1190.55)
+
+
+def page_content(rng: random.Random, page: int, color: bool) -> bytes:
+    """A text-heavy page content stream, with a coloured heading when asked"""
+    ops = [b"q", b"1 0 0 rg" if color else b"0.2 g", b"72 780 200 18 re f", b"0 g", b"BT /F1 10 Tf 72 740 Td 12 TL"]
+    for line in range(55):
+        words = " ".join(rng.choice(["invoice", "amount", "paid", "copies", "A4", "colour", "total"]) for _ in range(9))
+        ops.append(f"(Page {page + 1} line {line + 1}: {words}) '".encode())
+    ops += [b"ET", b"Q"]
+    return b"\n".join(ops)
+
+
+def make_pdf(pages: int, sizes: list, color_every: int = 0, object_streams: bool = False,
+             image_bytes: int = 0, seed: int = 1) -> bytes:
+    """A PDF of Flate content streams under a two-level page tree
+
+    object_streams packs the page dictionaries into compressed object streams
+    (as PDF 1.5+ writers do); image_bytes embeds a JPEG-sized opaque image
+    stream per page, to get realistic file sizes for scanned documents.
+    """
+    rng = random.Random(seed)
+    out = io.BytesIO()
+    out.write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+    next_number = [3]
+
+    def number() -> int:
+        next_number[0] += 1
+        return next_number[0] - 1
+
+    def write(num: int, body: bytes, stream: bytes = None):
+        out.write(f"{num} 0 obj\n".encode() + body)
+        if stream is not None:
+            out.write(b"\nstream\n" + stream + b"\nendstream")
+        out.write(b"\nendobj\n")
+
+    write(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+    font = number()
+    write(font, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    branches = [list(range(start, min(start + 50, pages))) for start in range(0, pages, 50)]
+    branch_numbers = [number() for _ in branches]
+    packed = []
+    for branch_number, branch in zip(branch_numbers, branches):
+        kids = []
+        for page in branch:
+            content = zlib.compress(page_content(rng, page, bool(color_every) and page % color_every == 0))
+            content_number = number()
+            write(content_number, f"<< /Length {len(content)} /Filter /FlateDecode >>".encode(), content)
+            xobject = b""
+            if image_bytes:
+                image_number = number()
+                write(image_number, f"<< /Type /XObject /Subtype /Image /Width 1240 /Height 1754 /ColorSpace /DeviceGray "
+                                    f"/BitsPerComponent 8 /Filter /DCTDecode /Length {image_bytes} >>".encode(),
+                      os.urandom(image_bytes))
+                xobject = f" /XObject << /Im1 {image_number} 0 R >>".encode()
+            width, height = sizes[page % len(sizes)]
+            page_number = number()
+            body = (f"<< /Type /Page /Parent {branch_number} 0 R /MediaBox [0 0 {width} {height}] "
+                    f"/Resources << /Font << /F1 {font} 0 R >>".encode() + xobject +
+                    f" >> /Contents {content_number} 0 R >>".encode())
+            if object_streams:
+                packed.append((page_number, body))
+            else:
+                write(page_number, body)
+            kids.append(page_number)
+        refs = " ".join(f"{kid} 0 R" for kid in kids)
+        write(branch_number, f"<< /Type /Pages /Parent 2 0 R /Kids [{refs}] /Count {len(kids)} >>".encode())
+    refs = " ".join(f"{branch} 0 R" for branch in branch_numbers)
+    write(2, f"<< /Type /Pages /Kids [{refs}] /Count {pages} >>".encode())
+
+    for start in range(0, len(packed), 100):
+        group = packed[start:start + 100]
+        offsets, bodies, offset = [], [], 0
+        for num, body in group:
+            offsets.append(f"{num} {offset}")
+            bodies.append(body)
+            offset += len(body) + 1
+        header = " ".join(offsets).encode() + b"\n"
+        stream = zlib.compress(header + b"\n".join(bodies) + b"\n")
+        write(number(), f"<< /Type /ObjStm /N {len(group)} /First {len(header)} /Filter /FlateDecode "
+                        f"/Length {len(stream)} >>".encode(), stream)
+
+    out.write(f"trailer\n<< /Size {next_number[0]} /Root 1 0 R >>\n%%EOF\n".encode())
+    return out.getvalue()
+
+
+def make_scan(mode: str, dpi: int) -> bytes:
+    img = Image.new(mode, (2480, 3508), "white")  # A4 at 300 DPI
+    out = io.BytesIO()
+    img.save(out, format="JPEG" if mode != "1" else "TIFF", dpi=(dpi, dpi))
+    return out.getvalue()
+
+
+def synthetic_corpus() -> list:
+    return [
+        ("report-a4.pdf", "application/pdf", make_pdf(2000, [A4], color_every=0)),
+        ("brochure-mixed.pdf", "application/pdf", make_pdf(600, [A4, A4, A3], color_every=97)),
+        ("letters-objstm.pdf", "application/pdf", make_pdf(3000, [LETTER], object_streams=True)),
+        ("scanned-book.pdf", "application/pdf", make_pdf(400, [A4], image_bytes=180_000)),
+        ("scan-color.jpg", "image/jpeg", make_scan("RGB", 300)),
+        ("scan-bw.tif", "image/tiff", make_scan("1", 300)),
+    ]
+
+
+def directory_corpus(path: Path) -> list:
+    corpus = []
+    for file_path in sorted(path.iterdir()):
+        content_type = mimetypes.guess_type(file_path.name)[0] or "application/octet-stream"
+        if file_path.is_file() and file_metadata.is_extractable(content_type):
+            corpus.append((file_path.name, content_type, file_path.read_bytes()))
+    return corpus
+
+
+def describe_sizes(page_sizes: list) -> str:
+    names = [size["name"] or f"{size['width_mm']}x{size['height_mm']}mm" for size in page_sizes]
+    return ", ".join(f"{size['pages']} {name}" for size, name in zip(page_sizes, names)) or "-"
+
+
+def run(corpus: list):
+    print("=" * 100)
+    print(f"📄 Metadata extraction benchmark ({file_metadata.METADATA_WORKERS} pool workers)")
+    print("=" * 100)
+    print(f"{'file':<22}{'size':>10}{'pages':>8}  {'paper':<22}{'colour':<8}{'ms':>9}{'MB/s':>9}{'pages/s':>10}")
+
+    total_bytes = total_secs = 0
+    for name, content_type, data in corpus:
+        start = time.perf_counter()
+        metadata = file_metadata.extract_metadata(data, content_type)
+        secs = time.perf_counter() - start
+        total_bytes += len(data)
+        total_secs += secs
+        print(
+            f"{name[:21]:<22}{len(data) / 1e6:>9.2f}M{metadata['page_count']:>8}  "
+            f"{describe_sizes(metadata['page_sizes'])[:21]:<22}{str(metadata['color']):<8}"
+            f"{secs * 1000:>9.1f}{len(data) / secs / 1e6:>9.0f}{metadata['page_count'] / secs:>10.0f}"
+        )
+
+    print("-" * 100)
+    print(f"{'in process':<22}{total_bytes / 1e6:>9.2f}M{'':>40}{total_secs * 1000:>9.1f}{total_bytes / total_secs / 1e6:>9.0f}")
+
+    # The pool pays for shipping each file to a worker, in exchange for keeping the event loop free
+    with ProcessPoolExecutor(max_workers=file_metadata.METADATA_WORKERS) as pool:
+        list(pool.map(file_metadata.extract_metadata, [b"%PDF"], ["application/pdf"]))  # start the workers
+        start = time.perf_counter()
+        list(pool.map(file_metadata.extract_metadata, [data for _, _, data in corpus], [ct for _, ct, _ in corpus]))
+        secs = time.perf_counter() - start
+    print(f"{'process pool':<22}{total_bytes / 1e6:>9.2f}M{'':>40}{secs * 1000:>9.1f}{total_bytes / secs / 1e6:>9.0f}")
+
+
+if __name__ == "__main__":
+    run(directory_corpus(Path(sys.argv[1])) if len(sys.argv) > 1 else synthetic_corpus())
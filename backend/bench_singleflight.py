@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Load test for single-flight coalescing on shared links
+Simulates a share link posted to a group: N customers open the public view and
+download at the same moment, against a fake Supabase/storage backend with
+realistic latency. Reports how many backend lookups each wave caused, with and
+without coalescing.
+
+Usage:
+    python bench_singleflight.py              # 1, 10, 50, 200 concurrent viewers
+    python bench_singleflight.py 500 1000     # custom wave sizes
+"""
+
+import asyncio
+import sys
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone, timedelta
+
+import httpx
+
+import server
+
+DB_LATENCY_SECONDS = 0.05
+STORAGE_LATENCY_SECONDS = 0.15
+FILE_BYTES = 2 * 1024 * 1024
+
+backend_calls = Counter()
+
+
+class FakeResult:
+    def __init__(self, data):
+        self.data = data
+        self.count = len(data)
+
+
+class FakeQuery:
+    """Just enough of the postgrest builder for the share-link paths"""
+
+    def __init__(self, rows: list, table: str):
+        self.rows = rows
+        self.table = table
+        self.filters = {}
+        self.updates = None
+
+    def select(self, *args, **kwargs):
+        return self
+
+    def update(self, data):
+        self.updates = data
+        return self
+
+    def eq(self, column, value):
+        self.filters[column] = value
+        return self
+
+    def execute(self):
+        matches = [row for row in self.rows if all(row.get(k) == v for k, v in self.filters.items())]
+        if self.updates is not None:
+            for row in matches:
+                row.update(self.updates)
+            return FakeResult(matches)
+        backend_calls[f"db:{self.table}"] += 1
+        time.sleep(DB_LATENCY_SECONDS)
+        return FakeResult([dict(row) for row in matches])
+
+
+class FakeRpc:
+    """record_share_view, the only function the share-link paths call"""
+
+    def __init__(self, tables: dict, name: str, params: dict):
+        self.tables = tables
+        self.name = name
+        self.params = params
+
+    def execute(self):
+        if self.name != "record_share_view":
+            raise NotImplementedError(self.name)
+        for row in self.tables.get("documents", []):
+            if row["id"] == self.params["p_document_id"]:
+                if row.get("one_time_view") and row.get("share_view_count"):
+                    return FakeResult([])
+                row["share_view_count"] = (row.get("share_view_count") or 0) + 1
+                return FakeResult([dict(row)])
+        return FakeResult([])
+
+
+class FakeSupabase:
+    def __init__(self, tables: dict):
+        self.tables = tables
+
+    def table(self, name):
+        return FakeQuery(self.tables.setdefault(name, []), name)
+
+    def rpc(self, name, params=None):
+        return FakeRpc(self.tables, name, params or {})
+
+
+class FakeObjectStorage:
+    def __init__(self, objects: dict):
+        self.objects = objects
+
+    def get(self, key):
+        backend_calls["storage:get"] += 1
+        time.sleep(STORAGE_LATENCY_SECONDS)
+        return self.objects[key]
+
+
+def install_fake_backend() -> str:
+    share_link = str(uuid.uuid4())
+    storage_key = f"blobs/{uuid.uuid4().hex}"
+    server.supabase_client = FakeSupabase({
+        "documents": [{
+            "id": str(uuid.uuid4()),
+            "user_id": str(uuid.uuid4()),
+            "document_name": "menu.pdf",
+            "document_type": "application/pdf",
+            "file_storage_key": storage_key,
+            "shared_link": share_link,
+            "share_link_expires_at": (datetime.now(timezone.utc) + timedelta(hours=1)).isoformat(),
+            "share_view_count": 0,
+            "one_time_view": False,
+            "status": "active"
+        }]
+    })
+    server.blob_store.objects = FakeObjectStorage({storage_key: b"%PDF" + bytes(FILE_BYTES)})
+    return share_link
+
+
+async def wave(client: httpx.AsyncClient, share_link: str, viewers: int) -> tuple[Counter, float]:
+    backend_calls.clear()
+
+    async def viewer():
+        view = await client.get(f"/api/documents/public/{share_link}")
+        download = await client.get(f"/api/documents/download/{share_link}")
+        assert view.status_code == 200 and download.status_code == 200
+
+    started = time.perf_counter()
+    await asyncio.gather(*(viewer() for _ in range(viewers)))
+    return Counter(backend_calls), time.perf_counter() - started
+
+
+async def run(waves: list, coalesce: bool):
+    share_link = install_fake_backend()
+    lookup = server.db_get_document_by_share_link
+    fetch = server.blob_store._fetch
+    if not coalesce:
+        server.db_get_document_by_share_link = lookup.__wrapped__
+        server.blob_store._fetch = lambda key: asyncio.to_thread(server.blob_store._get_object, key)
+
+    print(f"\n{'with' if coalesce else 'without'} single-flight")
+    print(f"{'viewers':>8}{'doc lookups':>13}{'storage gets':>14}{'wall time':>11}")
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for viewers in waves:
+            calls, elapsed = await wave(client, share_link, viewers)
+            print(f"{viewers:>8}{calls['db:documents']:>13}{calls['storage:get']:>14}{elapsed:>10.2f}s")
+
+    server.db_get_document_by_share_link = lookup
+    server.blob_store._fetch = fetch
+
+
+if __name__ == "__main__":
+    waves = [int(arg) for arg in sys.argv[1:]] or [1, 10, 50, 200]
+    print("=" * 46)
+    print("🔗 Shared-link load test (view + download per viewer)")
+    print("=" * 46)
+    asyncio.run(run(waves, coalesce=True))
+    asyncio.run(run(waves, coalesce=False))
@@ -0,0 +1,431 @@
+"""
+Content-addressed blob storage for uploaded documents.
+
+Uploads are hashed (SHA-256) while they stream in. Identical content is stored
+once under `blobs/{sha256}` in the documents bucket and shared between document
+rows through a reference count, so storage bytes and write bandwidth scale with
+unique content instead of upload count.
+
+Compressible content is stored zstd-compressed under `blobs/{sha256}.zst`; the
+suffix tells readers to decompress, so no metadata lookup is needed on download.
+
+With a cipher (STORAGE_ENCRYPTION_KEY) every object written, sidecars included,
+is sealed in AES-GCM chunks after compression (see encryption.py). Reads decrypt
+chunk by chunk as they stream, and a byte range of an uncompressed blob fetches
+and decrypts only the chunks that cover it.
+"""
+import asyncio
+import hashlib
+import logging
+from collections import Counter
+from dataclasses import dataclass
+from typing import AsyncIterator, Iterator, Optional
+
+import compression
+from circuit_breaker import CircuitOpenError, is_outage_error
+from encryption import HEADER_SIZE, SEALED_CONTENT_TYPE, ChunkCipher, ChunkReader, DecryptionError, is_sealed
+from singleflight import SingleFlight
+
+BLOB_PREFIX = "blobs/"
+READ_CHUNK_SIZE = 1024 * 1024  # 1MB
+REMOVE_BATCH_SIZE = 1000  # keys per storage remove call (S3 DeleteObjects maximum)
+ACQUIRE_RETRY_SECONDS = 0.2  # wait while the object of the same content is being removed
+
+
+class BlobTooLargeError(Exception):
+    """Raised when an upload exceeds the allowed size while streaming"""
+
+
+@dataclass
+class StoredBlob:
+    sha256: str
+    storage_key: str
+    size_bytes: int
+    deduplicated: bool
+
+
+def blob_key(sha256: str, compressed: bool = False) -> str:
+    """Storage key for a content hash"""
+    suffix = compression.COMPRESSED_SUFFIX if compressed else ""
+    return f"{BLOB_PREFIX}{sha256}{suffix}"
+
+
+def is_compressed_key(storage_key: str) -> bool:
+    return storage_key.startswith(BLOB_PREFIX) and storage_key.endswith(compression.COMPRESSED_SUFFIX)
+
+
+def _sha256_from_key(storage_key: str) -> str:
+    return storage_key[len(BLOB_PREFIX):].split(".", 1)[0]
+
+
+def sidecar_key(storage_key: str, name: str) -> str:
+    """Key for a derived object (e.g. a thumbnail) stored next to a blob"""
+    if is_compressed_key(storage_key):
+        storage_key = storage_key[:-len(compression.COMPRESSED_SUFFIX)]
+    return f"{storage_key}.{name}"
+
+
+def _missing_object(storage_key: str, error: Exception) -> None:
+    """A failed read: None when the object is missing (the caller answers 404), raising when storage is failing"""
+    if isinstance(error, CircuitOpenError) or is_outage_error(error):
+        raise error
+    logging.warning(f"Object {storage_key} not readable from object storage: {error}")
+    return None
+
+
+async def hash_upload(file, max_bytes: int) -> tuple[str, int]:
+    """Stream an UploadFile through SHA-256, enforcing the size limit as it reads"""
+    digest = hashlib.sha256()
+    size = 0
+    await file.seek(0)
+    while True:
+        chunk = await file.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > max_bytes:
+            raise BlobTooLargeError(f"Upload exceeds {max_bytes} bytes")
+        digest.update(chunk)
+    return digest.hexdigest(), size
+
+
+class BlobStore:
+    """Reference-counted blob store on object storage with in-memory fallback
+
+    Reference counts live in Supabase (blobs table) when a client is given,
+    else in mock_db["blobs"]; objects live in `objects` (Supabase Storage or
+    S3), else in mock_db["files"].
+    """
+
+    def __init__(self, supabase_client, objects, mock_db: dict, sidecar_names: tuple = (),
+                 cipher: Optional[ChunkCipher] = None):
+        self.supabase = supabase_client
+        self.objects = objects
+        self.sidecar_names = sidecar_names
+        self.cipher = cipher
+        self.files = mock_db.setdefault("files", {})
+        self.blobs = mock_db.setdefault("blobs", {})
+        # Concurrent reads of the same object (a share link opened by a whole group) share one download
+        self.fetches = SingleFlight("blob_fetch")
+
+    # -------------------- reference counts --------------------
+
+    async def _acquire(self, sha256: str, storage_key: str, size_bytes: int) -> tuple[int, str, bool]:
+        """Take a reference on a blob: (new reference count, stored key, whether its object is written)
+
+        The object of a blob whose first upload is still in progress is not
+        written yet. While the object of an unreferenced blob with the same
+        content is being removed no reference is taken: this waits for the
+        removal to finish, so the object this upload writes is not deleted by
+        it. With Supabase configured the reference counts live only there and
+        any failure propagates: counts kept in this process would disagree with
+        the other workers' and free objects still referenced.
+        """
+        if self.supabase:
+            while True:
+                result = self.supabase.rpc('acquire_blob', {
+                    "p_sha256": sha256,
+                    "p_storage_key": storage_key,
+                    "p_size_bytes": size_bytes
+                }).execute()
+                if result.data:
+                    row = result.data[0]
+                    return int(row['ref_count']), row['storage_key'], bool(row['stored'])
+                await asyncio.sleep(ACQUIRE_RETRY_SECONDS)
+
+        while self.blobs.get(sha256, {}).get("deleting"):
+            await asyncio.sleep(ACQUIRE_RETRY_SECONDS)
+        record = self.blobs.setdefault(sha256, {
+            "sha256": sha256,
+            "storage_key": storage_key,
+            "size_bytes": size_bytes,
+            "ref_count": 0,
+            "stored": False
+        })
+        record["ref_count"] += 1
+        return record["ref_count"], record["storage_key"], record["stored"]
+
+    async def _mark_stored(self, sha256: str):
+        """Record that a blob's object has been written, so later uploads can share it"""
+        if self.supabase:
+            try:
+                self.supabase.table('blobs').update({"stored": True}).eq('sha256', sha256).execute()
+            except Exception as e:
+                # The object is written either way; later uploads of it just write it again
+                logging.error(f"Marking blob {sha256[:12]} stored failed: {e}")
+            return
+        record = self.blobs.get(sha256)
+        if record:
+            record["stored"] = True
+
+    async def _release_ref(self, storage_key: str) -> int:
+        """Drop a reference on a blob, returning the remaining reference count
+
+        At zero the blob is marked deleting until _finish_removal, after its
+        object has been removed.
+        """
+        if self.supabase:
+            result = self.supabase.rpc('release_blob', {"p_storage_key": storage_key}).execute()
+            return int(result.data or 0)
+
+        sha256 = _sha256_from_key(storage_key)
+        record = self.blobs.get(sha256)
+        if not record:
+            return 0
+        record["ref_count"] -= 1
+        if record["ref_count"] <= 0:
+            record["deleting"] = True
+            return 0
+        return record["ref_count"]
+
+    async def _release_refs(self, storage_keys: list[str]) -> list[str]:
+        """Drop one reference per listed key (keys may repeat), returning the keys left unreferenced"""
+        if self.supabase:
+            result = self.supabase.rpc('release_blobs', {"p_storage_keys": storage_keys}).execute()
+            return list(result.data or [])
+
+        unreferenced = []
+        for storage_key, refs in Counter(storage_keys).items():
+            record = self.blobs.get(_sha256_from_key(storage_key))
+            if record:
+                record["ref_count"] -= refs
+                if record["ref_count"] > 0:
+                    continue
+                record["deleting"] = True
+            unreferenced.append(storage_key)
+        return unreferenced
+
+    async def _finish_removal(self, storage_keys: list[str]):
+        """Forget unreferenced blobs whose objects have been removed, so new uploads of their content can store them"""
+        if self.supabase:
+            try:
+                self.supabase.rpc('finish_blob_removal', {"p_storage_keys": storage_keys}).execute()
+            except Exception as e:
+                # acquire_blob takes over a removal left unfinished after a few minutes
+                logging.error(f"Finishing removal of {len(storage_keys)} blobs failed: {e}")
+            return
+        for storage_key in storage_keys:
+            record = self.blobs.get(_sha256_from_key(storage_key))
+            if record and record.get("deleting"):
+                del self.blobs[record["sha256"]]
+
+    # -------------------- object I/O --------------------
+
+    def _put_object(self, storage_key: str, content: bytes, content_type: Optional[str]):
+        if self.cipher:
+            content = self.cipher.seal_bytes(content)
+            content_type = SEALED_CONTENT_TYPE
+        if self.objects:
+            # Failures propagate: a write kept in this process would vanish with it
+            self.objects.put(storage_key, content, content_type)
+        else:
+            self.files[storage_key] = content
+
+    def _get_object(self, storage_key: str) -> Optional[bytes]:
+        if not self.objects:
+            return self.files.get(storage_key)
+        try:
+            return self.objects.get(storage_key)
+        except Exception as e:
+            return _missing_object(storage_key, e)
+
+    def _get_object_range(self, storage_key: str, start: int, end: int) -> Optional[bytes]:
+        """Bytes [start, end) of a stored object"""
+        if not self.objects:
+            content = self.files.get(storage_key)
+            return content[start:end] if content is not None else None
+        try:
+            return self.objects.get_range(storage_key, start, end)
+        except Exception as e:
+            return _missing_object(storage_key, e)
+
+    def _iter_stored(self, content: bytes) -> Iterator[bytes]:
+        """The stored bytes of an object, decrypted chunk by chunk when it is sealed"""
+        if is_sealed(content):
+            if self.cipher is None:
+                raise DecryptionError("Object is encrypted but STORAGE_ENCRYPTION_KEY is not set")
+            return self.cipher.iter_open(content, group=max(1, READ_CHUNK_SIZE // self.cipher.chunk_size))
+        return (content[offset:offset + READ_CHUNK_SIZE] for offset in range(0, len(content), READ_CHUNK_SIZE))
+
+    def _open(self, content: bytes) -> bytes:
+        """The stored bytes of a whole object, decrypted when sealed"""
+        return b"".join(self._iter_stored(content)) if is_sealed(content) else content
+
+    async def _fetch(self, storage_key: str) -> Optional[bytes]:
+        """Download an object off the event loop, coalescing identical concurrent fetches"""
+        return await self.fetches.do(storage_key, asyncio.to_thread, self._get_object, storage_key)
+
+    def _remove_objects(self, storage_keys: list[str]):
+        if not self.objects:
+            for key in storage_keys:
+                self.files.pop(key, None)
+            return
+        if storage_keys:
+            try:
+                self.objects.remove(storage_keys)
+            except CircuitOpenError:
+                raise
+            except Exception as e:
+                # Logged, not retried: the references are already dropped, so a retry would drop them again
+                logging.error(f"Failed to remove from object storage: {e}")
+
+    # -------------------- public API --------------------
+
+    async def put(self, file, max_bytes: int) -> StoredBlob:
+        """Store an UploadFile, writing its bytes only if the content is new"""
+        sha256, size = await hash_upload(file, max_bytes)
+
+        sample = []
+        for offset in compression.probe_offsets(size):
+            await file.seek(offset)
+            sample.append(await file.read(compression.PROBE_WINDOW))
+        compress = compression.should_compress(file.content_type, sample)
+
+        ref_count, storage_key, stored = await self._acquire(sha256, blob_key(sha256, compress), size)
+        if stored:
+            logging.info(f"Deduplicated upload {sha256[:12]} ({size} bytes, {ref_count} refs)")
+            return StoredBlob(sha256, storage_key, size, deduplicated=True)
+
+        # New content, or content whose first upload has not finished writing it: write it too
+        # (the same bytes under the same key), so this document never points at a missing object
+        await file.seek(0)
+        content = await file.read()
+        content_type = file.content_type
+        if is_compressed_key(storage_key):
+            content = await asyncio.to_thread(compression.compress, content)
+            content_type = compression.COMPRESSED_CONTENT_TYPE
+            logging.info(f"Compressed blob {sha256[:12]}: {size} -> {len(content)} bytes")
+        try:
+            # Off the event loop, so concurrent uploads write to storage in parallel
+            await asyncio.to_thread(self._put_object, storage_key, content, content_type)
+        except Exception:
+            await self.release(storage_key)
+            raise
+        await self._mark_stored(sha256)
+        return StoredBlob(sha256, storage_key, size, deduplicated=False)
+
+    async def adopt(self, staging_key: str, sha256: str, size: int) -> StoredBlob:
+        """Turn an object uploaded directly to storage into a blob (server-side copy only)"""
+        ref_count, storage_key, stored = await self._acquire(sha256, blob_key(sha256), size)
+        if not stored:
+            try:
+                if self.cipher:
+                    # Sealing needs the bytes, so encrypted stores give up the server-side copy
+                    content = await asyncio.to_thread(self.objects.get, staging_key)
+                    await asyncio.to_thread(self._put_object, storage_key, content, None)
+                else:
+                    await asyncio.to_thread(self.objects.copy, staging_key, storage_key)
+            except Exception:
+                # Keep the staged object so the completion can be retried
+                await self.release(storage_key)
+                raise
+            await self._mark_stored(sha256)
+        await asyncio.to_thread(self._remove_objects, [staging_key])
+
+        if stored:
+            logging.info(f"Deduplicated direct upload {sha256[:12]} ({size} bytes, {ref_count} refs)")
+        return StoredBlob(sha256, storage_key, size, deduplicated=stored)
+
+    async def read(self, storage_key: str) -> Optional[bytes]:
+        """Fetch the full (decrypted, decompressed) content for a storage key"""
+        content = await self._fetch(storage_key)
+        if content is None:
+            return None
+        content = await asyncio.to_thread(self._open, content)
+        if is_compressed_key(storage_key):
+            return compression.decompress(content)
+        return content
+
+    async def stream(self, storage_key: str) -> Optional[AsyncIterator[bytes]]:
+        """Open a storage key for streaming, decrypting and decompressing chunk by chunk"""
+        content = await self._fetch(storage_key)
+        if content is None:
+            return None
+
+        async def chunks():
+            stored = self._iter_stored(content)
+            if is_compressed_key(storage_key):
+                stored = compression.iter_decompress(ChunkReader(stored) if is_sealed(content) else content)
+            for chunk in stored:
+                yield chunk
+
+        return chunks()
+
+    def supports_ranges(self, storage_key: Optional[str]) -> bool:
+        """Whether stream_range can serve part of this blob (compressed blobs are read whole)"""
+        return bool(storage_key) and not is_compressed_key(storage_key)
+
+    async def stream_range(self, storage_key: str, start: int, end: int) -> Optional[AsyncIterator[bytes]]:
+        """Open bytes [start, end) of an uncompressed blob, fetching only the sealed chunks that cover them"""
+        span, header, first_index = None, None, 0
+        if self.cipher:
+            head = await asyncio.to_thread(self._get_object_range, storage_key, 0, HEADER_SIZE)
+            if head is None:
+                return None
+            if is_sealed(head):
+                header = self.cipher.open_header(head)
+                span_start, span_end, first_index = header.sealed_span(start, end)
+                span = await asyncio.to_thread(self._get_object_range, storage_key, span_start, span_end)
+        if header is None:
+            # No encryption, or an object stored before it was enabled
+            span = await asyncio.to_thread(self._get_object_range, storage_key, start, end)
+        if span is None:
+            return None
+
+        async def chunks():
+            if header is None:
+                for offset in range(0, len(span), READ_CHUNK_SIZE):
+                    yield span[offset:offset + READ_CHUNK_SIZE]
+                return
+            group = max(1, READ_CHUNK_SIZE // header.chunk_size)
+            for chunk in self.cipher.open_span(header, span, first_index, start, end, group):
+                yield chunk
+
+        return chunks()
+
+    async def put_sidecar(self, storage_key: str, name: str, content: bytes, content_type: str):
+        """Store a derived object next to a blob; it is removed together with the blob"""
+        await asyncio.to_thread(self._put_object, sidecar_key(storage_key, name), content, content_type)
+
+    async def read_sidecar(self, storage_key: str, name: str) -> Optional[bytes]:
+        """Fetch a derived object stored next to a blob"""
+        content = await self._fetch(sidecar_key(storage_key, name))
+        return await asyncio.to_thread(self._open, content) if content is not None else None
+
+    async def release(self, storage_key: Optional[str]):
+        """Drop a document's reference, deleting the object once unreferenced"""
+        if not storage_key:
+            return
+        if storage_key.startswith(BLOB_PREFIX):
+            if await self._release_ref(storage_key) > 0:
+                return
+        # Unreferenced blob, or a legacy per-document key
+        await asyncio.to_thread(
+            self._remove_objects, [storage_key] + [sidecar_key(storage_key, name) for name in self.sidecar_names]
+        )
+        if storage_key.startswith(BLOB_PREFIX):
+            await self._finish_removal([storage_key])
+
+    async def release_many(self, storage_keys: list[Optional[str]]) -> int:
+        """Drop the references of many documents at once, returning how many objects were removed
+
+        One reference-count call for the whole list and storage removals in
+        batches of REMOVE_BATCH_SIZE keys, instead of a round trip of each per
+        document. A key appears once per document that referenced it.
+        """
+        keys = [key for key in storage_keys if key]
+        unreferenced = [key for key in set(keys) if not key.startswith(BLOB_PREFIX)]
+        blob_keys = [key for key in keys if key.startswith(BLOB_PREFIX)]
+        if blob_keys:
+            unreferenced += await self._release_refs(blob_keys)
+
+        removals = [
+            key for storage_key in unreferenced
+            for key in [storage_key] + [sidecar_key(storage_key, name) for name in self.sidecar_names]
+        ]
+        for start in range(0, len(removals), REMOVE_BATCH_SIZE):
+            await asyncio.to_thread(self._remove_objects, removals[start:start + REMOVE_BATCH_SIZE])
+        removed_blobs = [key for key in unreferenced if key.startswith(BLOB_PREFIX)]
+        if removed_blobs:
+            await self._finish_removal(removed_blobs)
+        return len(unreferenced)
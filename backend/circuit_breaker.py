@@ -0,0 +1,252 @@
+"""
+Circuit breakers for the Supabase database and the object storage.
+
+Each dependency gets its own breaker that tracks the failure rate of recent
+calls in a sliding time window. Once enough calls fail the breaker opens and
+every call fails immediately with CircuitOpenError (the API answers 503) instead
+of waiting out a network timeout. While open, a background probe checks the
+dependency; when a probe succeeds the breaker goes half-open and lets a few
+trial calls through, closing again if they succeed.
+
+Only outage-like errors (timeouts, connection failures, 5xx) count as failures;
+a constraint violation or a 404 means the dependency is up.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Optional
+
+BREAKER_FAILURE_RATE = float(os.getenv('BREAKER_FAILURE_RATE', '0.5'))
+BREAKER_MIN_CALLS = int(os.getenv('BREAKER_MIN_CALLS', '5'))
+BREAKER_WINDOW_SECONDS = float(os.getenv('BREAKER_WINDOW_SECONDS', '30'))
+BREAKER_OPEN_SECONDS = float(os.getenv('BREAKER_OPEN_SECONDS', '10'))
+BREAKER_PROBE_INTERVAL_SECONDS = float(os.getenv('BREAKER_PROBE_INTERVAL_SECONDS', '5'))
+BREAKER_HALF_OPEN_CALLS = int(os.getenv('BREAKER_HALF_OPEN_CALLS', '2'))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """A dependency's breaker is open; the call was not attempted"""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"{name} is unavailable (circuit open)")
+        self.name = name
+        self.retry_after = retry_after
+
+
+def is_outage_error(exc: BaseException) -> bool:
+    """Whether an exception means the dependency is unreachable or failing"""
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+    name = type(exc).__name__
+    if "Timeout" in name or "Connect" in name or name in ("RemoteProtocolError", "NetworkError"):
+        return True
+    status = getattr(exc, "status_code", None) or getattr(exc, "status", None)
+    response = getattr(exc, "response", None)
+    if status is None and isinstance(response, dict):
+        status = response.get("ResponseMetadata", {}).get("HTTPStatusCode")  # botocore ClientError
+    elif status is None and response is not None:
+        status = getattr(response, "status_code", None)
+    if status is None:
+        status = getattr(exc, "code", None)  # postgrest APIError carries the HTTP status for gateway errors
+        if isinstance(status, str):
+            # A five-character SQLSTATE (23505, ...) is a rejected statement, not an HTTP status
+            status = int(status) if status.isdigit() and len(status) == 3 else None
+    try:
+        return int(status) >= 500
+    except (TypeError, ValueError):
+        return False
+
+
+class CircuitBreaker:
+    """Failure-rate circuit breaker with background recovery probes"""
+
+    def __init__(
+        self,
+        name: str,
+        failure_rate: float = BREAKER_FAILURE_RATE,
+        min_calls: int = BREAKER_MIN_CALLS,
+        window_seconds: float = BREAKER_WINDOW_SECONDS,
+        open_seconds: float = BREAKER_OPEN_SECONDS,
+        probe_interval: float = BREAKER_PROBE_INTERVAL_SECONDS,
+        half_open_calls: int = BREAKER_HALF_OPEN_CALLS
+    ):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window_seconds = window_seconds
+        self.open_seconds = open_seconds
+        self.probe_interval = probe_interval
+        self.half_open_calls = half_open_calls
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.counters = {"calls": 0, "failures": 0, "rejected": 0, "opened": 0}
+        self._outcomes: deque = deque()  # (monotonic time, failed)
+        self._trials = 0
+        self._lock = threading.Lock()
+        self._probe: Optional[Callable[[], object]] = None
+        self._probe_task: Optional[asyncio.Task] = None
+
+    # ---------- state ----------
+
+    def _trim(self, now: float):
+        while self._outcomes and self._outcomes[0][0] < now - self.window_seconds:
+            self._outcomes.popleft()
+
+    def _open(self, now: float):
+        if self.state != OPEN:
+            self.counters["opened"] += 1
+            logging.error(f"Circuit '{self.name}' opened - failing fast until it recovers")
+        self.state = OPEN
+        self.opened_at = now
+        self._trials = 0
+
+    def _close(self):
+        logging.info(f"Circuit '{self.name}' closed - dependency recovered")
+        self.state = CLOSED
+        self._outcomes.clear()
+        self._trials = 0
+
+    def before_call(self):
+        """Admit a call or raise CircuitOpenError"""
+        with self._lock:
+            now = time.monotonic()
+            # Without a probe task, fall back to letting a trial through after open_seconds
+            if self.state == OPEN and self._probe_task is None and now - self.opened_at >= self.open_seconds:
+                self.state = HALF_OPEN
+            if self.state == OPEN or (self.state == HALF_OPEN and self._trials >= self.half_open_calls):
+                self.counters["rejected"] += 1
+                retry_after = max(self.open_seconds - (now - self.opened_at), 1)
+                raise CircuitOpenError(self.name, retry_after)
+            if self.state == HALF_OPEN:
+                self._trials += 1
+            self.counters["calls"] += 1
+
+    def record(self, failed: bool):
+        with self._lock:
+            now = time.monotonic()
+            if failed:
+                self.counters["failures"] += 1
+            if self.state == HALF_OPEN:
+                if failed:
+                    self._open(now)
+                else:
+                    self._close()
+                return
+            self._outcomes.append((now, failed))
+            self._trim(now)
+            failures = sum(1 for _, f in self._outcomes if f)
+            if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.failure_rate:
+                self._open(now)
+
+    def call(self, fn: Callable, *args, **kwargs):
+        """Run a blocking call through the breaker"""
+        self.before_call()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            self.record(is_outage_error(e))
+            raise
+        self.record(False)
+        return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._trim(time.monotonic())
+            window = len(self._outcomes)
+            failures = sum(1 for _, f in self._outcomes if f)
+        return {
+            "state": self.state,
+            "windowCalls": window,
+            "windowFailureRate": round(failures / window, 3) if window else 0.0,
+            **self.counters
+        }
+
+    # ---------- background probes ----------
+
+    async def _probe_loop(self):
+        while True:
+            await asyncio.sleep(self.probe_interval)
+            if self.state != OPEN or time.monotonic() - self.opened_at < self.open_seconds:
+                continue
+            try:
+                await asyncio.to_thread(self._probe)
+            except Exception as e:
+                with self._lock:
+                    self.opened_at = time.monotonic()
+                logging.warning(f"Circuit '{self.name}' probe failed: {e}")
+                continue
+            with self._lock:
+                if self.state == OPEN:
+                    self.state = HALF_OPEN
+                    self._trials = 0
+            logging.info(f"Circuit '{self.name}' probe succeeded - half-open")
+
+    def start_probing(self, probe: Callable[[], object]):
+        """Start the health probe task (called from the app lifespan)"""
+        self._probe = probe
+        self._probe_task = asyncio.create_task(self._probe_loop())
+
+    def stop_probing(self):
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            self._probe_task = None
+
+
+class GuardedSupabase:
+    """Supabase client proxy whose query `.execute()` calls go through a breaker"""
+
+    def __init__(self, target, breaker: CircuitBreaker):
+        self._target = target
+        self._breaker = breaker
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if name == "execute":
+            return lambda *args, **kwargs: self._breaker.call(attr, *args, **kwargs)
+        if callable(attr):
+            # Query builder methods return the next builder; keep proxying the chain
+            return lambda *args, **kwargs: GuardedSupabase(attr(*args, **kwargs), self._breaker)
+        if hasattr(attr, "execute"):
+            # Builders reached through a property (e.g. `.not_`) are part of the chain too
+            return GuardedSupabase(attr, self._breaker)
+        return attr
+
+
+class GuardedObjectStorage:
+    """Object storage backend whose network calls go through a breaker"""
+
+    def __init__(self, objects, breaker: CircuitBreaker):
+        self.objects = objects
+        self.breaker = breaker
+
+    def put(self, key: str, content: bytes, content_type: Optional[str]):
+        self.breaker.call(self.objects.put, key, content, content_type)
+
+    def get(self, key: str) -> bytes:
+        return self.breaker.call(self.objects.get, key)
+
+    def get_range(self, key: str, start: int, end: int) -> bytes:
+        return self.breaker.call(self.objects.get_range, key, start, end)
+
+    def remove(self, keys: list[str]):
+        self.breaker.call(self.objects.remove, keys)
+
+    def copy(self, source_key: str, dest_key: str):
+        self.breaker.call(self.objects.copy, source_key, dest_key)
+
+    def verify(self, key: str, size_bytes: int, sha256_hex: str) -> bool:
+        return self.breaker.call(self.objects.verify, key, size_bytes, sha256_hex)
+
+    def probe(self):
+        self.objects.probe()
+
+    def presign_put(self, *args, **kwargs) -> dict:
+        # Signing is local; no call to the storage service
+        return self.objects.presign_put(*args, **kwargs)
@@ -0,0 +1,114 @@
+"""
+Transparent zstd compression for stored blobs.
+
+Whether a blob is compressed is decided per content type: formats that are
+already compressed (JPEG, PNG, ZIP, ...) are skipped outright, formats known to
+compress well (text, BMP/TIFF scans) are always compressed, and everything else
+(PDF, DOCX, unknown) goes through a cheap incompressibility probe on a sample.
+"""
+import io
+import logging
+import os
+from typing import Iterator, Optional
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+    logging.warning("zstandard not installed - blob compression disabled")
+
+COMPRESSION_ENABLED = os.getenv('BLOB_COMPRESSION', 'on').lower() not in ('0', 'off', 'false', 'no')
+COMPRESSION_LEVEL = int(os.getenv('BLOB_COMPRESSION_LEVEL', '3'))
+COMPRESSED_SUFFIX = ".zst"
+COMPRESSED_CONTENT_TYPE = "application/zstd"
+
+PROBE_WINDOW = 16 * 1024
+PROBE_MIN_SAVING = 0.10  # compress only if the sample shrinks by at least 10%
+STREAM_CHUNK_SIZE = 256 * 1024
+
+# Per-content-type policy: "always", "never" or "probe" (the default)
+CONTENT_TYPE_POLICY = {
+    "text/": "always",
+    "application/json": "always",
+    "application/xml": "always",
+    "application/postscript": "always",
+    "image/bmp": "always",
+    "image/x-ms-bmp": "always",
+    "image/tiff": "always",
+    "image/svg+xml": "always",
+    "image/jpeg": "never",
+    "image/png": "never",
+    "image/gif": "never",
+    "image/webp": "never",
+    "image/heic": "never",
+    "image/heif": "never",
+    "video/": "never",
+    "audio/": "never",
+    "application/zip": "never",
+    "application/gzip": "never",
+    "application/x-7z-compressed": "never",
+    "application/x-rar-compressed": "never",
+    "application/vnd.rar": "never",
+    "application/zstd": "never",
+}
+
+
+def policy_for(content_type: Optional[str]) -> str:
+    """Look up the compression policy for a MIME type (exact match, then prefix)"""
+    content_type = (content_type or "").split(";")[0].strip().lower()
+    if content_type in CONTENT_TYPE_POLICY:
+        return CONTENT_TYPE_POLICY[content_type]
+    for prefix, policy in CONTENT_TYPE_POLICY.items():
+        if prefix.endswith("/") and content_type.startswith(prefix):
+            return policy
+    return "probe"
+
+
+def probe_offsets(size: int) -> list[int]:
+    """Head, middle and tail windows, so a compressible header can't hide an incompressible body"""
+    return sorted({0, max(0, size // 2 - PROBE_WINDOW // 2), max(0, size - PROBE_WINDOW)})
+
+
+def probe_sample(data: bytes) -> list[bytes]:
+    """Build the probe windows from in-memory content"""
+    return [data[offset:offset + PROBE_WINDOW] for offset in probe_offsets(len(data))]
+
+
+def is_compressible(windows: list[bytes]) -> bool:
+    """Probe windows at the fastest level; most of them must save enough space"""
+    compressor = zstandard.ZstdCompressor(level=1)
+    saving = [
+        len(compressor.compress(window)) <= len(window) * (1 - PROBE_MIN_SAVING)
+        for window in windows if window
+    ]
+    return bool(saving) and sum(saving) * 2 > len(saving)
+
+
+def should_compress(content_type: Optional[str], sample: list[bytes]) -> bool:
+    """Decide whether a blob with this type and probe sample gets compressed"""
+    if not COMPRESSION_ENABLED or zstandard is None:
+        return False
+    policy = policy_for(content_type)
+    if policy == "never":
+        return False
+    if policy == "always":
+        return True
+    return is_compressible(sample)
+
+
+def compress(data: bytes) -> bytes:
+    """Compress a whole blob into a single zstd frame"""
+    return zstandard.ZstdCompressor(level=COMPRESSION_LEVEL, write_content_size=True).compress(data)
+
+
+def decompress(data: bytes) -> bytes:
+    """Decompress a whole blob"""
+    return b"".join(iter_decompress(data))
+
+
+def iter_decompress(data, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+    """Decompress a blob (bytes, or a file-like reader of them) incrementally, yielding at most chunk_size bytes at a time"""
+    if zstandard is None:
+        raise RuntimeError("zstandard is required to read compressed blobs")
+    source = io.BytesIO(data) if isinstance(data, (bytes, bytearray, memoryview)) else data
+    return zstandard.ZstdDecompressor().read_to_iter(source, read_size=chunk_size, write_size=chunk_size)
@@ -0,0 +1,224 @@
+"""
+Event-loop diagnostics: a loop-lag watchdog and a sampling CPU profiler.
+
+The watchdog is a heartbeat coroutine that stamps the time every
+LOOP_WATCHDOG_INTERVAL_MS plus a thread that checks the stamp. If the loop goes
+longer than LOOP_LAG_THRESHOLD_MS without running the heartbeat, something is
+blocking it; the thread grabs the loop thread's stack at that moment (the
+culprit, still running) and records it once per stall. Idle cost is one tiny
+callback and one thread wakeup per interval.
+
+The profiler samples thread stacks with sys._current_frames() from a separate
+thread and aggregates them into collapsed stacks ("frame;frame;frame count"),
+the input format of flamegraph.pl, speedscope and inferno. Nothing is sampled
+unless a profile was requested.
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+import uuid
+from collections import Counter, OrderedDict, deque
+from typing import Optional
+
+from starlette.datastructures import Headers
+
+LOOP_WATCHDOG_ENABLED = os.getenv('LOOP_WATCHDOG', 'on').lower() not in ('0', 'off', 'false', 'no')
+LOOP_WATCHDOG_INTERVAL_MS = int(os.getenv('LOOP_WATCHDOG_INTERVAL_MS', '100'))
+LOOP_LAG_THRESHOLD_MS = int(os.getenv('LOOP_LAG_THRESHOLD_MS', '250'))
+PROFILE_DEFAULT_HZ = 100
+PROFILE_MAX_SECONDS = 60
+PROFILE_HEADER = "x-profile"
+STALLS_KEPT = 50
+REQUEST_PROFILES_KEPT = 20
+
+
+def format_frame(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def collapse_stack(frame) -> str:
+    """Root-first, ';'-joined stack of a frame"""
+    frames = []
+    while frame is not None:
+        frames.append(format_frame(frame))
+        frame = frame.f_back
+    return ";".join(reversed(frames))
+
+
+class LoopWatchdog:
+    """Detects callbacks that block the event loop and captures their stacks"""
+
+    def __init__(self, interval_ms: int = LOOP_WATCHDOG_INTERVAL_MS, threshold_ms: int = LOOP_LAG_THRESHOLD_MS):
+        self.interval = interval_ms / 1000
+        self.threshold = threshold_ms / 1000
+        self.stalls: deque = deque(maxlen=STALLS_KEPT)
+        self.max_lag_ms = 0.0
+        self.stall_count = 0
+        self._last_beat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._heartbeat: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    async def _beat(self):
+        while True:
+            now = time.monotonic()
+            lag = now - self._last_beat - self.interval
+            if lag * 1000 > self.max_lag_ms:
+                self.max_lag_ms = lag * 1000
+            self._last_beat = now
+            await asyncio.sleep(self.interval)
+
+    def _watch(self):
+        reported_beat = None
+        while not self._stop.wait(self.interval):
+            last_beat = self._last_beat
+            stalled_for = time.monotonic() - last_beat - self.interval
+            if stalled_for < self.threshold or reported_beat == last_beat:
+                continue
+            # Still inside the stall: the loop thread's current stack is the blocking callback
+            reported_beat = last_beat
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else "<no frame>"
+            self.stall_count += 1
+            self.stalls.append({
+                "at": time.time(),
+                "stalledMs": round(stalled_for * 1000),
+                "stack": stack
+            })
+            logging.warning(f"Event loop blocked for {stalled_for * 1000:.0f}ms+ in:\n{stack}")
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self._heartbeat is not None,
+            "thresholdMs": round(self.threshold * 1000),
+            "maxLagMs": round(self.max_lag_ms, 1),
+            "stalls": self.stall_count
+        }
+
+    def start(self):
+        """Start the heartbeat and watcher thread (called from the app lifespan)"""
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop.clear()
+        self._heartbeat = asyncio.create_task(self._beat())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            self._heartbeat = None
+
+
+class Sampler:
+    """Samples stacks of all threads (except its own) at a fixed rate"""
+
+    def __init__(self, hz: int = PROFILE_DEFAULT_HZ):
+        self.interval = 1 / max(1, min(hz, 1000))
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _run(self):
+        own = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                self.stacks[f"{names.get(thread_id, thread_id)};{collapse_stack(frame)}"] += 1
+            self.samples += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> str:
+        """Stop sampling and return collapsed stacks, most frequent first"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common()) + "\n"
+
+
+class Profiler:
+    """Timed profiles and the per-request profiling results"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.request_profiles: OrderedDict = OrderedDict()
+
+    def busy(self) -> bool:
+        return self.lock.locked()
+
+    async def profile(self, seconds: float, hz: int = PROFILE_DEFAULT_HZ) -> Optional[str]:
+        """Sample every thread for `seconds` while the loop keeps serving; None if a profile is running"""
+        if not self.lock.acquire(blocking=False):
+            return None
+        try:
+            sampler = Sampler(hz)
+            sampler.start()
+            try:
+                await asyncio.sleep(min(seconds, PROFILE_MAX_SECONDS))
+            finally:
+                folded = sampler.stop()
+            return folded
+        finally:
+            self.lock.release()
+
+    def store_request_profile(self, profile_id: str, folded: str):
+        self.request_profiles[profile_id] = folded
+        while len(self.request_profiles) > REQUEST_PROFILES_KEPT:
+            self.request_profiles.popitem(last=False)
+
+
+class RequestProfilingMiddleware:
+    """Profiles a single request when it carries `X-Profile: 1` and a valid admin token
+
+    The profile covers every thread while the request runs (other requests on
+    the same worker included) and is fetched afterwards by the id returned in
+    the X-Profile-Id response header.
+    """
+
+    def __init__(self, app, profiler: Profiler, is_admin):
+        self.app = app
+        self.profiler = profiler
+        self.is_admin = is_admin
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not any(name == b"x-profile" for name, _ in scope["headers"]):
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        if headers.get(PROFILE_HEADER) != "1" or not self.is_admin(headers):
+            await self.app(scope, receive, send)
+            return
+        if not self.profiler.lock.acquire(blocking=False):
+            # Another profile is running; serve the request unprofiled
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = uuid.uuid4().hex
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message["headers"]) + [(b"x-profile-id", profile_id.encode())]
+            await send(message)
+
+        sampler = Sampler(int(headers.get("x-profile-hz", PROFILE_DEFAULT_HZ)))
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            self.profiler.store_request_profile(profile_id, sampler.stop())
+            self.profiler.lock.release()
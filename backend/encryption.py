@@ -0,0 +1,205 @@
+"""
+Chunked AES-GCM encryption at rest for stored objects.
+
+A sealed object is a header followed by fixed-size chunks, each encrypted
+and authenticated on its own, so reading never needs the whole object in
+the clear and a byte range only decrypts (and, with ranged storage reads,
+only fetches) the chunks that cover it:
+
+    header   MAGIC | chunk size u32 | plaintext size u64 | nonce prefix (7) | key nonce (12) | wrapped key (48)
+    chunk i  AES-256-GCM(data key, nonce = prefix | i u32 | last u8, aad = header)  -> chunk + 16-byte tag
+
+Every object is sealed under a fresh random data key, wrapped by the master
+key (STORAGE_ENCRYPTION_KEY, 32 bytes base64) and kept in its header, so
+rotating the master key means rewrapping headers rather than re-encrypting
+content. Documents with identical content share one blob, so a data key
+belongs to a stored object rather than to a document row. The chunk index
+and last-chunk flag in the nonce stop chunks being reordered or an object
+being truncated without failing authentication.
+
+Without STORAGE_ENCRYPTION_KEY objects are stored in the clear; sealed and
+plaintext objects can live side by side (readers check the magic bytes).
+"""
+import base64
+import os
+import struct
+from dataclasses import dataclass
+from typing import Iterable, Iterator, Optional
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+STORAGE_ENCRYPTION_KEY = os.getenv('STORAGE_ENCRYPTION_KEY', '')
+MAGIC = b"BPENC\x00\x01\x00"
+CHUNK_SIZE = 64 * 1024
+TAG_SIZE = 16
+SEALED_CONTENT_TYPE = "application/octet-stream"
+
+_header = struct.Struct(">8sIQ7s12s48s")
+HEADER_SIZE = _header.size
+
+
+class DecryptionError(Exception):
+    """A sealed object could not be authenticated (wrong key, corruption or tampering)"""
+
+
+def is_sealed(content: bytes) -> bool:
+    return content[:len(MAGIC)] == MAGIC
+
+
+def _nonce(prefix: bytes, index: int, last: bool) -> bytes:
+    return prefix + struct.pack(">IB", index, last)
+
+
+@dataclass
+class SealedHeader:
+    raw: bytes
+    chunk_size: int
+    size: int  # plaintext bytes
+    nonce_prefix: bytes
+    aead: AESGCM
+
+    @property
+    def chunk_count(self) -> int:
+        # Empty content is still one (empty, authenticated) chunk
+        return max(1, -(-self.size // self.chunk_size))
+
+    def chunk_offset(self, index: int) -> int:
+        """Offset of a sealed chunk within the object"""
+        return HEADER_SIZE + index * (self.chunk_size + TAG_SIZE)
+
+    @property
+    def sealed_size(self) -> int:
+        return HEADER_SIZE + self.size + self.chunk_count * TAG_SIZE
+
+    def sealed_span(self, start: int, end: int) -> tuple[int, int, int]:
+        """Object byte span [from, to) of the chunks covering plaintext [start, end), and the first chunk's index"""
+        first = start // self.chunk_size
+        last = max(first, (end - 1) // self.chunk_size)
+        return self.chunk_offset(first), min(self.chunk_offset(last + 1), self.sealed_size), first
+
+
+class ChunkReader:
+    """File-like read() over an iterator of byte chunks (for streaming decompression)"""
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self.chunks = iter(chunks)
+        self.buffer = b""
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self.buffer) < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            self.buffer += chunk
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+class ChunkCipher:
+    """Seals and opens objects in independently authenticated AES-GCM chunks"""
+
+    def __init__(self, master_key: bytes, chunk_size: int = CHUNK_SIZE):
+        self.master = AESGCM(master_key)
+        self.chunk_size = chunk_size
+
+    @classmethod
+    def from_env(cls) -> Optional["ChunkCipher"]:
+        """The cipher for STORAGE_ENCRYPTION_KEY, or None when encryption at rest is off"""
+        if not STORAGE_ENCRYPTION_KEY:
+            return None
+        key = base64.b64decode(STORAGE_ENCRYPTION_KEY)
+        if len(key) != 32:
+            raise ValueError("STORAGE_ENCRYPTION_KEY must be 32 bytes, base64-encoded")
+        return cls(key)
+
+    # -------------------- sealing --------------------
+
+    def seal(self, chunks: Iterable[bytes], size: int) -> Iterator[bytes]:
+        """Encrypt content arriving in pieces of any size; yields the header, then one item per sealed chunk"""
+        data_key = AESGCM.generate_key(bit_length=256)
+        nonce_prefix = os.urandom(7)
+        key_nonce = os.urandom(12)
+        wrapped = self.master.encrypt(key_nonce, data_key, MAGIC)
+        header = _header.pack(MAGIC, self.chunk_size, size, nonce_prefix, key_nonce, wrapped)
+        aead = AESGCM(data_key)
+        yield header
+
+        pending = b""  # the start of a chunk carried over to the next piece
+        index = 0
+        sealed = 0
+        for piece in chunks:
+            data = memoryview(pending + piece if pending else piece)
+            offset = 0
+            # The final chunk is sealed after the loop, with the last flag set
+            while len(data) - offset >= self.chunk_size and sealed + self.chunk_size < size:
+                yield aead.encrypt(_nonce(nonce_prefix, index, False), data[offset:offset + self.chunk_size], header)
+                offset += self.chunk_size
+                sealed += self.chunk_size
+                index += 1
+            pending = bytes(data[offset:])
+        if sealed + len(pending) != size:
+            raise ValueError(f"Sealed {sealed + len(pending)} bytes, expected {size}")
+        yield aead.encrypt(_nonce(nonce_prefix, index, True), pending, header)
+
+    def seal_bytes(self, content: bytes) -> bytes:
+        return b"".join(self.seal([content], len(content)))
+
+    # -------------------- opening --------------------
+
+    def open_header(self, raw: bytes) -> SealedHeader:
+        """Parse a header and unwrap its data key"""
+        if len(raw) < HEADER_SIZE or not is_sealed(raw):
+            raise DecryptionError("Not a sealed object")
+        raw = bytes(raw[:HEADER_SIZE])
+        _, chunk_size, size, nonce_prefix, key_nonce, wrapped = _header.unpack(raw)
+        try:
+            data_key = self.master.decrypt(key_nonce, wrapped, MAGIC)
+        except InvalidTag:
+            raise DecryptionError("Data key does not unwrap with the configured master key")
+        return SealedHeader(raw, chunk_size, size, nonce_prefix, AESGCM(data_key))
+
+    def open_chunk(self, header: SealedHeader, index: int, sealed: bytes) -> bytes:
+        try:
+            return header.aead.decrypt(_nonce(header.nonce_prefix, index, index == header.chunk_count - 1), sealed, header.raw)
+        except InvalidTag:
+            raise DecryptionError(f"Chunk {index} failed authentication")
+
+    def open_span(self, header: SealedHeader, span: bytes, first_index: int, start: int = 0,
+                  end: Optional[int] = None, group: int = 1) -> Iterator[bytes]:
+        """Decrypt consecutive sealed chunks starting at chunk first_index, trimmed to plaintext [start, end)
+
+        group: chunks joined per yielded piece, to keep pieces near the caller's read size.
+        """
+        end = header.size if end is None else min(end, header.size)
+        position = first_index * header.chunk_size  # plaintext offset of the current chunk
+        index = first_index
+        offset = 0
+        pieces = []
+        while offset < len(span) and position < end:
+            length = min(header.chunk_size, header.size - position) + TAG_SIZE
+            plain = self.open_chunk(header, index, span[offset:offset + length])
+            pieces.append(plain[max(0, start - position):end - position])
+            position += header.chunk_size
+            offset += length
+            index += 1
+            if len(pieces) >= group:
+                yield b"".join(pieces)
+                pieces = []
+        if pieces:
+            yield b"".join(pieces)
+        if position < end:
+            raise DecryptionError("Sealed object is truncated")
+
+    def iter_open(self, sealed: bytes, group: int = 1) -> Iterator[bytes]:
+        """Decrypt a whole sealed object chunk by chunk"""
+        header = self.open_header(sealed)
+        if header.size == 0:
+            self.open_chunk(header, 0, sealed[HEADER_SIZE:])
+            return
+        yield from self.open_span(header, memoryview(sealed)[HEADER_SIZE:], 0, group=group)
+
+    def open_bytes(self, sealed: bytes) -> bytes:
+        return b"".join(self.iter_open(sealed))
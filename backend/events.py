@@ -0,0 +1,243 @@
+"""
+Per-merchant event push over server-sent events.
+
+EventBus is an in-process pub/sub keyed by merchant id: each open SSE stream is
+a Subscription with a bounded queue, and publish() hands the event to every
+local subscriber of that merchant without blocking the request that caused it.
+A subscriber that falls behind is closed with a final "resync" event so the
+dashboard refetches instead of silently missing updates.
+
+With gunicorn the merchant's stream usually lives on a different worker than
+the request that uploaded the document, so events also fan out through
+Postgres LISTEN/NOTIFY when EVENTS_DATABASE_URL is set (a direct connection
+string, not the REST URL). Every worker LISTENs on one channel and delivers
+notifications from other workers to its own subscribers; its own events were
+already delivered locally. Without it (dev/mock, single worker) events stay in
+process.
+
+Streams end after EVENTS_MAX_STREAM_SECONDS and the browser reconnects, which
+spreads long-lived connections across workers and lets a restarting worker
+drain.
+"""
+import asyncio
+import json
+import logging
+import os
+import uuid
+from datetime import datetime, timezone
+from typing import AsyncIterator, Optional
+
+try:
+    import asyncpg  # optional: cross-worker fan-out
+except ImportError:
+    asyncpg = None
+
+EVENTS_DATABASE_URL = os.getenv('EVENTS_DATABASE_URL', '')
+EVENTS_CHANNEL = "merchant_events"
+EVENTS_HEARTBEAT_SECONDS = int(os.getenv('EVENTS_HEARTBEAT_SECONDS', '15'))
+EVENTS_MAX_STREAM_SECONDS = int(os.getenv('EVENTS_MAX_STREAM_SECONDS', '600'))
+EVENTS_MAX_STREAMS_PER_MERCHANT = int(os.getenv('EVENTS_MAX_STREAMS_PER_MERCHANT', '5'))
+SUBSCRIBER_QUEUE_SIZE = 100
+OUTBOX_SIZE = 1000
+RECONNECT_MAX_SECONDS = 30
+CLIENT_RETRY_MS = 3000
+NOTIFY_MAX_BYTES = 7900  # Postgres rejects NOTIFY payloads of 8000 bytes or more
+
+
+class TooManyStreamsError(Exception):
+    pass
+
+
+def format_sse(event_type: str, data: dict) -> str:
+    return f"event: {event_type}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+class Subscription:
+    """One open event stream of a merchant"""
+
+    def __init__(self, bus: "EventBus", channel: str):
+        self.bus = bus
+        self.channel = channel
+        self.queue: asyncio.Queue = asyncio.Queue(SUBSCRIBER_QUEUE_SIZE)
+        self.closed = False
+
+    def offer(self, event: dict):
+        if self.closed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Too slow to keep up: drop the backlog and tell the client to refetch
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({"type": "resync", "data": {"reason": "lagging"}})
+            self.close()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            if self.queue.full():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+    async def stream(self, heartbeat: float = EVENTS_HEARTBEAT_SECONDS,
+                     max_seconds: float = EVENTS_MAX_STREAM_SECONDS) -> AsyncIterator[str]:
+        """SSE frames for this subscription, with keep-alive comments, until closed or timed out"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + max_seconds
+        try:
+            yield f"retry: {CLIENT_RETRY_MS}\n\n"
+            yield format_sse("ready", {})
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return
+                try:
+                    event = await asyncio.wait_for(self.queue.get(), min(heartbeat, remaining))
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                if event is None:
+                    return
+                yield format_sse(event["type"], event["data"])
+        finally:
+            self.bus.unsubscribe(self)
+
+
+class EventBus:
+    """Merchant-keyed pub/sub with optional Postgres fan-out across workers"""
+
+    def __init__(self, database_url: str = EVENTS_DATABASE_URL):
+        self.database_url = database_url if asyncpg is not None else ""
+        self.worker_id = uuid.uuid4().hex
+        self.subscriptions: dict[str, set] = {}
+        self.counters = {"published": 0, "delivered": 0, "received": 0, "notifyFailed": 0, "dropped": 0}
+        self.connected = False
+        self._outbox: Optional[asyncio.Queue] = None
+        self._tasks: list = []
+
+    # ---------- subscribers ----------
+
+    def subscribe(self, channel: str) -> Subscription:
+        subscribers = self.subscriptions.setdefault(channel, set())
+        if len(subscribers) >= EVENTS_MAX_STREAMS_PER_MERCHANT:
+            raise TooManyStreamsError(channel)
+        subscription = Subscription(self, channel)
+        subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscribers = self.subscriptions.get(subscription.channel)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self.subscriptions[subscription.channel]
+
+    def _deliver(self, channel: str, event: dict):
+        for subscription in list(self.subscriptions.get(channel, ())):
+            subscription.offer(event)
+            self.counters["delivered"] += 1
+
+    # ---------- publishing ----------
+
+    def publish(self, channel: str, event_type: str, data: dict):
+        """Deliver an event to a merchant's streams on every worker; never blocks"""
+        event = {"type": event_type, "data": {**data, "at": datetime.now(timezone.utc).isoformat()}}
+        self.counters["published"] += 1
+        self._deliver(channel, event)
+        if self._outbox is None:
+            return
+        payload = json.dumps({"origin": self.worker_id, "channel": channel, "event": event}, separators=(',', ':'))
+        if len(payload.encode()) > NOTIFY_MAX_BYTES:
+            logging.warning(f"Event {event_type} too large for NOTIFY, delivered locally only")
+            return
+        try:
+            self._outbox.put_nowait(payload)
+        except asyncio.QueueFull:
+            self.counters["dropped"] += 1
+
+    def _on_notify(self, connection, pid, channel, payload):
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            return
+        if message.get("origin") == self.worker_id:
+            return
+        self.counters["received"] += 1
+        self._deliver(message["channel"], message["event"])
+
+    # ---------- Postgres fan-out ----------
+
+    async def _listen(self):
+        backoff = 1
+        while True:
+            connection = None
+            try:
+                connection = await asyncpg.connect(self.database_url)
+                lost = asyncio.Event()
+                connection.add_termination_listener(lambda _: lost.set())
+                await connection.add_listener(EVENTS_CHANNEL, self._on_notify)
+                self.connected = True
+                backoff = 1
+                while not lost.is_set():
+                    try:
+                        await asyncio.wait_for(lost.wait(), EVENTS_HEARTBEAT_SECONDS * 2)
+                    except asyncio.TimeoutError:
+                        # Half-open TCP connections never terminate by themselves
+                        await connection.execute("SELECT 1", timeout=10)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.warning(f"Event listener connection failed: {e}")
+            finally:
+                self.connected = False
+                if connection is not None and not connection.is_closed():
+                    connection.terminate()
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, RECONNECT_MAX_SECONDS)
+
+    async def _send(self):
+        connection = None
+        while True:
+            payload = await self._outbox.get()
+            try:
+                if connection is None or connection.is_closed():
+                    connection = await asyncpg.connect(self.database_url)
+                await connection.execute("SELECT pg_notify($1, $2)", EVENTS_CHANNEL, payload, timeout=10)
+            except asyncio.CancelledError:
+                if connection is not None:
+                    connection.terminate()
+                raise
+            except Exception as e:
+                # Local subscribers already have it; other workers' streams miss this one
+                self.counters["notifyFailed"] += 1
+                logging.warning(f"Event NOTIFY failed: {e}")
+                if connection is not None:
+                    connection.terminate()
+                connection = None
+
+    def stats(self) -> dict:
+        return {
+            **self.counters,
+            "fanout": "postgres" if self.database_url else "local",
+            "connected": self.connected,
+            "streams": sum(len(subscribers) for subscribers in self.subscriptions.values())
+        }
+
+    def start(self):
+        """Start the cross-worker listener and sender (called from the app lifespan)"""
+        if not self.database_url:
+            return
+        self._outbox = asyncio.Queue(OUTBOX_SIZE)
+        self._tasks = [asyncio.create_task(self._listen()), asyncio.create_task(self._send())]
+
+    async def stop(self):
+        """End every open stream and stop the fan-out tasks"""
+        for subscribers in list(self.subscriptions.values()):
+            for subscription in list(subscribers):
+                subscription.close()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._outbox = None
@@ -0,0 +1,366 @@
+"""
+Print-job metadata (page count, paper size, colour) extracted from uploads.
+
+Print shops quote by pages and paper size, so every new document gets a
+small metadata record stored with it. PDFs are scanned for their structure
+rather than rendered: one pass over the file collects the object
+dictionaries (jumping over stream data by /Length, and unpacking compressed
+object streams), the page tree is walked for the page count and each page's
+MediaBox, and the page content streams are inflated only to look for
+non-grey colour operators. Images are opened lazily by PIL, which reads the
+header for the dimensions, DPI and colour mode without decoding pixels.
+
+Extraction runs in a process pool, like preview rendering, so a large PDF
+never blocks the event loop.
+
+The colour value is a hint: "color" when a page paints with a non-grey
+RGB/CMYK colour or contains a colour image, "bw" otherwise (and None when the
+PDF is encrypted and its streams cannot be read). A colour image that only
+holds grey pixels, such as a scan saved as RGB, still counts as colour.
+"""
+import asyncio
+import io
+import logging
+import os
+import re
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Iterator, Optional
+
+from PIL import Image
+
+METADATA_WORKERS = int(os.getenv('METADATA_WORKERS', '2'))
+MAX_COLOR_SCAN_BYTES = 32 * 1024 * 1024  # inflated content stream bytes examined per PDF
+MAX_OBJECT_STREAM_BYTES = 16 * 1024 * 1024  # inflated object stream bytes unpacked per PDF
+PAPER_TOLERANCE_MM = 3
+
+# name -> (short edge, long edge) in millimetres
+PAPER_SIZES = {
+    "A3": (297, 420),
+    "A4": (210, 297),
+    "A5": (148, 210),
+    "Letter": (216, 279),
+    "Legal": (216, 356),
+}
+GREY_IMAGE_MODES = ("1", "L", "LA", "I", "I;16", "F")
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+_object_start = re.compile(rb"(\d+)\s+\d+\s+obj\b")
+_object_body = re.compile(rb"\bstream\r?\n|\bendobj\b")
+_length = re.compile(rb"/Length\s+(\d+)(\s+\d+\s+R)?")
+_ref = re.compile(rb"(\d+)\s+\d+\s+R")
+_number = rb"(-?\d*\.?\d+)"
+_pages_type = re.compile(rb"/Type\s*/Pages\b")
+_page_type = re.compile(rb"/Type\s*/Page\b")
+_catalog_root = re.compile(rb"/Type\s*/Catalog\b.*?/Pages\s+(\d+)\s+\d+\s+R", re.S)
+_media_box = re.compile(rb"/MediaBox\s*\[\s*" + rb"\s+".join([_number] * 4) + rb"\s*\]")
+_kids = re.compile(rb"/Kids\s*\[([^\]]*)\]")
+_count = re.compile(rb"/Count\s+(\d+)")
+_contents = re.compile(rb"/Contents\s*(\[[^\]]*\]|\d+\s+\d+\s+R)")
+_object_stream = re.compile(rb"/Type\s*/ObjStm\b")
+_first = re.compile(rb"/First\s+(\d+)")
+_filter = re.compile(rb"/Filter\s*(?:\[([^\]]*)\]|(/\w+))")
+_image = re.compile(rb"/Subtype\s*/Image\b")
+_color_space = re.compile(rb"/DeviceRGB|/DeviceCMYK|/CalRGB|/Lab\b")
+_icc_based = re.compile(rb"/ICCBased\s+(\d+)\s+\d+\s+R")
+_icc_channels = re.compile(rb"/N\s+(\d)\b")
+# operator -> operand count; one literal pattern each, which the regex engine searches for quickly
+_color_ops = [(re.compile(op + rb"\b"), count) for op, count in ((rb"rg", 3), (rb"RG", 3), (rb"k", 4), (rb"K", 4))]
+
+
+def is_extractable(content_type: Optional[str]) -> bool:
+    """Whether metadata can be extracted for this MIME type"""
+    content_type = (content_type or "").lower()
+    return content_type == "application/pdf" or (content_type.startswith("image/") and content_type != "image/svg+xml")
+
+
+def paper_size(width_mm: float, height_mm: float) -> dict:
+    """A page size in millimetres, named when it is a standard paper size (either orientation)"""
+    short, long = sorted((width_mm, height_mm))
+    name = next((
+        name for name, (paper_short, paper_long) in PAPER_SIZES.items()
+        if abs(short - paper_short) <= PAPER_TOLERANCE_MM and abs(long - paper_long) <= PAPER_TOLERANCE_MM
+    ), None)
+    return {"name": name, "width_mm": round(width_mm), "height_mm": round(height_mm)}
+
+
+def _tally_sizes(sizes: list) -> list:
+    """Distinct page sizes with how many pages have each, most common first"""
+    counts = {}
+    for size in sizes:
+        key = (size["name"], size["width_mm"], size["height_mm"])
+        counts[key] = counts.get(key, 0) + 1
+    return [
+        {"name": name, "width_mm": width, "height_mm": height, "pages": pages}
+        for (name, width, height), pages in sorted(counts.items(), key=lambda item: -item[1])
+    ]
+
+
+# -------------------- PDF --------------------
+
+def _inflate(head: bytes, stream, limit: int = 0) -> Optional[bytes]:
+    """The decoded bytes of an unfiltered or Flate stream (None for other filters or corrupt data)"""
+    match = _filter.search(head)
+    filters = (match.group(1) or match.group(2)).split() if match else []
+    if not filters:
+        return bytes(stream[:limit] if limit else stream)
+    if filters != [b"/FlateDecode"]:
+        return None
+    try:
+        return zlib.decompressobj().decompress(stream, limit)
+    except zlib.error:
+        return None
+
+
+def _scan_objects(data: bytes) -> Iterator[tuple]:
+    """(object number, dictionary bytes, stream data or None) for every object, in file order
+
+    Stream data is skipped over by its /Length, so binary content is never
+    searched for object boundaries. Objects packed in compressed object
+    streams are yielded after the stream that holds them; object streams are
+    inflated up to MAX_OBJECT_STREAM_BYTES in all, so a small file cannot
+    decompress into gigabytes.
+    """
+    view = memoryview(data)
+    position = 0
+    budget = MAX_OBJECT_STREAM_BYTES
+    while True:
+        start = _object_start.search(data, position)
+        if start is None:
+            return
+        body = _object_body.search(data, start.end())
+        if body is None:
+            return
+        number, head = int(start.group(1)), data[start.end():body.start()]
+        position = body.end()
+        if not body.group().startswith(b"stream"):
+            yield number, head, None
+            continue
+
+        length = _length.search(head)
+        end = position + int(length.group(1)) if length and not length.group(2) else -1
+        if end < 0 or data.find(b"endstream", end, end + 32) < 0:
+            end = data.find(b"endstream", position)  # indirect or wrong /Length
+            if end < 0:
+                return
+        stream = view[position:end]
+        position = end + len(b"endstream")
+        yield number, head, stream
+
+        if _object_stream.search(head) and budget > 0:
+            content = _inflate(head, stream, limit=budget)
+            if content is not None:
+                budget -= len(content)
+                yield from _unpack_object_stream(head, content)
+
+
+def _unpack_object_stream(head: bytes, content: bytes) -> Iterator[tuple]:
+    first = _first.search(head)
+    if content is None or first is None:
+        return
+    first = int(first.group(1))
+    numbers = content[:first].split()
+    pairs = [(int(numbers[i]), int(numbers[i + 1])) for i in range(0, len(numbers) - 1, 2)]
+    for i, (number, offset) in enumerate(pairs):
+        end = pairs[i + 1][1] if i + 1 < len(pairs) else len(content) - first
+        yield number, content[first + offset:first + end], None
+
+
+def _paints_color(content: bytes) -> bool:
+    """Whether a page content stream sets a non-grey RGB or CMYK colour"""
+    # Find the operators first, then read their operands back from just before them
+    for pattern, count in _color_ops:
+        for match in pattern.finditer(content):
+            start = match.start()
+            if start == 0 or not content[start - 1:start].isspace():
+                continue  # the end of a longer word
+            operands = content[max(0, start - 64):start].split()[-count:]
+            try:
+                channels = [float(value) for value in operands[:3]]  # r g b, or c m y of c m y k
+            except ValueError:
+                continue  # an operator-like word inside text
+            if len(operands) == count and max(channels) - min(channels) > 0.02:
+                return True
+    return False
+
+
+def pdf_metadata(data: bytes) -> dict:
+    """Page count, page sizes and colour hint of a PDF, from its structure"""
+    nodes = {}  # page tree node -> (kind, media box, kids, count, content refs); later versions win
+    streams = {}  # object number -> (dictionary, stream data)
+    icc_channels = {}
+    color_images = []  # (ICC profile ref or None) per image painted in colour, or possibly so
+    root = None
+    encrypted = b"/Encrypt" in data[-4096:]
+
+    for number, head, stream in _scan_objects(data):
+        if stream is not None:
+            streams[number] = (head, stream)
+            if _image.search(head):
+                icc = _icc_based.search(head)
+                if _color_space.search(head):
+                    color_images.append(None)
+                elif icc:
+                    color_images.append(int(icc.group(1)))
+            elif b"/XRef" in head and b"/Encrypt" in head:
+                encrypted = True
+            else:
+                channels = _icc_channels.search(head)
+                if channels:
+                    icc_channels[number] = int(channels.group(1))
+            continue
+
+        catalog = _catalog_root.search(head)
+        if catalog:
+            root = int(catalog.group(1))
+            continue
+        kind = "Pages" if _pages_type.search(head) else "Page" if _page_type.search(head) else None
+        if kind is None:
+            continue
+        box = _media_box.search(head)
+        kids = _kids.search(head)
+        count = _count.search(head)
+        contents = _contents.search(head)
+        nodes[number] = (
+            kind,
+            tuple(float(value) for value in box.groups()) if box else None,
+            [int(kid) for kid in _ref.findall(kids.group(1))] if kids else [],
+            int(count.group(1)) if count else 0,
+            [int(ref) for ref in _ref.findall(contents.group(1))] if contents else []
+        )
+
+    if root not in nodes:
+        # No catalog found: take the largest page tree
+        roots = [number for number, node in nodes.items() if node[0] == "Pages"]
+        root = max(roots, key=lambda number: nodes[number][3], default=None)
+
+    # Walk the page tree, inheriting MediaBox from ancestors
+    pages = []
+    stack = [(root, None)] if root is not None else []
+    seen = set()
+    while stack:
+        number, inherited_box = stack.pop()
+        node = nodes.get(number)
+        if node is None or number in seen:
+            continue
+        seen.add(number)
+        kind, box, kids, _, contents = node
+        box = box or inherited_box
+        if kind == "Page":
+            pages.append((box, contents))
+        else:
+            stack.extend((kid, box) for kid in reversed(kids))
+    if not pages:
+        pages = [(node[1], node[4]) for node in nodes.values() if node[0] == "Page"]
+
+    sizes = [
+        paper_size(abs(box[2] - box[0]) * 25.4 / 72, abs(box[3] - box[1]) * 25.4 / 72)
+        for box, _ in pages if box
+    ]
+
+    color = None
+    if not encrypted:
+        color = "color" if any(ref is None or icc_channels.get(ref, 3) > 1 for ref in color_images) else "bw"
+        budget = MAX_COLOR_SCAN_BYTES
+        for _, contents in pages:
+            if color == "color" or budget <= 0:
+                break
+            for ref in contents:
+                if ref not in streams:
+                    continue
+                content = _inflate(*streams[ref], limit=budget)
+                if content is None:
+                    continue
+                budget -= len(content)
+                if _paints_color(content):
+                    color = "color"
+                    break
+
+    return {
+        "kind": "pdf",
+        "page_count": len(pages) or (nodes[root][3] if root in nodes else 0),
+        "page_sizes": _tally_sizes(sizes),
+        "color": color
+    }
+
+
+# -------------------- images --------------------
+
+def image_metadata(data: bytes) -> dict:
+    """Pixel dimensions, DPI, print size and colour mode of an image, from its header"""
+    with Image.open(io.BytesIO(data)) as img:
+        width, height = img.size
+        dpi = img.info.get("dpi")
+        frames = getattr(img, "n_frames", 1)
+        mode = img.mode
+
+    # Files without a real density often say 1 or 0 DPI
+    dpi = (round(float(dpi[0])), round(float(dpi[1]))) if dpi and min(dpi) >= 10 else None
+    sizes = [paper_size(width / dpi[0] * 25.4, height / dpi[1] * 25.4)] * frames if dpi else []
+    return {
+        "kind": "image",
+        "page_count": frames,
+        "page_sizes": _tally_sizes(sizes),
+        "color": "bw" if mode in GREY_IMAGE_MODES else "color",
+        "width_px": width,
+        "height_px": height,
+        "dpi": list(dpi) if dpi else None
+    }
+
+
+def extract_metadata(content: bytes, content_type: str) -> dict:
+    """Metadata record for a stored file (runs inside a pool worker)"""
+    if content_type.lower() == "application/pdf":
+        return pdf_metadata(content)
+    return image_metadata(content)
+
+
+def _camel(key: str) -> str:
+    first, *rest = key.split("_")
+    return first + "".join(part.title() for part in rest)
+
+
+def metadata_response(metadata: Optional[dict]) -> Optional[dict]:
+    """API shape (camelCase) of a stored metadata record"""
+    if not metadata:
+        return None
+    return {
+        _camel(key): [{_camel(k): v for k, v in size.items()} for size in value] if key == "page_sizes" else value
+        for key, value in metadata.items()
+    }
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=METADATA_WORKERS)
+    return _pool
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+async def extract(blob_store, storage_key: str, content_type: str) -> Optional[dict]:
+    """Read a stored file and extract its metadata off the event loop (None if it cannot be read)"""
+    content = await blob_store.read(storage_key)
+    if content is None:
+        return None
+    loop = asyncio.get_running_loop()
+    pool = get_pool()
+    try:
+        return await loop.run_in_executor(pool, extract_metadata, content, content_type)
+    except BrokenProcessPool as e:
+        # A worker died (killed for memory, say): the pool takes no more work, so the next extraction starts a new one
+        logging.warning(f"Metadata extraction failed for {storage_key}, restarting the pool: {e}")
+        if pool is _pool:
+            shutdown_pool()
+        return None
+    except Exception as e:
+        logging.warning(f"Metadata extraction failed for {storage_key}: {e}")
+        return None
@@ -0,0 +1,185 @@
+"""
+HTTP caching and compression for JSON API responses.
+
+An ASGI middleware that buffers JSON responses only (downloads and other
+streamed bodies pass straight through). For GET/HEAD it adds a weak ETag and
+answers a matching If-None-Match with 304, applies the Cache-Control policy of
+the route and compresses the body with brotli or gzip once it is large enough.
+Routes marked static also keep their compressed variants, keyed by ETag, so the
+same payload is compressed only once per worker.
+"""
+import gzip
+import hashlib
+import os
+import re
+from collections import OrderedDict
+from typing import Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli  # optional: enables br for clients that accept it
+except ImportError:
+    brotli = None
+
+COMPRESSION_MIN_BYTES = int(os.getenv('HTTP_COMPRESSION_MIN_BYTES', '1024'))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+STATIC_VARIANT_CACHE_SIZE = 256
+
+DEFAULT_CACHE_CONTROL = "private, no-cache"
+
+# (path pattern, Cache-Control, static) - first match wins; static routes cache compressed variants
+ROUTE_POLICIES = [
+    (r"/api/subscriptions/plans", "public, max-age=3600", True),
+    (r"/api/referrals/my-code", "private, no-cache", False),
+    (r"/api/documents/public/[^/]+", "no-store", False),  # every call counts a view
+    (r"/api/auth/.*", "no-store", False),
+    (r"/api/documents/[^/]+", "private, no-cache", False),
+]
+# Compressed bodies of static routes, keyed by (ETag, encoding); shared by the worker
+_static_variants: OrderedDict[tuple, bytes] = OrderedDict()
+
+_compiled_policies = [(re.compile(f"{pattern}$"), cache_control, static) for pattern, cache_control, static in ROUTE_POLICIES]
+
+
+def policy_for(path: str) -> tuple[str, bool]:
+    """Cache-Control value and static flag for a request path"""
+    for pattern, cache_control, static in _compiled_policies:
+        if pattern.match(path):
+            return cache_control, static
+    return DEFAULT_CACHE_CONTROL, False
+
+
+def make_etag(body: bytes) -> str:
+    # Weak: the same entity is served gzip, brotli or identity
+    return f'W/"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:]
+    return any(tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(","))
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """Pick br or gzip from Accept-Encoding (q=0 disables an encoding)"""
+    accepted = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip()] = quality
+    if brotli is not None and accepted.get("br", 0) > 0:
+        return "br"
+    if accepted.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+
+def cached_variant_bytes() -> int:
+    """Bytes held by the static-route variant cache"""
+    return sum(len(body) for body in _static_variants.values())
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+class ResponseCacheMiddleware:
+    """ETag/304, per-route Cache-Control and compression for JSON responses"""
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_headers = Headers(scope=scope)
+        method = scope["method"]
+        start_message = None
+        body_parts = []
+        passthrough = False
+
+        async def buffered_send(message):
+            nonlocal start_message, passthrough
+            if passthrough:
+                await send(message)
+                return
+
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                content_type = headers.get("content-type", "")
+                # Only whole JSON bodies are handled; streams and files are left alone
+                if not content_type.startswith("application/json") or "content-encoding" in headers:
+                    passthrough = True
+                    await send(message)
+                    return
+                start_message = message
+                return
+
+            if message["type"] == "http.response.body":
+                body_parts.append(message.get("body", b""))
+                if message.get("more_body", False):
+                    return
+                await self._finish(scope, request_headers, method, start_message, b"".join(body_parts), send)
+                return
+
+            await send(message)
+
+        await self.app(scope, receive, buffered_send)
+
+    async def _finish(self, scope, request_headers: Headers, method: str, start_message: dict, body: bytes, send):
+        headers = MutableHeaders(raw=list(start_message["headers"]))
+        status = start_message["status"]
+        cache_control, static = policy_for(scope["path"])
+        cacheable = method in ("GET", "HEAD") and status == 200
+
+        etag = None
+        if cacheable:
+            etag = make_etag(body)
+            headers["ETag"] = etag
+            if "cache-control" not in headers:
+                headers["Cache-Control"] = cache_control
+            if etag_matches(request_headers.get("if-none-match"), etag) and cache_control != "no-store":
+                del headers["content-length"]
+                headers.add_vary_header("Accept-Encoding")
+                await send({"type": "http.response.start", "status": 304, "headers": headers.raw})
+                await send({"type": "http.response.body", "body": b""})
+                return
+
+        headers.add_vary_header("Accept-Encoding")
+        encoding = choose_encoding(request_headers.get("accept-encoding", "")) if len(body) >= self.minimum_size else None
+        if encoding:
+            body = self._compressed(body, encoding, etag if cacheable and static else None)
+            headers["Content-Encoding"] = encoding
+        headers["Content-Length"] = str(len(body))
+
+        await send({"type": "http.response.start", "status": status, "headers": headers.raw})
+        await send({"type": "http.response.body", "body": b"" if method == "HEAD" else body})
+
+    def _compressed(self, body: bytes, encoding: str, etag: Optional[str]) -> bytes:
+        if etag is None:
+            return compress(body, encoding)
+        key = (etag, encoding)
+        variant = _static_variants.get(key)
+        if variant is None:
+            variant = compress(body, encoding)
+            _static_variants[key] = variant
+            if len(_static_variants) > STATIC_VARIANT_CACHE_SIZE:
+                _static_variants.popitem(last=False)
+        else:
+            _static_variants.move_to_end(key)
+        return variant
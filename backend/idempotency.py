@@ -0,0 +1,273 @@
+"""
+Idempotency keys for non-repeatable POSTs (uploads, payment orders and checks).
+
+A client that may retry sends the same Idempotency-Key header with every
+attempt. The first attempt takes a lock on the key and runs; its response, if
+successful, is stored for IDEMPOTENCY_TTL_SECONDS and replayed to every retry
+(with Idempotent-Replayed: true) without running the endpoint again. An attempt
+that arrives while the first is still running waits for its result, up to
+IDEMPOTENCY_WAIT_SECONDS, then gets 409. Failed attempts (4xx/5xx, errors,
+disconnects) release the key, so the next retry runs for real.
+
+Keys are scoped to the caller (the merchant from the bearer token), and a key
+reused for a different endpoint gets 422. Locks and responses live in the
+Postgres idempotency_keys table when Supabase is configured, otherwise in a
+local SQLite file shared by every gunicorn worker on the host (like jobs.py).
+A lock held longer than IDEMPOTENCY_LOCK_SECONDS, by a worker that died for
+example, is taken over by the next attempt.
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import time
+from contextlib import closing
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Callable, Optional
+
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+
+IDEMPOTENCY_HEADER = "idempotency-key"
+IDEMPOTENCY_STORE_PATH = Path(os.getenv('IDEMPOTENCY_STORE_PATH', Path(tempfile.gettempdir()) / 'bharatprint-idempotency.sqlite3'))
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv('IDEMPOTENCY_TTL_SECONDS', str(24 * 3600)))
+IDEMPOTENCY_LOCK_SECONDS = int(os.getenv('IDEMPOTENCY_LOCK_SECONDS', '300'))
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv('IDEMPOTENCY_WAIT_SECONDS', '60'))
+IDEMPOTENCY_POLL_SECONDS = 0.2
+MAX_KEY_LENGTH = 255
+PURGE_EVERY = 1000  # requests with a key between purges of expired keys
+
+
+class SqliteIdempotencyStore:
+    """Keys in a local SQLite database (WAL, safe across processes on one host)"""
+
+    def __init__(self, path: Path = IDEMPOTENCY_STORE_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS idempotency_keys (
+                    key TEXT PRIMARY KEY,
+                    fingerprint TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    response TEXT,
+                    locked_until REAL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def begin(self, key: str, fingerprint: str, lock_seconds: int, ttl_seconds: int) -> dict:
+        """Lock a key for a new attempt ({"acquired": True}) or return the attempt holding it"""
+        now = time.time()
+        db = self._connect()
+        try:
+            # IMMEDIATE takes the write lock up front, so two workers never both acquire a key
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute("SELECT * FROM idempotency_keys WHERE key = ?", (key,)).fetchone()
+            live = row is not None and (
+                (row["status"] == "done" and row["expires_at"] > now)
+                or (row["status"] == "in_flight" and row["locked_until"] > now)
+            )
+            if not live:
+                db.execute(
+                    "INSERT OR REPLACE INTO idempotency_keys (key, fingerprint, status, locked_until, expires_at) "
+                    "VALUES (?, ?, 'in_flight', ?, ?)",
+                    (key, fingerprint, now + lock_seconds, now + ttl_seconds)
+                )
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        finally:
+            db.close()
+        if not live:
+            return {"acquired": True}
+        return {
+            "acquired": False,
+            "status": row["status"],
+            "fingerprint": row["fingerprint"],
+            "response": json.loads(row["response"]) if row["response"] else None
+        }
+
+    def complete(self, key: str, response: dict, ttl_seconds: int):
+        with closing(self._connect()) as db:
+            db.execute(
+                "UPDATE idempotency_keys SET status = 'done', response = ?, locked_until = NULL, expires_at = ? WHERE key = ?",
+                (json.dumps(response), time.time() + ttl_seconds, key)
+            )
+
+    def release(self, key: str):
+        with closing(self._connect()) as db:
+            db.execute("DELETE FROM idempotency_keys WHERE key = ? AND status = 'in_flight'", (key,))
+
+    def purge(self) -> int:
+        now = time.time()
+        with closing(self._connect()) as db:
+            return db.execute(
+                "DELETE FROM idempotency_keys WHERE expires_at < ? OR (status = 'in_flight' AND locked_until < ?)",
+                (now, now)
+            ).rowcount
+
+
+class SupabaseIdempotencyStore:
+    """Keys in the Postgres idempotency_keys table (see schema.sql)"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def begin(self, key: str, fingerprint: str, lock_seconds: int, ttl_seconds: int) -> dict:
+        result = self.client.rpc('begin_idempotent_request', {
+            "p_key": key,
+            "p_fingerprint": fingerprint,
+            "p_lock_seconds": lock_seconds,
+            "p_ttl_seconds": ttl_seconds
+        }).execute()
+        return result.data
+
+    def complete(self, key: str, response: dict, ttl_seconds: int):
+        self.client.table('idempotency_keys').update({
+            "status": "done",
+            "response": response,
+            "locked_until": None,
+            "expires_at": (datetime.now(timezone.utc) + timedelta(seconds=ttl_seconds)).isoformat()
+        }).eq('key', key).execute()
+
+    def release(self, key: str):
+        self.client.table('idempotency_keys').delete().eq('key', key).eq('status', 'in_flight').execute()
+
+    def purge(self) -> int:
+        result = self.client.rpc('purge_idempotency_keys').execute()
+        return result.data or 0
+
+
+class IdempotencyMiddleware:
+    """Replays stored responses to retried requests that carry an Idempotency-Key
+
+    paths: the POST routes keys apply to; requests elsewhere, or without the
+    header, pass straight through. caller(headers) names whose key space a
+    request uses; requests it cannot attribute (no valid token) pass through
+    and are rejected by the endpoint.
+    """
+
+    def __init__(self, app, store, paths: tuple, caller: Callable[[Headers], Optional[str]],
+                 ttl_seconds: int = IDEMPOTENCY_TTL_SECONDS, lock_seconds: int = IDEMPOTENCY_LOCK_SECONDS,
+                 wait_seconds: float = IDEMPOTENCY_WAIT_SECONDS):
+        self.app = app
+        self.store = store
+        self.paths = set(paths)
+        self.caller = caller
+        self.ttl_seconds = ttl_seconds
+        self.lock_seconds = lock_seconds
+        self.wait_seconds = wait_seconds
+        self._since_purge = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        client_key = headers.get(IDEMPOTENCY_HEADER)
+        caller = self.caller(headers) if client_key else None
+        if caller is None:
+            await self.app(scope, receive, send)
+            return
+        if len(client_key) > MAX_KEY_LENGTH or not client_key.isprintable():
+            await JSONResponse({"detail": "Invalid Idempotency-Key"}, status_code=400)(scope, receive, send)
+            return
+
+        key = f"{caller}:{client_key}"
+        fingerprint = f"POST {scope['path']}"
+        await self._purge_now_and_then()
+
+        deadline = time.monotonic() + self.wait_seconds
+        while True:
+            try:
+                held = await asyncio.to_thread(self.store.begin, key, fingerprint, self.lock_seconds, self.ttl_seconds)
+            except Exception as e:
+                # Without the store the request still runs, just without protection from duplicates
+                logging.error(f"Idempotency key lookup failed, running without it: {e}")
+                await self.app(scope, receive, send)
+                return
+            if held["acquired"]:
+                break
+            if held["fingerprint"] != fingerprint:
+                await JSONResponse({"detail": "Idempotency-Key was already used for a different request"},
+                                   status_code=422)(scope, receive, send)
+                return
+            if held["status"] == "done":
+                await self._replay(held["response"], scope, receive, send)
+                return
+            # The first attempt is still running: wait for its response (or for it to fail and free the key)
+            if time.monotonic() >= deadline:
+                await JSONResponse({"detail": "A request with this Idempotency-Key is still in progress"},
+                                   status_code=409, headers={"Retry-After": "1"})(scope, receive, send)
+                return
+            await asyncio.sleep(IDEMPOTENCY_POLL_SECONDS)
+
+        await self._run(key, scope, receive, send)
+
+    async def _run(self, key: str, scope, receive, send):
+        """Run the endpoint, storing a successful JSON response under the key and releasing it otherwise"""
+        response = {}
+        body_parts = []
+
+        async def recording_send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["content_type"] = Headers(raw=message["headers"]).get("content-type", "")
+            elif message["type"] == "http.response.body":
+                body_parts.append(message.get("body", b""))
+                if not message.get("more_body", False):
+                    response["complete"] = True
+            await send(message)
+
+        stored = False
+        try:
+            await self.app(scope, receive, recording_send)
+            if response.get("complete") and response["status"] < 400 and response["content_type"].startswith("application/json"):
+                await asyncio.to_thread(self.store.complete, key, {
+                    "status": response["status"],
+                    "content_type": response["content_type"],
+                    "body": b"".join(body_parts).decode()
+                }, self.ttl_seconds)
+                stored = True
+        finally:
+            if not stored:
+                try:
+                    await asyncio.to_thread(self.store.release, key)
+                except Exception as e:
+                    # The lock runs out after lock_seconds anyway
+                    logging.error(f"Releasing idempotency key failed: {e}")
+
+    async def _replay(self, response: dict, scope, receive, send):
+        body = response["body"].encode()
+        await send({
+            "type": "http.response.start",
+            "status": response["status"],
+            "headers": [
+                (b"content-type", response["content_type"].encode()),
+                (b"content-length", str(len(body)).encode()),
+                (b"idempotent-replayed", b"true")
+            ]
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def _purge_now_and_then(self):
+        self._since_purge += 1
+        if self._since_purge < PURGE_EVERY:
+            return
+        self._since_purge = 0
+        try:
+            purged = await asyncio.to_thread(self.store.purge)
+            logging.info(f"Purged {purged} expired idempotency keys")
+        except Exception as e:
+            logging.error(f"Purging idempotency keys failed: {e}")
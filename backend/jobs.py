@@ -0,0 +1,334 @@
+"""
+Durable background job queue for work that does not need to finish before the
+response (stats updates, preview rendering, storage cleanup).
+
+Jobs are rows in a table: the Postgres `jobs` table when Supabase is configured
+(claimed with FOR UPDATE SKIP LOCKED through the claim_jobs RPC), otherwise a
+local SQLite file shared by every gunicorn worker on the host. Each job type is
+registered with its handler, attempt limit and retry delay. A claimed job holds
+a lease; if its worker dies the lease runs out and another worker picks it up.
+Failures are retried with exponential backoff and jobs that run out of attempts
+are moved to the dead-letter state, where they stay until requeued.
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import time
+import uuid
+from contextlib import closing
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Awaitable, Callable, Optional
+
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '2'))
+JOB_QUEUE_PATH = Path(os.getenv('JOB_QUEUE_PATH', Path(tempfile.gettempdir()) / 'bharatprint-jobs.sqlite3'))
+JOB_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', '300'))
+JOB_POLL_INTERVAL_SECONDS = float(os.getenv('JOB_POLL_INTERVAL_SECONDS', '1'))
+MAX_RETRY_DELAY_SECONDS = 3600
+
+
+@dataclass
+class JobType:
+    name: str
+    handler: Callable[[dict], Awaitable[None]]
+    max_attempts: int = 5
+    retry_delay: float = 5  # seconds; doubles after every failed attempt
+    with_job_id: bool = False  # handler(payload, job_id), for handlers that make their effect idempotent per job
+
+
+class UnknownJobTypeError(Exception):
+    """Enqueued a job type that has no registered handler"""
+
+
+class SqliteJobStore:
+    """Jobs in a local SQLite database (WAL, safe across processes on one host)"""
+
+    def __init__(self, path: Path = JOB_QUEUE_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    type TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'queued',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    max_attempts INTEGER NOT NULL,
+                    run_at REAL NOT NULL,
+                    locked_until REAL,
+                    last_error TEXT,
+                    created_at REAL NOT NULL
+                )
+            """)
+            db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_runnable ON jobs(status, run_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def insert(self, job: dict):
+        with closing(self._connect()) as db:
+            db.execute(
+                "INSERT INTO jobs (id, type, payload, max_attempts, run_at, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job["id"], job["type"], json.dumps(job["payload"]), job["max_attempts"], job["run_at"], time.time())
+            )
+
+    def claim(self, limit: int, lease_seconds: int) -> list:
+        now = time.time()
+        db = self._connect()
+        try:
+            # IMMEDIATE takes the write lock up front, so two workers never claim the same row
+            db.execute("BEGIN IMMEDIATE")
+            rows = db.execute(
+                """SELECT * FROM jobs
+                   WHERE (status = 'queued' AND run_at <= ?) OR (status = 'running' AND locked_until < ?)
+                   ORDER BY run_at LIMIT ?""",
+                (now, now, limit)
+            ).fetchall()
+            for row in rows:
+                db.execute(
+                    "UPDATE jobs SET status = 'running', attempts = attempts + 1, locked_until = ? WHERE id = ?",
+                    (now + lease_seconds, row["id"])
+                )
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        finally:
+            db.close()
+        return [
+            {**dict(row), "payload": json.loads(row["payload"]), "attempts": row["attempts"] + 1}
+            for row in rows
+        ]
+
+    def complete(self, job_id: str):
+        with closing(self._connect()) as db:
+            db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def retry(self, job_id: str, run_at: float, error: str):
+        with closing(self._connect()) as db:
+            db.execute(
+                "UPDATE jobs SET status = 'queued', run_at = ?, locked_until = NULL, last_error = ? WHERE id = ?",
+                (run_at, error, job_id)
+            )
+
+    def bury(self, job_id: str, error: str):
+        with closing(self._connect()) as db:
+            db.execute(
+                "UPDATE jobs SET status = 'dead', locked_until = NULL, last_error = ? WHERE id = ?",
+                (error, job_id)
+            )
+
+    def counts(self) -> dict:
+        with closing(self._connect()) as db:
+            return {row["status"]: row["n"] for row in db.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status")}
+
+    def dead_jobs(self, limit: int) -> list:
+        with closing(self._connect()) as db:
+            rows = db.execute(
+                "SELECT id, type, payload, attempts, last_error, created_at FROM jobs WHERE status = 'dead' ORDER BY created_at LIMIT ?",
+                (limit,)
+            ).fetchall()
+        return [{**dict(row), "payload": json.loads(row["payload"])} for row in rows]
+
+    def requeue_dead(self, job_id: Optional[str] = None) -> int:
+        query = "UPDATE jobs SET status = 'queued', attempts = 0, run_at = ? WHERE status = 'dead'"
+        params = [time.time()]
+        if job_id:
+            query += " AND id = ?"
+            params.append(job_id)
+        with closing(self._connect()) as db:
+            return db.execute(query, params).rowcount
+
+
+class SupabaseJobStore:
+    """Jobs in the Postgres `jobs` table (see schema.sql), claimed with SKIP LOCKED"""
+
+    def __init__(self, client):
+        self.client = client
+
+    @staticmethod
+    def _timestamp(epoch: float) -> str:
+        return datetime.fromtimestamp(epoch, timezone.utc).isoformat()
+
+    def insert(self, job: dict):
+        self.client.table('jobs').insert({
+            "id": job["id"],
+            "type": job["type"],
+            "payload": job["payload"],
+            "max_attempts": job["max_attempts"],
+            "run_at": self._timestamp(job["run_at"])
+        }).execute()
+
+    def claim(self, limit: int, lease_seconds: int) -> list:
+        result = self.client.rpc('claim_jobs', {"p_limit": limit, "p_lease_seconds": lease_seconds}).execute()
+        return result.data or []
+
+    def complete(self, job_id: str):
+        self.client.table('jobs').delete().eq('id', job_id).execute()
+
+    def retry(self, job_id: str, run_at: float, error: str):
+        self.client.table('jobs').update({
+            "status": "queued",
+            "run_at": self._timestamp(run_at),
+            "locked_until": None,
+            "last_error": error
+        }).eq('id', job_id).execute()
+
+    def bury(self, job_id: str, error: str):
+        self.client.table('jobs').update({
+            "status": "dead",
+            "locked_until": None,
+            "last_error": error
+        }).eq('id', job_id).execute()
+
+    def counts(self) -> dict:
+        counts = {}
+        for status in ("queued", "running", "dead"):
+            result = self.client.table('jobs').select('id', count='exact').eq('status', status).limit(1).execute()
+            counts[status] = result.count or 0
+        return counts
+
+    def dead_jobs(self, limit: int) -> list:
+        result = self.client.table('jobs').select('id, type, payload, attempts, last_error, created_at')\
+            .eq('status', 'dead').order('created_at').limit(limit).execute()
+        return result.data or []
+
+    def requeue_dead(self, job_id: Optional[str] = None) -> int:
+        query = self.client.table('jobs').update({
+            "status": "queued",
+            "attempts": 0,
+            "run_at": self._timestamp(time.time())
+        }).eq('status', 'dead')
+        if job_id:
+            query = query.eq('id', job_id)
+        result = query.execute()
+        return len(result.data or [])
+
+
+class JobQueue:
+    """Typed job registry plus the worker pool that drains the store"""
+
+    def __init__(
+        self,
+        store,
+        workers: int = JOB_WORKERS,
+        lease_seconds: int = JOB_LEASE_SECONDS,
+        poll_interval: float = JOB_POLL_INTERVAL_SECONDS
+    ):
+        self.store = store
+        self.workers = workers
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.job_types: dict[str, JobType] = {}
+        self.counters = {"enqueued": 0, "succeeded": 0, "retried": 0, "dead": 0}
+        self._tasks: list[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def job(self, name: str, max_attempts: int = 5, retry_delay: float = 5, with_job_id: bool = False):
+        """Decorator registering an async handler(payload) (or handler(payload, job_id)) as a job type"""
+        def register(handler):
+            self.job_types[name] = JobType(name, handler, max_attempts, retry_delay, with_job_id)
+            return handler
+        return register
+
+    async def enqueue(self, name: str, payload: dict, delay_seconds: float = 0) -> str:
+        """Persist a job; it runs after the current request, on any worker"""
+        job_type = self.job_types.get(name)
+        if job_type is None:
+            raise UnknownJobTypeError(name)
+        job = {
+            "id": str(uuid.uuid4()),
+            "type": name,
+            "payload": payload,
+            "max_attempts": job_type.max_attempts,
+            "run_at": time.time() + delay_seconds
+        }
+        await asyncio.to_thread(self.store.insert, job)
+        self.counters["enqueued"] += 1
+        if self._wakeup is not None and not delay_seconds:
+            self._wakeup.set()
+        return job["id"]
+
+    async def _run_job(self, job: dict):
+        job_type = self.job_types.get(job["type"])
+        try:
+            if job_type is None:
+                raise UnknownJobTypeError(job["type"])
+            if job_type.with_job_id:
+                await job_type.handler(job["payload"], job["id"])
+            else:
+                await job_type.handler(job["payload"])
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if job_type is None or job["attempts"] >= job["max_attempts"]:
+                await asyncio.to_thread(self.store.bury, job["id"], error)
+                self.counters["dead"] += 1
+                logging.error(f"Job {job['type']} {job['id']} moved to dead letter after {job['attempts']} attempts: {error}")
+            else:
+                delay = min(job_type.retry_delay * 2 ** (job["attempts"] - 1), MAX_RETRY_DELAY_SECONDS)
+                await asyncio.to_thread(self.store.retry, job["id"], time.time() + delay, error)
+                self.counters["retried"] += 1
+                logging.warning(f"Job {job['type']} {job['id']} failed (attempt {job['attempts']}), retrying in {delay:.0f}s: {error}")
+            return
+        await asyncio.to_thread(self.store.complete, job["id"])
+        self.counters["succeeded"] += 1
+
+    async def _worker(self):
+        while True:
+            try:
+                jobs = await asyncio.to_thread(self.store.claim, 1, self.lease_seconds)
+            except Exception as e:
+                logging.error(f"Job claim failed: {e}")
+                jobs = []
+            if jobs:
+                await self._run_job(jobs[0])
+                continue
+            # Idle: sleep until the poll interval passes or a local enqueue wakes us
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def run_pending(self) -> int:
+        """Drain every runnable job in the calling task (admin trigger / scripts)"""
+        processed = 0
+        while True:
+            jobs = await asyncio.to_thread(self.store.claim, 1, self.lease_seconds)
+            if not jobs:
+                return processed
+            await self._run_job(jobs[0])
+            processed += 1
+
+    async def stats(self) -> dict:
+        return {**self.counters, "workers": len(self._tasks), "jobs": await asyncio.to_thread(self.store.counts)}
+
+    async def dead_jobs(self, limit: int = 50) -> list:
+        return await asyncio.to_thread(self.store.dead_jobs, limit)
+
+    async def requeue_dead(self, job_id: Optional[str] = None) -> int:
+        requeued = await asyncio.to_thread(self.store.requeue_dead, job_id)
+        if requeued and self._wakeup is not None:
+            self._wakeup.set()
+        return requeued
+
+    def start(self):
+        """Start the worker pool (called from the app lifespan)"""
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logging.info(f"Job queue started with {self.workers} workers ({type(self.store).__name__})")
+
+    async def stop(self):
+        """Stop the workers; jobs they were running are picked up again once their lease expires"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
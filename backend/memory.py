@@ -0,0 +1,188 @@
+"""
+Memory accounting for the API workers.
+
+Three views of where memory goes:
+- Gauges: bytes held by the in-process stores (mock file store, cached response
+  variants, buffers) plus the worker's RSS. Always available, computed on read.
+- Per-route peak allocation: while tracemalloc is on, each request records how
+  far traced memory peaked above its starting point. The peak counter is
+  process-wide, so a request that overlaps others reports an upper bound.
+- Snapshot diffs: a background task takes a tracemalloc snapshot every
+  MEMORY_SNAPSHOT_INTERVAL_SECONDS and keeps the top growth by source line
+  compared with the previous one.
+
+tracemalloc slows allocation-heavy code noticeably, so it is off unless
+MEMORY_TRACING is set or an admin switches it on at runtime.
+"""
+import asyncio
+import logging
+import os
+import resource
+import time
+import tracemalloc
+from typing import Callable, Optional
+
+MEMORY_TRACING = os.getenv('MEMORY_TRACING', 'off').lower() in ('1', 'on', 'true', 'yes')
+MEMORY_TRACE_FRAMES = int(os.getenv('MEMORY_TRACE_FRAMES', '1'))
+MEMORY_SNAPSHOT_INTERVAL_SECONDS = int(os.getenv('MEMORY_SNAPSHOT_INTERVAL_SECONDS', '300'))
+SNAPSHOT_TOP_LINES = 25
+
+# Allocations made by tracemalloc itself and the import machinery are noise
+_SNAPSHOT_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+]
+
+
+def rss_bytes() -> int:
+    """Current resident set size of this process"""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # No procfs (macOS): fall back to the high-water mark
+        return peak_rss_bytes()
+
+
+def peak_rss_bytes() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if os.uname().sysname == "Darwin" else peak * 1024
+
+
+def diff_snapshots(old: tracemalloc.Snapshot, new: tracemalloc.Snapshot, limit: int = SNAPSHOT_TOP_LINES) -> list:
+    """Top allocation growth by source line between two snapshots"""
+    return [
+        {
+            "location": str(stat.traceback[0]) if stat.traceback else "?",
+            "sizeDiffBytes": stat.size_diff,
+            "sizeBytes": stat.size,
+            "countDiff": stat.count_diff
+        }
+        for stat in old.compare_to(new, "lineno")[:limit]
+    ]
+
+
+class MemoryAccounting:
+    """Gauges, per-route allocation peaks and periodic snapshot diffs"""
+
+    def __init__(self, snapshot_interval: int = MEMORY_SNAPSHOT_INTERVAL_SECONDS):
+        self.snapshot_interval = snapshot_interval
+        self.gauges: dict[str, Callable[[], int]] = {}
+        self.routes: dict[str, dict] = {}
+        self.last_diff: Optional[dict] = None
+        self._baseline: Optional[tracemalloc.Snapshot] = None
+        self._in_flight = 0
+        self._task: Optional[asyncio.Task] = None
+
+    # ---------- gauges ----------
+
+    def gauge(self, name: str, read: Callable[[], int]):
+        """Register a callable returning the bytes currently held by some cache"""
+        self.gauges[name] = read
+
+    def read_gauges(self) -> dict:
+        values = {"rssBytes": rss_bytes(), "peakRssBytes": peak_rss_bytes()}
+        for name, read in self.gauges.items():
+            try:
+                values[name] = read()
+            except Exception as e:
+                logging.warning(f"Memory gauge {name} failed: {e}")
+        if tracemalloc.is_tracing():
+            values["tracedBytes"], values["tracedPeakBytes"] = tracemalloc.get_traced_memory()
+        return values
+
+    # ---------- tracing ----------
+
+    def set_tracing(self, enabled: bool):
+        if enabled and not tracemalloc.is_tracing():
+            tracemalloc.start(MEMORY_TRACE_FRAMES)
+            self._baseline = self._snapshot()
+            logging.info("tracemalloc started")
+        elif not enabled and tracemalloc.is_tracing():
+            tracemalloc.stop()
+            self._baseline = None
+            logging.info("tracemalloc stopped")
+
+    def _snapshot(self) -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+
+    def snapshot_diff(self) -> Optional[dict]:
+        """Diff a fresh snapshot against the previous one, which it then replaces"""
+        if not tracemalloc.is_tracing():
+            return None
+        started = time.perf_counter()
+        snapshot = self._snapshot()
+        if self._baseline is not None:
+            self.last_diff = {
+                "takenAt": time.time(),
+                "tookMs": round((time.perf_counter() - started) * 1000),
+                "top": diff_snapshots(self._baseline, snapshot)
+            }
+        self._baseline = snapshot
+        return self.last_diff
+
+    def route_stats(self) -> dict:
+        return {
+            route: {**stats, "avgPeakBytes": stats["totalPeakBytes"] // max(stats["requests"], 1)}
+            for route, stats in sorted(self.routes.items(), key=lambda item: -item[1]["maxPeakBytes"])
+        }
+
+    def _record_route(self, route: str, peak: int):
+        stats = self.routes.setdefault(route, {"requests": 0, "maxPeakBytes": 0, "totalPeakBytes": 0})
+        stats["requests"] += 1
+        stats["totalPeakBytes"] += peak
+        stats["maxPeakBytes"] = max(stats["maxPeakBytes"], peak)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.snapshot_interval)
+            if tracemalloc.is_tracing():
+                # Snapshots walk every traced block; keep that off the event loop
+                await asyncio.to_thread(self.snapshot_diff)
+
+    def start(self):
+        """Start tracing if configured and the periodic snapshot task (called from the app lifespan)"""
+        if MEMORY_TRACING:
+            self.set_tracing(True)
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+class MemoryAccountingMiddleware:
+    """Records the traced-memory peak of each request under its route template
+
+    Long-lived streams (untracked_paths) are skipped: while one is open the
+    shared peak could never be reset for the other requests.
+    """
+
+    def __init__(self, app, accounting: MemoryAccounting, untracked_paths: tuple = ()):
+        self.app = app
+        self.accounting = accounting
+        self.untracked_paths = untracked_paths
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not tracemalloc.is_tracing() or scope["path"].startswith(self.untracked_paths):
+            await self.app(scope, receive, send)
+            return
+
+        accounting = self.accounting
+        start, _ = tracemalloc.get_traced_memory()
+        if accounting._in_flight == 0:
+            # Only reset the shared peak when no other request's measurement depends on it
+            tracemalloc.reset_peak()
+        accounting._in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            accounting._in_flight -= 1
+            if tracemalloc.is_tracing():
+                _, peak = tracemalloc.get_traced_memory()
+                route = scope.get("route")
+                path = getattr(route, "path", None) or scope["path"]
+                accounting._record_route(f"{scope['method']} {path}", max(0, peak - start))
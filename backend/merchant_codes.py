@@ -0,0 +1,146 @@
+"""
+Collision-free merchant (referral) codes.
+
+A merchant code is a sequence number made unguessable and compact:
+
+    BP_ + 8 Crockford base32 characters (a keyed 40-bit permutation of the number) + 1 check character
+
+The permutation is a 4-round Feistel network keyed by MERCHANT_CODE_SECRET, so
+distinct numbers always give distinct codes and no signup has to look for a
+free one; merchant codes appear in public upload links, so consecutive
+merchants do not get consecutive codes. The check character (Luhn mod 32)
+catches any single mistyped character and most swapped pairs before a lookup
+is made. The secret must not change once codes have been issued: a different
+permutation could reissue an existing code.
+
+Numbers come from the merchant_code_seq sequence (schema.sql) a block at a
+time: each worker reserves a block in one round trip and hands codes out
+locally, so workers never share a number. A number is taken only for a new
+merchant whose OTP was right; numbers left in a block when a worker stops are
+simply never used. Codes issued before this scheme (BP_ plus eight digits)
+stay valid.
+"""
+import asyncio
+import hashlib
+import hmac
+import time
+from typing import Awaitable, Callable, Optional
+
+ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"  # Crockford base32: no I, L, O or U
+PREFIX = "BP_"
+NUMBER_BITS = 40
+BODY_LENGTH = NUMBER_BITS // 5
+CODE_LENGTH = len(PREFIX) + BODY_LENGTH + 1
+FEISTEL_ROUNDS = 4
+INDEX_MAX_ENTRIES = 200_000
+INDEX_MAX_AGE_SECONDS = 300
+
+_HALF_BITS = NUMBER_BITS // 2
+_HALF_MASK = (1 << _HALF_BITS) - 1
+_values = {char: value for value, char in enumerate(ALPHABET)}
+
+
+def _luhn_sum(values: list, factor: int) -> int:
+    total = 0
+    for value in reversed(values):
+        addend = factor * value
+        total += addend // len(ALPHABET) + addend % len(ALPHABET)
+        factor = 1 if factor == 2 else 2
+    return total
+
+
+def check_character(body: str) -> str:
+    """Luhn mod 32 check character for a code body"""
+    return ALPHABET[-_luhn_sum([_values[char] for char in body], 2) % len(ALPHABET)]
+
+
+def is_well_formed(code: str) -> bool:
+    """Whether a code could have been issued (new codes must pass their check character)"""
+    if len(code) != CODE_LENGTH or not code.startswith(PREFIX):
+        return code.startswith(PREFIX)  # older codes have no check character
+    values = [_values.get(char) for char in code[len(PREFIX):]]
+    return None not in values and _luhn_sum(values, 1) % len(ALPHABET) == 0
+
+
+class MerchantCodeAllocator:
+    """Turns sequence numbers, reserved a block at a time, into merchant codes"""
+
+    def __init__(self, reserve_block: Callable[[], Awaitable[tuple]], secret: str):
+        """reserve_block returns (first number, block size) of a block no other caller gets"""
+        self.reserve_block = reserve_block
+        self.key = secret.encode()
+        self.next = self.end = 0
+        self.lock = asyncio.Lock()
+
+    def _round(self, index: int, half: int) -> int:
+        digest = hmac.new(self.key, bytes([index]) + half.to_bytes(4, "big"), hashlib.sha256).digest()
+        return int.from_bytes(digest[:4], "big") & _HALF_MASK
+
+    def encode(self, number: int) -> str:
+        """The code for a sequence number"""
+        if not 0 <= number < 1 << NUMBER_BITS:
+            raise ValueError(f"Merchant code number {number} out of range")
+        left, right = number >> _HALF_BITS, number & _HALF_MASK
+        for index in range(FEISTEL_ROUNDS):
+            left, right = right, left ^ self._round(index, right)
+        permuted = left << _HALF_BITS | right
+        body = "".join(ALPHABET[permuted >> shift & 31] for shift in range(NUMBER_BITS - 5, -1, -5))
+        return PREFIX + body + check_character(body)
+
+    async def allocate(self) -> str:
+        """A code no merchant has, reserving a new block of numbers when this one runs out"""
+        async with self.lock:
+            if self.next >= self.end:
+                start, size = await self.reserve_block()
+                self.next, self.end = start, start + size
+            number = self.next
+            self.next += 1
+        return self.encode(number)
+
+
+class MerchantCodeIndex:
+    """Merchant code -> user record, filled as merchants sign up or are looked up
+
+    Codes never change hands, so a lookup by code is answered from here
+    without a query. Records are shared, so callers treat them as read-only.
+    The entry of a user updated in this process is dropped (forget_user), and
+    entries older than max_age seconds are dropped on lookup, so changes made
+    through other workers show within that time.
+    """
+
+    def __init__(self, max_entries: int = INDEX_MAX_ENTRIES, max_age: float = INDEX_MAX_AGE_SECONDS):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.users: dict[str, tuple[float, dict]] = {}  # code -> (monotonic time added, user)
+        self.codes: dict[str, str] = {}  # user id -> code
+
+    def get(self, code: str) -> Optional[dict]:
+        entry = self.users.get(code)
+        if entry is None:
+            return None
+        added, user = entry
+        if time.monotonic() - added > self.max_age:
+            self.remove(code)
+            return None
+        return user
+
+    def add(self, user: Optional[dict]):
+        code = user.get("referral_code") if user else None
+        if not code or not user.get("id"):
+            return
+        self.users.pop(code, None)
+        self.users[code] = (time.monotonic(), user)
+        self.codes[user["id"]] = code
+        if len(self.users) > self.max_entries:
+            self.remove(next(iter(self.users)))  # the oldest entry
+
+    def remove(self, code: str):
+        entry = self.users.pop(code, None)
+        if entry is not None:
+            self.codes.pop(entry[1]["id"], None)
+
+    def forget_user(self, user_id: str):
+        """Drop a user's entry after the user was changed"""
+        code = self.codes.pop(user_id, None)
+        if code is not None:
+            self.users.pop(code, None)
@@ -0,0 +1,84 @@
+-- Convert an existing (unpartitioned) documents table to the daily-partitioned
+-- layout of schema.sql. Run once in the Supabase SQL Editor, after creating
+-- documents_archive, document_search_vector and the DOCUMENT PARTITIONS
+-- functions from schema.sql and during a quiet period: the copy holds a lock on
+-- documents until it commits.
+
+BEGIN;
+
+LOCK TABLE documents IN ACCESS EXCLUSIVE MODE;
+
+-- Columns added since the table was introduced, so the copy below has them
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS content_sha256 CHAR(64);
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS file_metadata JSONB;
+
+-- created_at is part of the partition key; rows without one keep a date instead of being lost
+UPDATE documents SET created_at = COALESCE(updated_at, deleted_at, NOW()) WHERE created_at IS NULL;
+
+ALTER TABLE documents RENAME TO documents_unpartitioned;
+-- Old indexes, and any that running the new schema.sql already put on the old table
+DROP INDEX IF EXISTS idx_documents_user;
+DROP INDEX IF EXISTS idx_documents_shared_link;
+DROP INDEX IF EXISTS idx_documents_status;
+DROP INDEX IF EXISTS idx_documents_auto_delete;
+DROP INDEX IF EXISTS idx_documents_user_active;
+DROP INDEX IF EXISTS idx_documents_auto_delete_active;
+DROP INDEX IF EXISTS idx_documents_user_history;
+DROP INDEX IF EXISTS idx_documents_search;
+
+CREATE TABLE documents (
+    LIKE documents_unpartitioned INCLUDING DEFAULTS,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+ALTER TABLE documents ADD FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE;
+
+CREATE TABLE documents_default PARTITION OF documents DEFAULT;
+
+CREATE INDEX idx_documents_user_active ON documents(user_id, created_at DESC) WHERE status = 'active';
+CREATE INDEX idx_documents_shared_link ON documents(shared_link);
+CREATE INDEX idx_documents_auto_delete_active ON documents(auto_delete_at) WHERE status = 'active';
+CREATE INDEX idx_documents_user_history ON documents(user_id, created_at, id);
+CREATE INDEX idx_documents_search ON documents
+    USING GIN (document_search_vector(customer_name, customer_phone, order_details));
+
+-- Partitions for every day that still has documents, then today onwards
+DO $$
+DECLARE
+    v_day DATE;
+BEGIN
+    FOR v_day IN
+        SELECT DISTINCT (created_at AT TIME ZONE 'UTC')::date
+        FROM documents_unpartitioned
+    LOOP
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF documents FOR VALUES FROM (%L) TO (%L)',
+            'documents_' || to_char(v_day, 'YYYYMMDD'),
+            v_day::timestamp AT TIME ZONE 'UTC', (v_day + 1)::timestamp AT TIME ZONE 'UTC'
+        );
+    END LOOP;
+END $$;
+SELECT create_document_partitions();
+
+INSERT INTO documents
+SELECT * FROM documents_unpartitioned;
+
+ALTER TABLE documents ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Users can view own documents" ON documents
+    FOR SELECT USING (auth.uid()::text = user_id::text);
+
+CREATE POLICY "Users can insert own documents" ON documents
+    FOR INSERT WITH CHECK (auth.uid()::text = user_id::text);
+
+CREATE POLICY "Users can update own documents" ON documents
+    FOR UPDATE USING (auth.uid()::text = user_id::text);
+
+CREATE POLICY "Users can delete own documents" ON documents
+    FOR DELETE USING (auth.uid()::text = user_id::text);
+
+CREATE POLICY "Public can view shared documents" ON documents
+    FOR SELECT USING (shared_link IS NOT NULL AND status = 'active');
+
+DROP TABLE documents_unpartitioned;
+
+COMMIT;
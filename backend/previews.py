@@ -0,0 +1,117 @@
+"""
+Thumbnail and preview generation for shared documents.
+
+Renders run in a process pool so PIL decoding never blocks the event loop. The
+JPEG results are cached in storage next to the blob they were made from, which
+lets a share link be shown for a few kilobytes instead of the full download.
+"""
+import asyncio
+import io
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from PIL import Image, ImageOps
+
+try:
+    import fitz  # PyMuPDF, optional: enables first-page renders of PDFs
+except ImportError:
+    fitz = None
+
+PREVIEW_WORKERS = int(os.getenv('PREVIEW_WORKERS', '2'))
+PREVIEW_CONTENT_TYPE = "image/jpeg"
+
+# variant -> (max edge in pixels, JPEG quality)
+VARIANTS = {
+    "thumb": (256, 70),
+    "preview": (1024, 80),
+}
+SIDECAR_NAMES = tuple(f"{variant}.jpg" for variant in VARIANTS)
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def is_previewable(content_type: Optional[str]) -> bool:
+    """Whether a preview can be rendered for this MIME type"""
+    content_type = (content_type or "").lower()
+    if content_type == "application/pdf":
+        return fitz is not None
+    return content_type.startswith("image/") and content_type != "image/svg+xml"
+
+
+def _open_first_page(content: bytes, content_type: str) -> Image.Image:
+    if content_type == "application/pdf":
+        with fitz.open(stream=content, filetype="pdf") as pdf:
+            page = pdf[0]
+            largest = max(size for size, _ in VARIANTS.values())
+            zoom = largest / max(page.rect.width, page.rect.height)
+            pixmap = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+            return Image.frombytes("RGB", (pixmap.width, pixmap.height), pixmap.samples)
+
+    img = Image.open(io.BytesIO(content))
+    # JPEG can decode at 1/2, 1/4 or 1/8 scale directly, much cheaper than a full decode
+    largest = max(size for size, _ in VARIANTS.values())
+    img.draft("RGB", (largest, largest))
+    return ImageOps.exif_transpose(img)
+
+
+def render_previews(content: bytes, content_type: str) -> dict[str, bytes]:
+    """Render every preview variant as JPEG (runs inside a pool worker)"""
+    img = _open_first_page(content, content_type)
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+
+    rendered = {}
+    # Largest first, so each smaller variant is resampled from an already reduced image
+    for variant, (size, quality) in sorted(VARIANTS.items(), key=lambda item: -item[1][0]):
+        img.thumbnail((size, size), Image.Resampling.LANCZOS)
+        buffer = io.BytesIO()
+        img.save(buffer, format="JPEG", quality=quality, optimize=True, progressive=True)
+        rendered[variant] = buffer.getvalue()
+    return rendered
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=PREVIEW_WORKERS)
+    return _pool
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+async def generate_previews(blob_store, storage_key: str, content_type: str, content: Optional[bytes] = None):
+    """Render previews off the event loop and cache them next to the blob
+
+    Content that cannot be rendered (unsupported or corrupt) is logged and
+    skipped, since a retry would fail the same way. Storage and database
+    errors, and a pool whose worker died, propagate so the job is retried.
+    """
+    if content is None:
+        content = await blob_store.read(storage_key)
+        if content is None:
+            logging.warning(f"Blob {storage_key} is gone, skipping its previews")
+            return
+    loop = asyncio.get_running_loop()
+    pool = get_pool()
+    try:
+        rendered = await loop.run_in_executor(pool, render_previews, content, content_type)
+    except BrokenProcessPool:
+        # The next attempt starts a new pool
+        if pool is _pool:
+            shutdown_pool()
+        raise
+    except Exception as e:
+        logging.warning(f"Preview generation failed for {storage_key}: {e}")
+        return
+
+    for variant, image in rendered.items():
+        await blob_store.put_sidecar(storage_key, f"{variant}.jpg", image, PREVIEW_CONTENT_TYPE)
+    logging.info(f"Generated previews for {storage_key} ({', '.join(f'{v}={len(b)}B' for v, b in rendered.items())})")
@@ -0,0 +1,228 @@
+"""
+Read-replica routing for the Supabase (PostgREST) data layer.
+
+SUPABASE_READ_REPLICA_URLS lists the API URLs of read replicas (a Supabase read
+replica has its own API URL). Read-only lookups go round-robin to replicas that
+are healthy; writes, and reads that must see them, use the primary client.
+
+Lag awareness: every REPLICA_LAG_CHECK_SECONDS each replica is asked for its
+replay lag through the replica_lag_seconds() RPC (schema.sql). A replica that is
+more than REPLICA_MAX_LAG_SECONDS behind, or whose check fails, gets no reads
+until it catches up. A read that fails on a replica is retried on the primary,
+and so is a single-row lookup that finds nothing there (the row may simply not
+have been replayed yet).
+
+Read-your-writes: a healthy replica is at most REPLICA_MAX_LAG_SECONDS behind,
+so a session that wrote reads from the primary for that long plus one check
+interval. Within a worker the session is the user id (note_write); across
+workers it is carried by the client: responses to writes set
+X-Read-Primary-Until and the frontend sends it back until it passes
+(ReplicaRoutingMiddleware).
+
+Testing locally: run a Postgres primary and a streaming standby
+(pg_basebackup -R), put PostgREST behind a /rest/v1 proxy in front of each (the
+Supabase client appends that path), apply schema.sql on the primary and point
+SUPABASE_URL and SUPABASE_READ_REPLICA_URLS at the two proxies.
+"""
+import asyncio
+import contextvars
+import logging
+import os
+import threading
+import time
+from typing import Callable, Optional
+
+from starlette.datastructures import Headers
+
+from circuit_breaker import CircuitBreaker, GuardedSupabase
+
+SUPABASE_READ_REPLICA_URLS = [url.strip() for url in os.getenv('SUPABASE_READ_REPLICA_URLS', '').split(',') if url.strip()]
+REPLICA_MAX_LAG_SECONDS = float(os.getenv('REPLICA_MAX_LAG_SECONDS', '2'))
+REPLICA_LAG_CHECK_SECONDS = float(os.getenv('REPLICA_LAG_CHECK_SECONDS', '1'))
+PRIMARY_UNTIL_HEADER = "x-read-primary-until"
+SESSIONS_KEPT = 10000
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+# Set per request by ReplicaRoutingMiddleware: read from the primary until this time (epoch seconds)
+_primary_until: contextvars.ContextVar[float] = contextvars.ContextVar("primary_until", default=0.0)
+
+
+class Replica:
+    """One read replica with its own breaker and last measured lag"""
+
+    def __init__(self, name: str, client):
+        self.name = name
+        self.breaker = CircuitBreaker(f"replica:{name}")
+        self.client = GuardedSupabase(client, self.breaker)
+        self.raw_client = client
+        self.lag_seconds: Optional[float] = None
+        self.healthy = False
+        self.counters = {"reads": 0, "failures": 0, "emptyRetries": 0}
+
+    def stats(self) -> dict:
+        return {
+            "healthy": self.healthy,
+            "lagSeconds": self.lag_seconds,
+            "circuit": self.breaker.state,
+            **self.counters
+        }
+
+
+class ReplicaRouter:
+    """Chooses a replica or the primary for each read"""
+
+    def __init__(self, replicas: list[Replica], max_lag: float = REPLICA_MAX_LAG_SECONDS,
+                 check_interval: float = REPLICA_LAG_CHECK_SECONDS):
+        self.replicas = replicas
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.sticky_seconds = max_lag + check_interval
+        self.counters = {"replicaReads": 0, "primaryReads": 0, "primaryFallbacks": 0}
+        self._writes: dict[str, float] = {}  # session -> monotonic time of its last write
+        self._next = 0
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    # ---------- read-your-writes ----------
+
+    def note_write(self, session: Optional[str]):
+        """Route this session's reads to the primary until replicas have its write"""
+        if not self.replicas or not session:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._writes.pop(session, None)
+            self._writes[session] = now
+            # Re-inserted on every write, so the first entry is the oldest
+            while len(self._writes) > SESSIONS_KEPT or next(iter(self._writes.values())) < now - self.sticky_seconds:
+                del self._writes[next(iter(self._writes))]
+
+    def primary_until(self) -> float:
+        """Epoch time until which a client that just wrote should read from the primary"""
+        return time.time() + self.sticky_seconds
+
+    def wants_primary(self, session: Optional[str]) -> bool:
+        """Whether this read must see the caller's own writes (and so skip replicas)"""
+        if _primary_until.get() > time.time():
+            return True
+        written = self._writes.get(session) if session else None
+        return written is not None and time.monotonic() - written < self.sticky_seconds
+
+    # ---------- routing ----------
+
+    def pick(self, session: Optional[str] = None) -> Optional[Replica]:
+        """A healthy replica for this read, or None to use the primary"""
+        if not self.replicas or self.wants_primary(session):
+            return None
+        with self._lock:
+            for _ in range(len(self.replicas)):
+                replica = self.replicas[self._next % len(self.replicas)]
+                self._next += 1
+                if replica.healthy:
+                    return replica
+        return None
+
+    def read(self, primary, run: Callable, session: Optional[str] = None, retry_empty: bool = False):
+        """Run `run(client)` on a replica when possible, otherwise (or on failure) on the primary
+
+        retry_empty: the query looks up rows that must exist (by id or link), so
+        an empty result from a lagging replica is retried on the primary.
+        """
+        replica = self.pick(session)
+        if replica is not None:
+            try:
+                result = run(replica.client)
+                replica.counters["reads"] += 1
+                if not (retry_empty and not result.data):
+                    self.counters["replicaReads"] += 1
+                    return result
+                replica.counters["emptyRetries"] += 1
+            except Exception as e:
+                replica.counters["failures"] += 1
+                self.counters["primaryFallbacks"] += 1
+                logging.warning(f"Replica {replica.name} read failed, using primary: {e}")
+        self.counters["primaryReads"] += 1
+        return run(primary)
+
+    # ---------- lag checks ----------
+
+    def check_lag(self):
+        """Measure each replica's replay lag and mark it healthy or not (blocking)"""
+        for replica in self.replicas:
+            try:
+                lag = float(replica.raw_client.rpc('replica_lag_seconds').execute().data)
+            except Exception as e:
+                if replica.healthy:
+                    logging.warning(f"Replica {replica.name} lag check failed, taking it out of rotation: {e}")
+                replica.healthy = False
+                replica.lag_seconds = None
+                continue
+            healthy = lag <= self.max_lag
+            if healthy != replica.healthy:
+                logging.info(f"Replica {replica.name} {'back in' if healthy else 'out of'} rotation (lag {lag:.1f}s)")
+            replica.lag_seconds = round(lag, 3)
+            replica.healthy = healthy
+
+    async def _check_loop(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.check_lag)
+            except Exception as e:
+                logging.error(f"Replica lag check failed: {e}")
+            await asyncio.sleep(self.check_interval)
+
+    def stats(self) -> dict:
+        return {
+            **self.counters,
+            "maxLagSeconds": self.max_lag,
+            "replicas": {replica.name: replica.stats() for replica in self.replicas}
+        }
+
+    def start(self):
+        """Start the lag checks (called from the app lifespan); replicas get reads after the first check"""
+        if self.replicas:
+            self._task = asyncio.create_task(self._check_loop())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+class ReplicaRoutingMiddleware:
+    """Carries read-your-writes across workers through the X-Read-Primary-Until header
+
+    Requests with a future X-Read-Primary-Until read from the primary, as do
+    writes (anything but GET/HEAD/OPTIONS), whose successful responses set the
+    header for the client to send back.
+    """
+
+    def __init__(self, app, router: ReplicaRouter):
+        self.app = app
+        self.router = router
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.router.replicas:
+            await self.app(scope, receive, send)
+            return
+
+        primary_until = 0.0
+        try:
+            primary_until = float(Headers(scope=scope).get(PRIMARY_UNTIL_HEADER, 0))
+        except ValueError:
+            pass
+        writes = scope["method"] not in SAFE_METHODS
+        if writes:
+            primary_until = self.router.primary_until()
+        token = _primary_until.set(primary_until)
+
+        async def send_with_header(message):
+            if writes and message["type"] == "http.response.start" and message["status"] < 400:
+                header = f"{self.router.primary_until():.3f}".encode()
+                message["headers"] = list(message["headers"]) + [(PRIMARY_UNTIL_HEADER.encode(), header)]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_header)
+        finally:
+            _primary_until.reset(token)
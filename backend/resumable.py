@@ -0,0 +1,183 @@
+"""
+Resumable chunked uploads (tus 1.0 core protocol, creation/termination/expiration).
+
+Every upload is a spool file on local disk plus a small JSON state file. PATCH
+requests append straight into the spool file at the acknowledged offset, so a
+dropped connection loses only the bytes that never arrived and the client
+resumes from HEAD's Upload-Offset. On completion the spool file itself is handed
+to the blob store; chunks are never reassembled. State lives on disk, so any
+gunicorn worker on the host can serve any request of an upload.
+"""
+import asyncio
+import base64
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import AsyncIterator, Optional
+
+TUS_VERSION = "1.0.0"
+TUS_EXTENSIONS = "creation,termination,expiration"
+UPLOAD_SPOOL_DIR = Path(os.getenv('UPLOAD_SPOOL_DIR', Path(tempfile.gettempdir()) / 'bharatprint-uploads'))
+RESUMABLE_UPLOAD_TTL_SECONDS = int(os.getenv('RESUMABLE_UPLOAD_TTL_SECONDS', str(24 * 3600)))
+
+
+class UploadNotFoundError(Exception):
+    """Unknown or expired upload id"""
+
+
+class UploadConflictError(Exception):
+    """Offset mismatch, or another request is writing the same upload"""
+
+
+class UploadTooLargeError(Exception):
+    """Body would exceed the declared Upload-Length"""
+
+
+def parse_upload_metadata(header: Optional[str]) -> dict:
+    """Decode a tus Upload-Metadata header ("key base64value,key2 base64value2")"""
+    metadata = {}
+    for pair in (header or "").split(","):
+        pair = pair.strip()
+        if not pair:
+            continue
+        key, _, value = pair.partition(" ")
+        metadata[key] = base64.b64decode(value).decode("utf-8") if value else ""
+    return metadata
+
+
+class ResumableUploads:
+    """Disk-backed store of in-progress uploads"""
+
+    def __init__(self, spool_dir: Path = UPLOAD_SPOOL_DIR, ttl_seconds: int = RESUMABLE_UPLOAD_TTL_SECONDS):
+        self.spool_dir = Path(spool_dir)
+        self.ttl_seconds = ttl_seconds
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+
+    def _data_path(self, upload_id: str) -> Path:
+        return self.spool_dir / f"{upload_id}.part"
+
+    def _state_path(self, upload_id: str) -> Path:
+        return self.spool_dir / f"{upload_id}.json"
+
+    def _write_state(self, upload_id: str, state: dict):
+        tmp_path = self.spool_dir / f"{upload_id}.json.tmp"
+        tmp_path.write_text(json.dumps(state))
+        os.replace(tmp_path, self._state_path(upload_id))
+
+    def _valid_id(self, upload_id: str) -> bool:
+        try:
+            return str(uuid.UUID(upload_id)) == upload_id
+        except ValueError:
+            return False
+
+    def create(self, length: int, metadata: dict, owner: dict) -> dict:
+        """Start an upload of `length` bytes"""
+        upload_id = str(uuid.uuid4())
+        self._data_path(upload_id).touch()
+        state = {
+            "id": upload_id,
+            "length": length,
+            "metadata": metadata,
+            "owner": owner,
+            "created_at": time.time(),
+            "expires_at": time.time() + self.ttl_seconds,
+            "result": None
+        }
+        self._write_state(upload_id, state)
+        return state
+
+    def get(self, upload_id: str) -> dict:
+        """Load upload state with the current offset; raises UploadNotFoundError"""
+        if not self._valid_id(upload_id):
+            raise UploadNotFoundError(upload_id)
+        try:
+            state = json.loads(self._state_path(upload_id).read_text())
+            if state.get("result"):
+                state["offset"] = state["length"]
+            else:
+                state["offset"] = self._data_path(upload_id).stat().st_size
+        except (FileNotFoundError, ValueError):
+            raise UploadNotFoundError(upload_id)
+        if state["expires_at"] < time.time() and not state.get("result"):
+            self.terminate(upload_id)
+            raise UploadNotFoundError(upload_id)
+        return state
+
+    async def append(self, upload_id: str, offset: int, chunks: AsyncIterator[bytes]) -> int:
+        """Append a PATCH body at `offset`, returning the new offset
+
+        Bytes are written as they arrive, so if the client disconnects mid-body
+        everything received so far is kept and acknowledged on the next HEAD.
+        """
+        state = self.get(upload_id)
+        with open(self._data_path(upload_id), "ab") as spool:
+            try:
+                fcntl.flock(spool.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise UploadConflictError("Upload is locked by another request")
+
+            current = os.fstat(spool.fileno()).st_size
+            if offset != current:
+                raise UploadConflictError(f"Upload-Offset {offset} does not match current offset {current}")
+
+            # Disk writes and the fsync run in worker threads, off the event loop
+            try:
+                async for chunk in chunks:
+                    if current + len(chunk) > state["length"]:
+                        raise UploadTooLargeError("Body exceeds Upload-Length")
+                    await asyncio.to_thread(spool.write, chunk)
+                    current += len(chunk)
+            finally:
+                await asyncio.to_thread(self._sync, spool)
+        return current
+
+    @staticmethod
+    def _sync(spool):
+        spool.flush()
+        os.fsync(spool.fileno())
+
+    @contextmanager
+    def finishing(self, upload_id: str):
+        """Lock a fully received upload and open its spool file for reading"""
+        with open(self._data_path(upload_id), "rb") as spool:
+            try:
+                fcntl.flock(spool.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise UploadConflictError("Upload is locked by another request")
+            yield spool
+
+    def mark_complete(self, upload_id: str, result: dict):
+        """Record the completion response so repeated completions replay it"""
+        state = self.get(upload_id)
+        state.pop("offset", None)
+        state["result"] = result
+        self._write_state(upload_id, state)
+        # The bytes now live in the blob store
+        self._data_path(upload_id).unlink(missing_ok=True)
+
+    def terminate(self, upload_id: str):
+        """Delete an upload and its spooled bytes"""
+        self._data_path(upload_id).unlink(missing_ok=True)
+        self._state_path(upload_id).unlink(missing_ok=True)
+
+    def purge_expired(self) -> int:
+        """Delete uploads past their expiry; returns how many were removed"""
+        removed = 0
+        now = time.time()
+        for state_path in self.spool_dir.glob("*.json"):
+            try:
+                state = json.loads(state_path.read_text())
+            except (FileNotFoundError, ValueError):
+                continue
+            if state.get("expires_at", 0) < now:
+                self.terminate(state_path.stem)
+                removed += 1
+        if removed:
+            logging.info(f"Purged {removed} expired resumable uploads")
+        return removed
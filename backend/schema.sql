@@ -33,6 +33,18 @@ CREATE INDEX IF NOT EXISTS idx_users_phone ON users(phone_number);
 CREATE INDEX IF NOT EXISTS idx_users_referral_code ON users(referral_code);
 CREATE INDEX IF NOT EXISTS idx_users_subscription ON users(subscription_status);
 
+-- Merchant codes are a keyed permutation of a number from this sequence
+-- (merchant_codes.py), so they never collide. Each API worker reserves a
+-- block of INCREMENT BY numbers at a time and hands them out itself.
+CREATE SEQUENCE IF NOT EXISTS merchant_code_seq INCREMENT BY 100 MINVALUE 0 START WITH 0;
+
+CREATE OR REPLACE FUNCTION reserve_merchant_codes()
+RETURNS JSONB AS $$
+    SELECT jsonb_build_object('start', nextval('merchant_code_seq'), 'size', increment_by)
+    FROM pg_sequences
+    WHERE schemaname = current_schema() AND sequencename = 'merchant_code_seq';
+$$ LANGUAGE sql;
+
 -- ==================== OTP TABLE ====================
 CREATE TABLE IF NOT EXISTS otps (
     id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
@@ -51,15 +63,88 @@ CREATE TABLE IF NOT EXISTS otps (
 CREATE INDEX IF NOT EXISTS idx_otps_phone ON otps(phone_number);
 CREATE INDEX IF NOT EXISTS idx_otps_expires ON otps(expires_at);
 
+-- Verify an OTP and log the user in, in one round trip. The latest live OTP
+-- row is locked, so concurrent attempts for a phone are serialised: a wrong
+-- code counts an attempt, a right one consumes the OTP, and the user is created
+-- (or has last_login bumped) in the same transaction. p_otp_hash is the API's
+-- keyed hash of phone and code; p_otp_code matches the plain dev copy.
+-- p_referral_code is NULL on the first call, so no merchant code is spent on
+-- wrong codes or returning users.
+CREATE OR REPLACE FUNCTION verify_otp_login(
+    p_phone TEXT,
+    p_otp_hash TEXT,
+    p_otp_code TEXT,
+    p_name TEXT,
+    p_referral_code TEXT,
+    p_max_attempts INTEGER DEFAULT 5
+)
+RETURNS JSONB AS $$
+DECLARE
+    v_otp otps%ROWTYPE;
+    v_user users%ROWTYPE;
+    v_user_id UUID;
+    v_new_user BOOLEAN;
+BEGIN
+    SELECT * INTO v_otp
+    FROM otps
+    WHERE phone_number = p_phone AND expires_at > NOW() AND verified_at IS NULL
+    ORDER BY sent_at DESC
+    LIMIT 1
+    FOR UPDATE;
+    
+    IF NOT FOUND THEN
+        RETURN jsonb_build_object('status', 'not_found');
+    END IF;
+    IF v_otp.attempts >= p_max_attempts THEN
+        RETURN jsonb_build_object('status', 'too_many_attempts');
+    END IF;
+    IF v_otp.otp_hash IS DISTINCT FROM p_otp_hash AND v_otp.otp_code IS DISTINCT FROM p_otp_code THEN
+        UPDATE otps SET attempts = attempts + 1 WHERE id = v_otp.id;
+        RETURN jsonb_build_object('status', 'invalid');
+    END IF;
+    
+    -- A new user needs a merchant code, which the API allocates only once the
+    -- OTP is known to be right: it calls again with one, the OTP still unused
+    IF p_referral_code IS NULL AND NOT EXISTS (SELECT 1 FROM users WHERE phone_number = p_phone) THEN
+        RETURN jsonb_build_object('status', 'needs_referral_code');
+    END IF;
+    
+    UPDATE otps SET verified_at = NOW() WHERE id = v_otp.id;
+    
+    -- xmax = 0 only for a freshly inserted row
+    INSERT INTO users (phone_number, owner_name, phone_verified, shop_name, city, referral_code, last_login)
+    VALUES (p_phone, COALESCE(p_name, ''), TRUE, '', '', p_referral_code, NOW())
+    ON CONFLICT (phone_number) DO UPDATE
+        SET last_login = NOW(),
+            owner_name = CASE
+                WHEN COALESCE(users.owner_name, '') = '' AND COALESCE(p_name, '') <> '' THEN p_name
+                ELSE users.owner_name
+            END
+    RETURNING id, (xmax = 0) INTO v_user_id, v_new_user;
+    
+    SELECT * INTO v_user FROM users WHERE id = v_user_id;
+    RETURN jsonb_build_object('status', 'ok', 'is_new_user', v_new_user, 'user', to_jsonb(v_user));
+END;
+$$ LANGUAGE plpgsql;
+
 -- ==================== DOCUMENTS TABLE ====================
+-- Range-partitioned by created_at, one partition per UTC day. Documents live for
+-- minutes, so instead of deleting dead rows one by one (and vacuuming after),
+-- maintain_document_partitions() drops a whole day once none of its documents
+-- are active, keeping a compact copy of each row in documents_archive.
+-- Unique constraints must include the partition key, so the primary key is
+-- (id, created_at) and shared_link (a random UUID) is indexed, not constrained.
+-- Existing installs: run migrate_documents_partitioned.sql.
 CREATE TABLE IF NOT EXISTS documents (
-    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    id UUID NOT NULL DEFAULT uuid_generate_v4(),
     user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
     document_name VARCHAR(255) NOT NULL,
     document_type VARCHAR(100),
     file_size_bytes BIGINT DEFAULT 0,
     file_storage_key VARCHAR(500),
-    shared_link VARCHAR(100) UNIQUE,
+    content_sha256 CHAR(64),
+    file_metadata JSONB, -- page count, paper sizes, colour hint (file_metadata.py)
+    shared_link VARCHAR(100),
     share_link_expires_at TIMESTAMPTZ,
     share_view_count INTEGER DEFAULT 0,
     one_time_view BOOLEAN DEFAULT FALSE,
@@ -74,15 +159,189 @@ CREATE TABLE IF NOT EXISTS documents (
     status VARCHAR(20) DEFAULT 'active', -- 'active', 'deleted', 'expired'
     auto_delete_at TIMESTAMPTZ,
     deleted_at TIMESTAMPTZ,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    updated_at TIMESTAMPTZ DEFAULT NOW(),
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+-- Catches rows for days whose partition was not created in time
+CREATE TABLE IF NOT EXISTS documents_default PARTITION OF documents DEFAULT;
+
+-- Columns added since the table was introduced (existing tables, partitioned or not)
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS content_sha256 CHAR(64);
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS file_metadata JSONB;
+
+-- Indexes for documents (created on every partition). Listing, counting and the
+-- expiry sweep only look at active documents, so those indexes skip dead rows.
+CREATE INDEX IF NOT EXISTS idx_documents_user_active ON documents(user_id, created_at DESC) WHERE status = 'active';
+CREATE INDEX IF NOT EXISTS idx_documents_shared_link ON documents(shared_link);
+CREATE INDEX IF NOT EXISTS idx_documents_auto_delete_active ON documents(auto_delete_at) WHERE status = 'active';
+-- Keyset cursor of the history export (every status, oldest first)
+CREATE INDEX IF NOT EXISTS idx_documents_user_history ON documents(user_id, created_at, id);
+
+-- ==================== DOCUMENT SEARCH ====================
+-- Full-text search over customer name, phone and order details. Words are
+-- matched by prefix ('sharm' finds Sharma) and the phone is indexed as its
+-- digits with and without the country code, so partial numbers match too.
+-- search_index.py is the in-memory equivalent used without Supabase.
+CREATE OR REPLACE FUNCTION document_search_vector(p_name TEXT, p_phone TEXT, p_details TEXT)
+RETURNS tsvector AS $$
+    SELECT to_tsvector('simple',
+        coalesce(p_name, '') || ' ' ||
+        coalesce(regexp_replace(p_phone, '\D', '', 'g'), '') || ' ' ||
+        coalesce(right(regexp_replace(p_phone, '\D', '', 'g'), 10), '') || ' ' ||
+        coalesce(p_details, ''));
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE INDEX IF NOT EXISTS idx_documents_search ON documents
+    USING GIN (document_search_vector(customer_name, customer_phone, order_details));
+
+-- A merchant's active documents matching every word of p_query, newest first
+-- (deleted and expired ones are hidden, as in the documents list)
+CREATE OR REPLACE FUNCTION search_documents(
+    p_user_id UUID,
+    p_query TEXT,
+    p_created_after TIMESTAMPTZ DEFAULT NULL,
+    p_created_before TIMESTAMPTZ DEFAULT NULL,
+    p_limit INTEGER DEFAULT 20
+)
+RETURNS SETOF documents AS $$
+    SELECT d.*
+    FROM documents d
+    WHERE d.user_id = p_user_id
+      AND d.status = 'active'
+      AND document_search_vector(d.customer_name, d.customer_phone, d.order_details) @@ to_tsquery('simple',
+          array_to_string(ARRAY(
+              SELECT word || ':*' FROM regexp_split_to_table(lower(p_query), '[^[:alnum:]]+') AS word WHERE word <> ''
+          ), ' & '))
+      AND (p_created_after IS NULL OR d.created_at >= p_created_after)
+      AND (p_created_before IS NULL OR d.created_at < p_created_before)
+    ORDER BY d.created_at DESC
+    LIMIT p_limit;
+$$ LANGUAGE sql STABLE;
+
+-- Count a view of a shared document. The one-time check and the increment are
+-- one statement, so concurrent viewers cannot both open a one-time document;
+-- no row comes back when the view is refused.
+CREATE OR REPLACE FUNCTION record_share_view(p_document_id UUID)
+RETURNS SETOF documents AS $$
+    UPDATE documents
+    SET share_view_count = COALESCE(share_view_count, 0) + 1
+    WHERE id = p_document_id
+      AND (NOT COALESCE(one_time_view, FALSE) OR COALESCE(share_view_count, 0) = 0)
+    RETURNING *;
+$$ LANGUAGE sql;
+
+-- Compact record of documents whose partition was dropped (no customer details)
+CREATE TABLE IF NOT EXISTS documents_archive (
+    id UUID NOT NULL,
+    user_id UUID NOT NULL,
+    document_type VARCHAR(100),
+    file_size_bytes BIGINT,
+    content_sha256 CHAR(64),
+    share_view_count INTEGER,
+    customer_uploaded BOOLEAN,
+    status VARCHAR(20),
+    created_at TIMESTAMPTZ NOT NULL,
+    deleted_at TIMESTAMPTZ,
+    PRIMARY KEY (id, created_at)
+);
+
+CREATE INDEX IF NOT EXISTS idx_documents_archive_user ON documents_archive(user_id, created_at);
+
+-- ==================== BLOBS TABLE ====================
+-- Content-addressed file storage: identical uploads share one object stored
+-- under blobs/{sha256} (or blobs/{sha256}.zst when zstd-compressed) in the
+-- documents bucket, reference-counted by documents
+CREATE TABLE IF NOT EXISTS blobs (
+    sha256 CHAR(64) PRIMARY KEY,
+    storage_key VARCHAR(500) UNIQUE NOT NULL,
+    size_bytes BIGINT NOT NULL,
+    ref_count INTEGER NOT NULL DEFAULT 0,
+    stored BOOLEAN NOT NULL DEFAULT FALSE, -- set once the first upload has written the object
+    deleting_since TIMESTAMPTZ, -- set while the object of an unreferenced blob is being removed
     created_at TIMESTAMPTZ DEFAULT NOW(),
     updated_at TIMESTAMPTZ DEFAULT NOW()
 );
 
--- Indexes for documents
-CREATE INDEX IF NOT EXISTS idx_documents_user ON documents(user_id);
-CREATE INDEX IF NOT EXISTS idx_documents_shared_link ON documents(shared_link);
-CREATE INDEX IF NOT EXISTS idx_documents_status ON documents(status);
-CREATE INDEX IF NOT EXISTS idx_documents_auto_delete ON documents(auto_delete_at);
+-- Columns added since the table was introduced
+ALTER TABLE blobs ADD COLUMN IF NOT EXISTS stored BOOLEAN NOT NULL DEFAULT FALSE;
+ALTER TABLE blobs ADD COLUMN IF NOT EXISTS deleting_since TIMESTAMPTZ;
+
+ALTER TABLE blobs ENABLE ROW LEVEL SECURITY;
+
+-- Take a reference on a blob. Until stored is set the object may not exist yet
+-- (the first upload is still writing it, or failed), so the caller writes it
+-- itself. storage_key is the key the first writer chose (blobs/{sha256}[.zst]).
+-- While the blob's object is being removed no row comes back and the caller
+-- tries again, so it never writes an object the removal then deletes; a
+-- removal not finished within 5 minutes (its worker died) is taken over.
+DROP FUNCTION IF EXISTS acquire_blob(TEXT, TEXT, BIGINT);
+CREATE OR REPLACE FUNCTION acquire_blob(p_sha256 TEXT, p_storage_key TEXT, p_size_bytes BIGINT)
+RETURNS TABLE (ref_count INTEGER, storage_key VARCHAR, stored BOOLEAN) AS $$
+    INSERT INTO blobs AS b (sha256, storage_key, size_bytes, ref_count)
+    VALUES (p_sha256, p_storage_key, p_size_bytes, 1)
+    ON CONFLICT (sha256) DO UPDATE
+        SET ref_count = GREATEST(b.ref_count, 0) + 1,
+            stored = b.stored AND b.deleting_since IS NULL,
+            deleting_since = NULL,
+            updated_at = NOW()
+        WHERE b.deleting_since IS NULL OR b.deleting_since < NOW() - INTERVAL '5 minutes'
+    RETURNING b.ref_count, b.storage_key, b.stored;
+$$ LANGUAGE sql;
+
+-- Drop a reference on a blob; returns 0 when the object can be removed from
+-- storage, marking the blob deleting until finish_blob_removal
+CREATE OR REPLACE FUNCTION release_blob(p_storage_key TEXT)
+RETURNS INTEGER AS $$
+DECLARE
+    remaining INTEGER;
+BEGIN
+    UPDATE blobs
+    SET ref_count = ref_count - 1, updated_at = NOW()
+    WHERE storage_key = p_storage_key
+    RETURNING ref_count INTO remaining;
+
+    IF remaining IS NULL OR remaining <= 0 THEN
+        UPDATE blobs SET deleting_since = NOW() WHERE storage_key = p_storage_key AND ref_count <= 0;
+        RETURN 0;
+    END IF;
+    RETURN remaining;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Drop one reference per listed key (a key repeats once per document that
+-- held it) and return the keys whose objects can be removed from storage.
+-- Keys are processed in order so concurrent batches lock rows consistently.
+CREATE OR REPLACE FUNCTION release_blobs(p_storage_keys TEXT[])
+RETURNS SETOF TEXT AS $$
+DECLARE
+    v_key TEXT;
+    v_refs INTEGER;
+    v_remaining INTEGER;
+BEGIN
+    FOR v_key, v_refs IN
+        SELECT key, COUNT(*) FROM unnest(p_storage_keys) AS key GROUP BY key ORDER BY key
+    LOOP
+        UPDATE blobs
+        SET ref_count = ref_count - v_refs, updated_at = NOW()
+        WHERE storage_key = v_key
+        RETURNING ref_count INTO v_remaining;
+        
+        IF v_remaining IS NULL OR v_remaining <= 0 THEN
+            UPDATE blobs SET deleting_since = NOW() WHERE storage_key = v_key AND ref_count <= 0;
+            RETURN NEXT v_key;
+        END IF;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Forget blobs whose objects have been removed, so their content can be stored again
+CREATE OR REPLACE FUNCTION finish_blob_removal(p_storage_keys TEXT[])
+RETURNS VOID AS $$
+    DELETE FROM blobs
+    WHERE storage_key = ANY(p_storage_keys) AND ref_count <= 0 AND deleting_since IS NOT NULL;
+$$ LANGUAGE sql;
 
 -- ==================== AUDIT LOGS TABLE ====================
 CREATE TABLE IF NOT EXISTS audit_logs (
@@ -100,6 +359,156 @@ CREATE TABLE IF NOT EXISTS audit_logs (
 CREATE INDEX IF NOT EXISTS idx_audit_user ON audit_logs(user_id);
 CREATE INDEX IF NOT EXISTS idx_audit_action ON audit_logs(action);
 
+-- ==================== JOBS TABLE ====================
+-- Durable queue for post-request work (stats updates, previews, cleanup).
+-- Rows are deleted once the job succeeds; status 'dead' is the dead letter.
+CREATE TABLE IF NOT EXISTS jobs (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    type VARCHAR(50) NOT NULL,
+    payload JSONB NOT NULL DEFAULT '{}',
+    status VARCHAR(20) NOT NULL DEFAULT 'queued',  -- queued, running, dead
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 5,
+    run_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    locked_until TIMESTAMPTZ,
+    last_error TEXT,
+    created_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_jobs_runnable ON jobs(run_at) WHERE status = 'queued';
+CREATE INDEX IF NOT EXISTS idx_jobs_leased ON jobs(locked_until) WHERE status = 'running';
+
+ALTER TABLE jobs ENABLE ROW LEVEL SECURITY;
+
+-- Claim up to p_limit runnable jobs (or jobs whose worker's lease ran out).
+-- SKIP LOCKED lets every API worker claim concurrently without blocking or
+-- ever handing the same job to two workers.
+CREATE OR REPLACE FUNCTION claim_jobs(p_limit INTEGER, p_lease_seconds INTEGER)
+RETURNS SETOF jobs AS $$
+    UPDATE jobs j
+    SET status = 'running',
+        attempts = j.attempts + 1,
+        locked_until = NOW() + make_interval(secs => p_lease_seconds)
+    WHERE j.id IN (
+        SELECT id FROM jobs
+        WHERE (status = 'queued' AND run_at <= NOW())
+           OR (status = 'running' AND locked_until < NOW())
+        ORDER BY run_at
+        LIMIT p_limit
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING j.*;
+$$ LANGUAGE sql;
+
+-- Add a user_stats job's increments to the user's counters in place. The job row
+-- is marked applied in the same transaction, so a retry of the job (its row is
+-- only deleted once the worker sees success) changes nothing and returns FALSE.
+CREATE OR REPLACE FUNCTION increment_user_stats(p_job_id UUID, p_user_id UUID, p_increments JSONB)
+RETURNS BOOLEAN AS $$
+BEGIN
+    UPDATE jobs SET payload = payload || '{"applied": true}'
+    WHERE id = p_job_id AND NOT payload ? 'applied';
+    IF NOT FOUND THEN
+        RETURN FALSE;
+    END IF;
+
+    UPDATE users
+    SET documents_uploaded = COALESCE(documents_uploaded, 0) + COALESCE((p_increments->>'documents_uploaded')::INTEGER, 0),
+        uploads_used_this_month = COALESCE(uploads_used_this_month, 0) + COALESCE((p_increments->>'uploads_used_this_month')::INTEGER, 0),
+        updated_at = NOW()
+    WHERE id = p_user_id;
+    RETURN TRUE;
+END;
+$$ LANGUAGE plpgsql;
+
+-- ==================== IDEMPOTENCY KEYS TABLE ====================
+-- Locks and stored responses of POSTs retried with an Idempotency-Key
+-- (idempotency.py). key is "<user id>:<client key>"; status in_flight while the
+-- first attempt runs (until locked_until), then done with its response until
+-- expires_at.
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    key VARCHAR(300) PRIMARY KEY,
+    fingerprint VARCHAR(200) NOT NULL,
+    status VARCHAR(20) NOT NULL,  -- in_flight, done
+    response JSONB,
+    locked_until TIMESTAMPTZ,
+    expires_at TIMESTAMPTZ NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires ON idempotency_keys(expires_at);
+
+ALTER TABLE idempotency_keys ENABLE ROW LEVEL SECURITY;
+
+-- Lock a key for a new attempt, taking over an expired response or a lock whose
+-- holder ran out of time; otherwise return the attempt that holds it. The
+-- upsert locks the row, so concurrent attempts cannot both acquire the key.
+CREATE OR REPLACE FUNCTION begin_idempotent_request(
+    p_key TEXT,
+    p_fingerprint TEXT,
+    p_lock_seconds INTEGER,
+    p_ttl_seconds INTEGER
+)
+RETURNS JSONB AS $$
+DECLARE
+    v_row idempotency_keys%ROWTYPE;
+BEGIN
+    INSERT INTO idempotency_keys (key, fingerprint, status, response, locked_until, expires_at)
+    VALUES (p_key, p_fingerprint, 'in_flight', NULL,
+            NOW() + make_interval(secs => p_lock_seconds), NOW() + make_interval(secs => p_ttl_seconds))
+    ON CONFLICT (key) DO UPDATE
+        SET fingerprint = EXCLUDED.fingerprint,
+            status = 'in_flight',
+            response = NULL,
+            locked_until = EXCLUDED.locked_until,
+            expires_at = EXCLUDED.expires_at
+        WHERE idempotency_keys.expires_at <= NOW()
+           OR (idempotency_keys.status = 'in_flight' AND idempotency_keys.locked_until <= NOW())
+    RETURNING * INTO v_row;
+    
+    IF FOUND THEN
+        RETURN jsonb_build_object('acquired', TRUE);
+    END IF;
+    
+    SELECT * INTO v_row FROM idempotency_keys WHERE key = p_key;
+    RETURN jsonb_build_object(
+        'acquired', FALSE,
+        'status', v_row.status,
+        'fingerprint', v_row.fingerprint,
+        'response', v_row.response
+    );
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION purge_idempotency_keys()
+RETURNS INTEGER AS $$
+    WITH purged AS (
+        DELETE FROM idempotency_keys
+        WHERE expires_at < NOW() OR (status = 'in_flight' AND locked_until < NOW())
+        RETURNING 1
+    )
+    SELECT COUNT(*)::INTEGER FROM purged;
+$$ LANGUAGE sql;
+
+-- ==================== BULK DELETES TABLE ====================
+-- Progress of merchant bulk document deletes, run in the background by the
+-- bulk_delete job: status queued, running, done or failed (retried by the job)
+CREATE TABLE IF NOT EXISTS bulk_deletes (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    selection JSONB NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'queued',
+    total INTEGER,
+    deleted INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    updated_at TIMESTAMPTZ DEFAULT NOW(),
+    finished_at TIMESTAMPTZ
+);
+
+CREATE INDEX IF NOT EXISTS idx_bulk_deletes_user ON bulk_deletes(user_id, created_at DESC);
+
+ALTER TABLE bulk_deletes ENABLE ROW LEVEL SECURITY;
+
 -- ==================== ROW LEVEL SECURITY ====================
 
 -- Enable RLS on all tables
@@ -107,6 +516,7 @@ ALTER TABLE users ENABLE ROW LEVEL SECURITY;
 ALTER TABLE documents ENABLE ROW LEVEL SECURITY;
 ALTER TABLE otps ENABLE ROW LEVEL SECURITY;
 ALTER TABLE audit_logs ENABLE ROW LEVEL SECURITY;
+ALTER TABLE documents_archive ENABLE ROW LEVEL SECURITY;
 
 -- Users can only see their own data
 CREATE POLICY "Users can view own data" ON users
@@ -174,10 +584,154 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql;
 
+-- ==================== DOCUMENT PARTITIONS ====================
+
+-- Create the daily documents partitions from today through p_days_ahead days
+-- ahead; returns how many were created. Rows of a day that landed in the
+-- default partition (maintenance did not run in time) would make creating its
+-- partition fail, so they are moved into it: the partition is built as a plain
+-- table, filled from the default partition and then attached.
+CREATE OR REPLACE FUNCTION create_document_partitions(p_days_ahead INTEGER DEFAULT 7)
+RETURNS INTEGER AS $$
+DECLARE
+    v_today DATE := (NOW() AT TIME ZONE 'UTC')::date;
+    v_day DATE;
+    v_name TEXT;
+    v_from TIMESTAMPTZ;
+    v_to TIMESTAMPTZ;
+    v_created INTEGER := 0;
+BEGIN
+    FOR v_day IN SELECT d::date FROM generate_series(v_today, v_today + p_days_ahead, INTERVAL '1 day') AS d LOOP
+        v_name := 'documents_' || to_char(v_day, 'YYYYMMDD');
+        CONTINUE WHEN to_regclass(v_name) IS NOT NULL;
+        v_from := v_day::timestamp AT TIME ZONE 'UTC';
+        v_to := (v_day + 1)::timestamp AT TIME ZONE 'UTC';
+        IF EXISTS (SELECT 1 FROM documents_default WHERE created_at >= v_from AND created_at < v_to) THEN
+            EXECUTE format('CREATE TABLE %I (LIKE documents INCLUDING DEFAULTS)', v_name);
+            EXECUTE format(
+                'WITH moved AS (DELETE FROM documents_default WHERE created_at >= %L AND created_at < %L RETURNING *)
+                 INSERT INTO %I SELECT * FROM moved',
+                v_from, v_to, v_name
+            );
+            EXECUTE format(
+                'ALTER TABLE documents ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                v_name, v_from, v_to
+            );
+        ELSE
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF documents FOR VALUES FROM (%L) TO (%L)',
+                v_name, v_from, v_to
+            );
+        END IF;
+        v_created := v_created + 1;
+    END LOOP;
+    RETURN v_created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Archive and drop daily partitions older than p_keep_days whose documents are
+-- all expired or deleted (the API has already released their blobs). A day that
+-- still has an active document (a long auto-delete time) is retried on the next
+-- run. Dropping takes a brief exclusive lock on documents; lock_timeout keeps it
+-- from queueing behind long queries, and a partition that cannot be locked is
+-- skipped until next time.
+CREATE OR REPLACE FUNCTION drop_expired_document_partitions(p_keep_days INTEGER DEFAULT 1)
+RETURNS TABLE (partition_name TEXT, archived_rows BIGINT) AS $$
+DECLARE
+    v_cutoff DATE := (NOW() AT TIME ZONE 'UTC')::date - p_keep_days;
+    v_name TEXT;
+    v_active BOOLEAN;
+    v_rows BIGINT;
+BEGIN
+    PERFORM set_config('lock_timeout', '2s', true);
+    FOR v_name IN
+        SELECT c.relname
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'documents'::regclass
+          AND c.relname ~ '^documents_[0-9]{8}$'
+          AND to_date(substring(c.relname FROM 11), 'YYYYMMDD') < v_cutoff
+        ORDER BY c.relname
+    LOOP
+        BEGIN
+            -- Hold off writes while checking and copying
+            EXECUTE format('LOCK TABLE %I IN EXCLUSIVE MODE', v_name);
+            EXECUTE format('SELECT EXISTS (SELECT 1 FROM %I WHERE status = ''active'')', v_name) INTO v_active;
+            CONTINUE WHEN v_active;
+            EXECUTE format(
+                'INSERT INTO documents_archive
+                     (id, user_id, document_type, file_size_bytes, content_sha256, share_view_count,
+                      customer_uploaded, status, created_at, deleted_at)
+                 SELECT id, user_id, document_type, file_size_bytes, content_sha256, share_view_count,
+                        customer_uploaded, status, created_at, deleted_at
+                 FROM %I
+                 ON CONFLICT DO NOTHING', v_name);
+            GET DIAGNOSTICS v_rows = ROW_COUNT;
+            EXECUTE format('DROP TABLE %I', v_name);
+            partition_name := v_name;
+            archived_rows := v_rows;
+            RETURN NEXT;
+        EXCEPTION WHEN lock_not_available THEN
+            RAISE NOTICE 'Partition % is busy, retrying next run', v_name;
+        END;
+    END LOOP;
+    
+    -- Dead rows that landed in the default partition are moved row by row
+    WITH moved AS (
+        DELETE FROM documents_default
+        WHERE status <> 'active' AND created_at < v_cutoff::timestamp AT TIME ZONE 'UTC'
+        RETURNING *
+    )
+    INSERT INTO documents_archive
+        (id, user_id, document_type, file_size_bytes, content_sha256, share_view_count,
+         customer_uploaded, status, created_at, deleted_at)
+    SELECT id, user_id, document_type, file_size_bytes, content_sha256, share_view_count,
+           customer_uploaded, status, created_at, deleted_at
+    FROM moved
+    ON CONFLICT DO NOTHING;
+    GET DIAGNOSTICS v_rows = ROW_COUNT;
+    IF v_rows > 0 THEN
+        partition_name := 'documents_default';
+        archived_rows := v_rows;
+        RETURN NEXT;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Both maintenance steps; called periodically by the API
+CREATE OR REPLACE FUNCTION maintain_document_partitions(p_days_ahead INTEGER DEFAULT 7, p_keep_days INTEGER DEFAULT 1)
+RETURNS JSONB AS $$
+DECLARE
+    v_created INTEGER;
+    v_dropped JSONB;
+BEGIN
+    v_created := create_document_partitions(p_days_ahead);
+    SELECT COALESCE(jsonb_agg(jsonb_build_object('partition', partition_name, 'archivedRows', archived_rows)), '[]'::jsonb)
+    INTO v_dropped
+    FROM drop_expired_document_partitions(p_keep_days);
+    RETURN jsonb_build_object('created', v_created, 'dropped', v_dropped);
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT create_document_partitions();
+
+-- Replication lag of a read replica in seconds (0 on the primary). Called by the
+-- API on each replica to decide whether reads may go there. A standby that has
+-- replayed everything it received is current even if the primary has been idle.
+CREATE OR REPLACE FUNCTION replica_lag_seconds()
+RETURNS double precision AS $$
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM NOW() - pg_last_xact_replay_timestamp()), 0)
+    END;
+$$ LANGUAGE sql STABLE;
+
 -- ==================== SCHEDULED JOBS (pg_cron) ====================
 -- Note: Enable pg_cron extension in Supabase Dashboard first
 
 -- Delete expired documents every minute
+-- Superseded by the API's expiry sweep (EXPIRY_SWEEP_INTERVAL_SECONDS), which also
+-- releases stored blobs; rows expired here keep their blob references
 -- SELECT cron.schedule('delete-expired-docs', '* * * * *', 'SELECT delete_expired_documents()');
 
 -- Reset monthly uploads on 1st of each month at midnight
@@ -186,6 +740,10 @@ $$ LANGUAGE plpgsql;
 -- Check expired trials every hour
 -- SELECT cron.schedule('check-expired-trials', '0 * * * *', 'SELECT downgrade_expired_trials()');
 
+-- Create upcoming document partitions and drop expired ones (the API also does
+-- this every DOCUMENT_PARTITION_MAINTENANCE_SECONDS; either is enough)
+-- SELECT cron.schedule('document-partitions', '15 * * * *', 'SELECT maintain_document_partitions()');
+
 -- ==================== SAMPLE DATA (Optional for Testing) ====================
 
 -- Uncomment to insert test user
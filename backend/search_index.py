@@ -0,0 +1,106 @@
+"""
+In-memory document search for the embedded (mock) store.
+
+Mirrors search_documents() in schema.sql: a document matches when every
+word of the query is a prefix of a word in its customer name, phone number
+or order details. Phone numbers are indexed as their digits, with and
+without the country code, so "98123" finds +919812345678.
+
+Each merchant has an inverted index from word to document ids plus a sorted
+word list, so a prefix is a bisect and a short scan rather than a pass over
+every document.
+"""
+import bisect
+import re
+from typing import Optional
+
+SEARCH_FIELDS = ("customer_name", "order_details")
+_word = re.compile(r"[^\W_]+")
+
+
+def search_words(text: Optional[str]) -> list[str]:
+    """Lowercased words of a query or field (letters and digits)"""
+    return _word.findall(text.lower()) if text else []
+
+
+def document_words(doc: dict) -> set[str]:
+    words = set()
+    for field in SEARCH_FIELDS:
+        words.update(search_words(doc.get(field)))
+    digits = "".join(c for c in doc.get("customer_phone") or "" if c.isdigit())
+    if digits:
+        words.update((digits, digits[-10:]))
+    return words
+
+
+class _MerchantIndex:
+    def __init__(self):
+        self.postings: dict[str, set[str]] = {}
+        self.words: list[str] = []  # sorted keys of postings
+
+    def add(self, doc_id: str, words: set[str]):
+        for word in words:
+            ids = self.postings.get(word)
+            if ids is None:
+                ids = self.postings[word] = set()
+                bisect.insort(self.words, word)
+            ids.add(doc_id)
+
+    def remove(self, doc_id: str, words: set[str]):
+        for word in words:
+            ids = self.postings.get(word)
+            if ids is None:
+                continue
+            ids.discard(doc_id)
+            if not ids:
+                del self.postings[word]
+                del self.words[bisect.bisect_left(self.words, word)]
+
+    def prefixed(self, prefix: str) -> set[str]:
+        """Ids of documents with a word starting with prefix"""
+        ids = set()
+        for i in range(bisect.bisect_left(self.words, prefix), len(self.words)):
+            word = self.words[i]
+            if not word.startswith(prefix):
+                break
+            ids |= self.postings[word]
+        return ids
+
+
+class DocumentSearchIndex:
+    """Word-prefix index over the searchable fields of each merchant's documents"""
+
+    def __init__(self):
+        self.merchants: dict[str, _MerchantIndex] = {}
+        self.documents: dict[str, dict] = {}
+        self._words: dict[str, set[str]] = {}
+
+    def add(self, doc: dict):
+        doc_id = doc["id"]
+        if doc_id in self.documents:
+            self.remove(doc_id)
+        words = document_words(doc)
+        self.documents[doc_id] = doc
+        self._words[doc_id] = words
+        self.merchants.setdefault(doc.get("user_id"), _MerchantIndex()).add(doc_id, words)
+
+    def remove(self, doc_id: str):
+        doc = self.documents.pop(doc_id, None)
+        if doc is None:
+            return
+        merchant = self.merchants.get(doc.get("user_id"))
+        if merchant is not None:
+            merchant.remove(doc_id, self._words.pop(doc_id))
+
+    def search(self, user_id: str, query: str) -> list[dict]:
+        """A merchant's documents matching every word of the query, in no particular order"""
+        merchant = self.merchants.get(user_id)
+        terms = sorted(set(search_words(query)), key=len, reverse=True)  # longest (most selective) first
+        if merchant is None or not terms:
+            return []
+        ids = None
+        for term in terms:
+            ids = merchant.prefixed(term) if ids is None else ids & merchant.prefixed(term)
+            if not ids:
+                return []
+        return [self.documents[doc_id] for doc_id in ids]
@@ -1,37 +1,88 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, UploadFile, File, Form, Header, BackgroundTasks
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, UploadFile, File, Form, Header, Query, Request
+from fastapi.responses import StreamingResponse, JSONResponse, Response, PlainTextResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.datastructures import Headers
+from starlette.requests import ClientDisconnect
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict
+from urllib.parse import urlparse
+from pydantic import BaseModel, Field, ConfigDict, ValidationError
 from typing import List, Optional
 import uuid
 from datetime import datetime, timezone, timedelta
-import bcrypt
 import jwt
 import random
 import io
 import qrcode
 import base64
 import asyncio
+import sys
+import hmac
+import hashlib
+import ipaddress
+import tracemalloc
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Sibling modules are imported flat so both `server:app` and `backend.server:app` work
+if str(ROOT_DIR) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR))
+
+from blob_store import BlobStore, BlobTooLargeError
+from encryption import ChunkCipher
+from object_storage import S3ObjectStorage, SupabaseObjectStorage
+import previews
+import file_metadata
+import merchant_codes
+from http_cache import ResponseCacheMiddleware, cached_variant_bytes
+from audit import AuditLog
+from jobs import JobQueue, SqliteJobStore, SupabaseJobStore
+from idempotency import IdempotencyMiddleware, SqliteIdempotencyStore, SupabaseIdempotencyStore
+from singleflight import single_flight
+from diagnostics import LOOP_WATCHDOG_ENABLED, LoopWatchdog, Profiler, RequestProfilingMiddleware
+from memory import MemoryAccounting, MemoryAccountingMiddleware
+from events import EventBus, TooManyStreamsError
+from exports import EXPORT_FORMATS, EXPORT_SELECT, stream_export
+from search_index import DocumentSearchIndex, search_words
+from replicas import SUPABASE_READ_REPLICA_URLS, Replica, ReplicaRouter, ReplicaRoutingMiddleware
+from circuit_breaker import CircuitBreaker, CircuitOpenError, GuardedObjectStorage, GuardedSupabase
+from resumable import (
+    ResumableUploads, UploadConflictError, UploadNotFoundError, UploadTooLargeError,
+    RESUMABLE_UPLOAD_TTL_SECONDS, TUS_EXTENSIONS, TUS_VERSION, parse_upload_metadata
+)
+
 # Supabase configuration
 SUPABASE_URL = os.getenv('SUPABASE_URL', '')
 SUPABASE_KEY = os.getenv('SUPABASE_KEY', '')
 SUPABASE_SERVICE_KEY = os.getenv('SUPABASE_SERVICE_KEY', '')
+DB_TIMEOUT_SECONDS = float(os.getenv('DB_TIMEOUT_SECONDS', '5'))
+STORAGE_TIMEOUT_SECONDS = int(os.getenv('STORAGE_TIMEOUT_SECONDS', '30'))
 
 # Initialize Supabase client
 supabase_client = None
+replica_clients = []
 try:
     if SUPABASE_URL and SUPABASE_KEY and 'your-project' not in SUPABASE_URL:
         from supabase import create_client, Client
-        supabase_client: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+        from supabase.lib.client_options import ClientOptions
+        supabase_client: Client = create_client(SUPABASE_URL, SUPABASE_KEY, options=ClientOptions(
+            postgrest_client_timeout=DB_TIMEOUT_SECONDS,
+            storage_client_timeout=STORAGE_TIMEOUT_SECONDS
+        ))
         logging.info("Supabase client initialized successfully")
+        
+        # Read replicas (read-only lookups are routed to them while they keep up)
+        replica_clients = [
+            (urlparse(url).hostname or url, create_client(url, SUPABASE_KEY, options=ClientOptions(
+                postgrest_client_timeout=DB_TIMEOUT_SECONDS
+            )))
+            for url in SUPABASE_READ_REPLICA_URLS
+        ]
+        if replica_clients:
+            logging.info(f"Routing reads to {len(replica_clients)} read replica(s)")
     else:
         logging.warning("Supabase credentials not configured - using mock database")
 except Exception as e:
@@ -76,11 +127,69 @@ try:
 except Exception as e:
     logging.warning(f"Razorpay not configured: {e}")
 
+# S3-compatible object storage (AWS S3, Supabase Storage's S3 endpoint or a local MinIO)
+# Enables direct-to-storage uploads through presigned URLs
+s3_client = None
+S3_BUCKET = os.getenv('S3_BUCKET', 'documents')
+try:
+    if os.getenv('S3_ENDPOINT_URL') and os.getenv('S3_ACCESS_KEY_ID') and os.getenv('S3_SECRET_ACCESS_KEY'):
+        import boto3
+        from botocore.config import Config as BotoConfig
+        s3_client = boto3.client(
+            's3',
+            endpoint_url=os.getenv('S3_ENDPOINT_URL'),
+            aws_access_key_id=os.getenv('S3_ACCESS_KEY_ID'),
+            aws_secret_access_key=os.getenv('S3_SECRET_ACCESS_KEY'),
+            region_name=os.getenv('S3_REGION', 'us-east-1'),
+            config=BotoConfig(
+                signature_version='s3v4',
+                s3={'addressing_style': 'path'},
+                connect_timeout=DB_TIMEOUT_SECONDS,
+                read_timeout=STORAGE_TIMEOUT_SECONDS,
+                retries={'max_attempts': 2}
+            )
+        )
+        logging.info(f"S3 object storage initialized (bucket: {S3_BUCKET})")
+except Exception as e:
+    logging.warning(f"S3 object storage not configured: {e}")
+
 # JWT Configuration
 JWT_SECRET = os.getenv('JWT_SECRET', 'your-secret-key-change-this-in-production')
 JWT_ALGORITHM = 'HS256'
 JWT_EXPIRATION_DAYS = 30
 
+# OTPs are stored as an HMAC of phone and code under this key
+OTP_HASH_SECRET = os.getenv('OTP_HASH_SECRET', '') or JWT_SECRET
+OTP_MAX_ATTEMPTS = 5
+
+# Keys the permutation behind merchant codes; never change it once codes are issued (merchant_codes.py).
+# Required with Supabase: a known key would let anyone list merchants' codes
+MERCHANT_CODE_SECRET = os.getenv('MERCHANT_CODE_SECRET', '')
+MERCHANT_CODE_BLOCK_SIZE = 100  # in-memory store; Postgres uses merchant_code_seq's increment
+
+# Diagnostics endpoints (profiling, memory) require this token in X-Admin-Token
+ADMIN_API_TOKEN = os.getenv('ADMIN_API_TOKEN', '')
+
+# Upload configuration
+MAX_UPLOAD_BYTES = 52428800  # 50MB
+MAX_BATCH_FILES = int(os.getenv('MAX_BATCH_FILES', '50'))
+BATCH_UPLOAD_CONCURRENCY = int(os.getenv('BATCH_UPLOAD_CONCURRENCY', '4'))
+
+# Bulk delete: documents per select/update round trip (ids travel in the URL) and ids per request
+BULK_DELETE_BATCH_SIZE = 200
+MAX_BULK_DELETE_IDS = 5000
+
+# History export: rows fetched per cursor step
+EXPORT_PAGE_SIZE = 500
+
+MAX_SEARCH_RESULTS = 100
+DIRECT_UPLOAD_URL_TTL_SECONDS = int(os.getenv('DIRECT_UPLOAD_URL_TTL_SECONDS', '900'))
+EVENTS_TICKET_TTL_SECONDS = 60
+EXPIRY_SWEEP_INTERVAL_SECONDS = int(os.getenv('EXPIRY_SWEEP_INTERVAL_SECONDS', '60'))
+DOCUMENT_PARTITION_MAINTENANCE_SECONDS = int(os.getenv('DOCUMENT_PARTITION_MAINTENANCE_SECONDS', '3600'))
+DOCUMENT_PARTITION_KEEP_DAYS = int(os.getenv('DOCUMENT_PARTITION_KEEP_DAYS', '1'))
+DOCUMENT_PARTITION_DAYS_AHEAD = 7
+
 # Setup lifespan
 from contextlib import asynccontextmanager
 
@@ -105,11 +214,43 @@ async def lifespan(app: FastAPI):
     
     logging.info("="*60)
     
+    expiry_task = asyncio.create_task(expiry_sweep_loop())
+    if LOOP_WATCHDOG_ENABLED:
+        loop_watchdog.start()
+    memory_accounting.start()
+    replica_router.start()
+    event_bus.start()
+    audit_log.start()
+    job_queue.start()
+    if raw_supabase_client:
+        db_breaker.start_probing(lambda: raw_supabase_client.table('users').select('id').limit(1).execute())
+    if object_storage:
+        storage_breaker.start_probing(object_storage.probe)
+    
     yield
     
     # Shutdown
+    expiry_task.cancel()
+    loop_watchdog.stop()
+    memory_accounting.stop()
+    replica_router.stop()
+    db_breaker.stop_probing()
+    storage_breaker.stop_probing()
+    await event_bus.stop()
+    await job_queue.stop()
+    await audit_log.stop()
+    previews.shutdown_pool()
+    file_metadata.shutdown_pool()
     logging.info("👋 BharatPrint API shutting down...")
 
+# Event-loop stall detection and on-demand CPU profiling
+loop_watchdog = LoopWatchdog()
+profiler = Profiler()
+memory_accounting = MemoryAccounting()
+
+# Live document events for merchant dashboards (fanned out across workers via Postgres)
+event_bus = EventBus()
+
 # Create the main app
 app = FastAPI(title="BharatPrint API", lifespan=lifespan)
 api_router = APIRouter(prefix="/api")
@@ -119,8 +260,48 @@ mock_db = {
     "users": [],
     "otps": [],
     "documents": [],
-    "files": {}
+    "files": {},
+    "blobs": {},
+    "audit_logs": [],
+    "documents_archive": [],
+    "bulk_deletes": [],
+    "merchant_code_seq": 0
 }
+# Search over the mock documents (Postgres uses a full-text index, see search_documents in schema.sql)
+document_search_index = DocumentSearchIndex()
+# Merchant code -> user record, so customer upload links resolve without a query
+merchant_code_index = merchant_codes.MerchantCodeIndex()
+
+# Circuit breakers: while Supabase or the storage tier is down, calls fail fast (503)
+# instead of each request waiting out the network timeout
+db_breaker = CircuitBreaker("database")
+storage_breaker = CircuitBreaker("storage")
+raw_supabase_client = supabase_client
+if supabase_client:
+    supabase_client = GuardedSupabase(raw_supabase_client, db_breaker)
+
+# Read-only lookups go to replicas that are within REPLICA_MAX_LAG_SECONDS of the primary
+replica_router = ReplicaRouter([Replica(name, client) for name, client in replica_clients])
+
+# Content-addressed, reference-counted file storage shared by all upload paths
+if s3_client:
+    object_storage = GuardedObjectStorage(S3ObjectStorage(s3_client, S3_BUCKET), storage_breaker)
+elif supabase_client:
+    object_storage = GuardedObjectStorage(SupabaseObjectStorage(raw_supabase_client, 'documents'), storage_breaker)
+else:
+    object_storage = None
+# Objects are sealed in AES-GCM chunks when STORAGE_ENCRYPTION_KEY is set
+blob_store = BlobStore(supabase_client, object_storage, mock_db, sidecar_names=previews.SIDECAR_NAMES,
+                       cipher=ChunkCipher.from_env())
+
+# Bytes held in process by the in-memory stores and caches
+memory_accounting.gauge("mockFileStoreBytes", lambda: sum(len(content) for content in mock_db["files"].values()))
+memory_accounting.gauge("responseVariantCacheBytes", cached_variant_bytes)
+memory_accounting.gauge("requestProfileBytes", lambda: sum(len(folded) for folded in profiler.request_profiles.values()))
+memory_accounting.gauge("blobFetchesInFlight", lambda: blob_store.fetches.stats()["inFlight"])
+
+# In-progress resumable uploads, spooled on local disk
+resumable_uploads = ResumableUploads()
 
 # ==================== MODELS ====================
 
@@ -172,6 +353,41 @@ class VerifyOTPResponse(BaseModel):
     user: UserProfile
     model_config = ConfigDict(populate_by_name=True)
 
+class DocumentDetails(BaseModel):
+    customer_name: str = Field(alias="customerName")
+    customer_phone: Optional[str] = Field(None, alias="customerPhone")
+    customer_email: Optional[str] = Field(None, alias="customerEmail")
+    order_details: Optional[str] = Field(None, alias="orderDetails")
+    due_date: Optional[str] = Field(None, alias="dueDate")
+    one_time_view: bool = Field(False, alias="oneTimeView")
+    delete_after_minutes: int = Field(5, alias="deleteAfterMinutes")
+    allow_download: bool = Field(True, alias="allowDownload")
+    model_config = ConfigDict(populate_by_name=True)
+
+class DirectUploadRequest(BaseModel):
+    file_name: str = Field(alias="fileName")
+    content_type: str = Field("application/octet-stream", alias="contentType")
+    file_size: int = Field(alias="fileSize")
+    sha256: str
+    model_config = ConfigDict(populate_by_name=True)
+
+class CompleteDirectUploadRequest(DocumentDetails):
+    upload_token: str = Field(alias="uploadToken")
+
+class CustomerUploadOptions(BaseModel):
+    self_destruct_minutes: int = Field(5, alias="selfDestructMinutes")
+    allow_merchant_download: bool = Field(False, alias="allowMerchantDownload")
+    model_config = ConfigDict(populate_by_name=True)
+
+class CompleteCustomerDirectUploadRequest(CustomerUploadOptions):
+    upload_token: str = Field(alias="uploadToken")
+
+class BulkDeleteRequest(BaseModel):
+    document_ids: Optional[List[str]] = Field(None, alias="documentIds")
+    created_before: Optional[str] = Field(None, alias="createdBefore")
+    customer_uploaded: Optional[bool] = Field(None, alias="customerUploaded")
+    model_config = ConfigDict(populate_by_name=True)
+
 class RegisterRequest(BaseModel):
     name: str = Field(alias="name")
     shop_name: str = Field(alias="shopName")
@@ -188,19 +404,39 @@ def generate_otp() -> str:
     """Generate 6-digit OTP"""
     return str(random.randint(100000, 999999))
 
-def hash_password(password: str) -> str:
-    """Hash password using bcrypt"""
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+def hash_otp(phone: str, otp_code: str) -> str:
+    """Keyed hash of an OTP for its phone number
 
-def verify_password(password: str, hashed: str) -> bool:
-    """Verify password against hash"""
-    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+    Deterministic, unlike bcrypt, so verify_otp_login can compare it in SQL. A
+    slow hash adds nothing for a 6-digit code; the key and the attempt limit do.
+    """
+    return hmac.new(OTP_HASH_SECRET.encode(), f"{phone}:{otp_code}".encode(), hashlib.sha256).hexdigest()
 
-def generate_referral_code(phone: str) -> str:
-    """Generate unique referral code / merchant code"""
-    suffix = phone[-4:] if len(phone) >= 4 else phone
-    random_part = str(random.randint(1000, 9999))
-    return f"BP_{suffix.upper()}{random_part}"
+def new_user_record(phone: str, name: Optional[str], referral_code: str) -> dict:
+    """Full record of a merchant signing up with a verified phone"""
+    now = datetime.now(timezone.utc).isoformat()
+    return {
+        "id": str(uuid.uuid4()),
+        "phone_number": phone,
+        "owner_name": name or "",  # Save the name provided during signup
+        "phone_verified": True,
+        "shop_name": "",
+        "city": "",
+        "state": "Assam",
+        "pincode": None,
+        "business_category": "print_shop",
+        "referral_code": referral_code,
+        "documents_uploaded": 0,
+        "subscription_status": "free",
+        "monthly_upload_limit": 20,
+        "uploads_used_this_month": 0,
+        "onboarding_completed": False,
+        "trial_started_at": None,
+        "trial_ends_at": None,
+        "last_login": now,
+        "created_at": now,
+        "updated_at": now
+    }
 
 def create_jwt_token(user_id: str, phone: str) -> str:
     """Create JWT token"""
@@ -224,195 +460,385 @@ def generate_qr_code(data: str) -> str:
     img_base64 = base64.b64encode(buffer.getvalue()).decode()
     return f"data:image/png;base64,{img_base64}"
 
+async def schedule_previews(blob, content_type: str):
+    """Queue thumbnail/preview rendering for a newly stored blob"""
+    if blob.deduplicated or not previews.is_previewable(content_type):
+        return
+    await job_queue.enqueue("generate_previews", {"storage_key": blob.storage_key, "content_type": content_type})
+
+async def schedule_metadata(doc_record: dict):
+    """Queue page count / paper size extraction for a new document"""
+    if not file_metadata.is_extractable(doc_record['document_type']):
+        return
+    await job_queue.enqueue("extract_metadata", {
+        "document_id": doc_record['id'],
+        "storage_key": doc_record['file_storage_key'],
+        "content_type": doc_record['document_type']
+    })
+
+def create_upload_token(claims: dict) -> str:
+    """Sign the parameters of a pending direct upload so completion can trust them"""
+    payload = {
+        **claims,
+        'typ': 'direct_upload',
+        'exp': datetime.now(timezone.utc) + timedelta(seconds=DIRECT_UPLOAD_URL_TTL_SECONDS * 2)
+    }
+    return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
+
+def decode_upload_token(token: str) -> dict:
+    """Verify a direct upload token"""
+    try:
+        claims = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+    except jwt.ExpiredSignatureError:
+        raise HTTPException(status_code=400, detail="Upload session expired. Please upload again.")
+    except jwt.InvalidTokenError:
+        raise HTTPException(status_code=400, detail="Invalid upload token")
+    if claims.get('typ') != 'direct_upload':
+        raise HTTPException(status_code=400, detail="Invalid upload token")
+    return claims
+
+def create_upload_ticket(upload_id: str) -> str:
+    """Token for the later requests of a customer's resumable upload (customers have no account to sign in with)"""
+    payload = {
+        'upload_id': upload_id,
+        'typ': 'resumable_upload',
+        'exp': datetime.now(timezone.utc) + timedelta(seconds=RESUMABLE_UPLOAD_TTL_SECONDS)
+    }
+    return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
+
+def decode_upload_ticket(authorization: Optional[str]) -> Optional[str]:
+    """The upload id a resumable upload ticket (sent as a bearer token) is for, None if it is not valid"""
+    try:
+        claims = jwt.decode((authorization or '').replace('Bearer ', ''), JWT_SECRET, algorithms=[JWT_ALGORITHM])
+    except jwt.InvalidTokenError:
+        return None
+    return claims.get('upload_id') if claims.get('typ') == 'resumable_upload' else None
+
+def create_events_ticket(user_id: str) -> str:
+    """Short-lived token for opening an event stream (EventSource cannot send an Authorization header)"""
+    payload = {
+        'sub': user_id,
+        'typ': 'events',
+        'exp': datetime.now(timezone.utc) + timedelta(seconds=EVENTS_TICKET_TTL_SECONDS)
+    }
+    return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
+
+def decode_events_ticket(ticket: str) -> str:
+    """Verify an event stream ticket and return its user id"""
+    try:
+        claims = jwt.decode(ticket, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+    except jwt.ExpiredSignatureError:
+        raise HTTPException(status_code=401, detail="Event stream ticket expired")
+    except jwt.InvalidTokenError:
+        raise HTTPException(status_code=401, detail="Invalid event stream ticket")
+    if claims.get('typ') != 'events':
+        raise HTTPException(status_code=401, detail="Invalid event stream ticket")
+    return claims['sub']
+
 # ==================== DATABASE OPERATIONS ====================
 
+def db_read(run, session: Optional[str] = None, retry_empty: bool = False):
+    """Run a read-only query, `run(client)`, on a replica that has caught up or else on the primary"""
+    return replica_router.read(supabase_client, run, session, retry_empty)
+
 async def db_get_user_by_phone(phone: str):
     """Get user by phone number"""
     if supabase_client:
-        try:
-            result = supabase_client.table('users').select('*').eq('phone_number', phone).execute()
-            if result.data:
-                return result.data[0]
-        except Exception as e:
-            logging.error(f"Supabase user query failed: {e}")
-    
-    # Fall back to mock_db
-    if "users" in mock_db:
+        result = db_read(lambda db: db.table('users').select('*').eq('phone_number', phone).execute(), retry_empty=True)
+        return result.data[0] if result.data else None
+    else:
         for user in mock_db["users"]:
             if user.get("phone_number") == phone:
                 return user
-    return None
+        return None
 
+@single_flight(bypass=lambda user_id: replica_router.wants_primary(user_id))
 async def db_get_user_by_id(user_id: str):
-    """Get user by ID"""
+    """Get user by ID (concurrent lookups of the same user share one query,
+    except reads that must see the user's own recent write)"""
     if supabase_client:
-        try:
-            result = supabase_client.table('users').select('*').eq('id', user_id).execute()
-            if result.data:
-                return result.data[0]
-        except Exception as e:
-            logging.error(f"Supabase user query failed: {e}")
-    
-    # Fall back to mock_db
-    if "users" in mock_db:
+        result = await asyncio.to_thread(
+            db_read, lambda db: db.table('users').select('*').eq('id', user_id).execute(), user_id, True
+        )
+        return result.data[0] if result.data else None
+    else:
         for user in mock_db["users"]:
             if user.get("id") == user_id:
                 return user
-    return None
+        return None
 
 async def db_get_user_by_merchant_code(merchant_code: str):
-    """Get user by merchant/referral code"""
-    if supabase_client:
-        try:
-            result = supabase_client.table('users').select('*').eq('referral_code', merchant_code).execute()
-            if result.data:
-                return result.data[0]
-        except Exception as e:
-            logging.error(f"Supabase user query failed: {e}")
+    """Get user by merchant/referral code
+
+    Codes failing their check character are rejected without a query, and
+    known codes are answered from merchant_code_index.
+    """
+    if not merchant_codes.is_well_formed(merchant_code):
+        return None
+    user = merchant_code_index.get(merchant_code)
+    if user:
+        return user
     
-    # Fall back to mock_db
-    if "users" in mock_db:
+    if supabase_client:
+        result = supabase_client.table('users').select('*').eq('referral_code', merchant_code).execute()
+        if not result.data:
+            return None
+        merchant_code_index.add(result.data[0])
+        return result.data[0]
+    else:
         for user in mock_db["users"]:
             if user.get("referral_code") == merchant_code:
+                merchant_code_index.add(user)
                 return user
-    return None
+        return None
+
+async def db_reserve_merchant_codes() -> tuple:
+    """(first number, size) of a block of merchant code numbers reserved for this worker"""
+    if supabase_client:
+        result = await asyncio.to_thread(supabase_client.rpc('reserve_merchant_codes').execute)
+        return result.data['start'], result.data['size']
+    else:
+        start = mock_db["merchant_code_seq"]
+        mock_db["merchant_code_seq"] = start + MERCHANT_CODE_BLOCK_SIZE
+        return start, MERCHANT_CODE_BLOCK_SIZE
+
+if not MERCHANT_CODE_SECRET:
+    if supabase_client:
+        raise RuntimeError("MERCHANT_CODE_SECRET must be set when Supabase is configured")
+    MERCHANT_CODE_SECRET = 'bharatprint-merchant-codes'  # in-memory database only
+
+# Unique merchant codes without lookups: one round trip per block of signups
+merchant_code_allocator = merchant_codes.MerchantCodeAllocator(db_reserve_merchant_codes, MERCHANT_CODE_SECRET)
 
 async def db_create_user(user_data: dict):
     """Create new user"""
+    replica_router.note_write(user_data.get('id'))
     if supabase_client:
-        try:
-            result = supabase_client.table('users').insert(user_data).execute()
-            if result.data:
-                return result.data[0]
-        except Exception as e:
-            logging.error(f"Supabase user insert failed: {e}")
-    
-    # Fall back to mock_db
-    if "users" not in mock_db:
-        mock_db["users"] = []
-    mock_db["users"].append(user_data)
-    return user_data
+        result = supabase_client.table('users').insert(user_data).execute()
+        if not result.data:
+            return None
+        merchant_code_index.add(result.data[0])
+        return result.data[0]
+    else:
+        mock_db["users"].append(user_data)
+        merchant_code_index.add(user_data)
+        return user_data
 
 async def db_update_user(user_id: str, update_data: dict):
     """Update user"""
+    replica_router.note_write(user_id)
+    merchant_code_index.forget_user(user_id)
     if supabase_client:
-        try:
-            result = supabase_client.table('users').update(update_data).eq('id', user_id).execute()
-            if result.data:
-                return result.data[0]
-        except Exception as e:
-            logging.error(f"Supabase user update failed: {e}")
-    
-    # Fall back to mock_db
-    if "users" in mock_db:
+        result = supabase_client.table('users').update(update_data).eq('id', user_id).execute()
+        return result.data[0] if result.data else None
+    else:
         for i, user in enumerate(mock_db["users"]):
             if user.get("id") == user_id:
                 mock_db["users"][i].update(update_data)
                 return mock_db["users"][i]
-    return None
+        return None
+
+async def db_increment_user_stats(job_id: str, user_id: str, increments: dict) -> bool:
+    """Add to a user's counters in place, at most once per job; False if this job already did"""
+    replica_router.note_write(user_id)
+    merchant_code_index.forget_user(user_id)
+    if supabase_client:
+        result = await asyncio.to_thread(supabase_client.rpc('increment_user_stats', {
+            'p_job_id': job_id,
+            'p_user_id': user_id,
+            'p_increments': increments
+        }).execute)
+        return bool(result.data)
+    else:
+        # Never awaits, so nothing runs between the read and the write, and it cannot fail once applied
+        user = next((user for user in mock_db["users"] if user.get("id") == user_id), None)
+        if user is None:
+            return False
+        for field, increment in increments.items():
+            user[field] = (user.get(field) or 0) + increment
+        return True
 
 async def db_create_otp(otp_data: dict):
     """Store OTP record"""
     if supabase_client:
-        try:
-            result = supabase_client.table('otps').insert(otp_data).execute()
-            return result.data[0] if result.data else None
-        except Exception as e:
-            logging.error(f"Supabase OTP insert failed: {e}")
-            # Fall back to mock_db
-            if "otps" not in mock_db:
-                mock_db["otps"] = []
-            mock_db["otps"].append(otp_data)
-            return otp_data
+        result = supabase_client.table('otps').insert(otp_data).execute()
+        return result.data[0] if result.data else None
     else:
-        if "otps" not in mock_db:
-            mock_db["otps"] = []
         mock_db["otps"].append(otp_data)
         return otp_data
 
-async def db_get_latest_otp(phone: str):
-    """Get latest valid OTP for phone"""
+def verify_otp_login_in_memory(phone: str, otp_hash: str, otp_code: str, name: Optional[str],
+                               referral_code: Optional[str]) -> dict:
+    """verify_otp_login (schema.sql) on mock_db; never awaits, so no other request runs in the middle of it"""
     now = datetime.now(timezone.utc).isoformat()
+    valid_otps = [
+        otp for otp in mock_db.setdefault("otps", [])
+        if otp.get("phone_number") == phone
+        and otp.get("expires_at") > now
+        and otp.get("verified_at") is None
+    ]
+    if not valid_otps:
+        return {"status": "not_found"}
+    otp_record = valid_otps[-1]
+    if otp_record.get("attempts", 0) >= OTP_MAX_ATTEMPTS:
+        return {"status": "too_many_attempts"}
+    if not hmac.compare_digest(otp_record.get("otp_hash", ""), otp_hash) and otp_record.get("otp_code") != otp_code:
+        otp_record["attempts"] = otp_record.get("attempts", 0) + 1
+        return {"status": "invalid"}
+    
+    users = mock_db.setdefault("users", [])
+    user = next((user for user in users if user.get("phone_number") == phone), None)
+    is_new_user = user is None
+    if is_new_user and referral_code is None:
+        return {"status": "needs_referral_code"}
+    otp_record["verified_at"] = now
+    if is_new_user:
+        user = new_user_record(phone, name, referral_code)
+        users.append(user)
+    else:
+        user["last_login"] = now
+        if name and not user.get("owner_name"):
+            user["owner_name"] = name
+    return {"status": "ok", "user": user, "is_new_user": is_new_user}
+
+async def db_verify_otp_login(phone: str, otp_code: str, name: Optional[str]) -> dict:
+    """Check an OTP and log the user in (creating them if new) in one atomic step
+
+    Returns {"status": "ok", "user": ..., "is_new_user": ...}, or a status of
+    not_found, too_many_attempts or invalid. With Supabase this is a call to
+    verify_otp_login (schema.sql), which locks the OTP row so concurrent
+    attempts cannot both succeed or lose an attempt count.
+    
+    A merchant code is allocated only when the OTP is right and the user is
+    new (the first call answers needs_referral_code), so wrong codes and
+    returning users never spend one. Codes are unique by construction, so the
+    insert cannot collide.
+    """
+    otp_hash = hash_otp(phone, otp_code)
+    
+    async def verify(referral_code: Optional[str]) -> dict:
+        if not supabase_client:
+            return verify_otp_login_in_memory(phone, otp_hash, otp_code, name, referral_code)
+        result = supabase_client.rpc('verify_otp_login', {
+            'p_phone': phone,
+            'p_otp_hash': otp_hash,
+            'p_otp_code': otp_code,
+            'p_name': name,
+            'p_referral_code': referral_code,
+            'p_max_attempts': OTP_MAX_ATTEMPTS
+        }).execute()
+        return result.data
     
-    # Try Supabase first
-    if supabase_client:
-        try:
-            result = supabase_client.table('otps')\
-                .select('*')\
-                .eq('phone_number', phone)\
-                .gt('expires_at', now)\
-                .is_('verified_at', 'null')\
-                .order('sent_at', desc=True)\
-                .limit(1)\
-                .execute()
-            if result.data:
-                return result.data[0]
-        except Exception as e:
-            logging.error(f"Supabase OTP query failed: {e}")
-    
-    # Fall back to mock_db (or if Supabase failed)
-    if "otps" in mock_db:
-        valid_otps = [
-            otp for otp in mock_db["otps"]
-            if otp.get("phone_number") == phone
-            and otp.get("expires_at") > now
-            and otp.get("verified_at") is None
-        ]
-        return valid_otps[-1] if valid_otps else None
-    
-    return None
-
-async def db_update_otp(otp_id: str, update_data: dict):
-    """Update OTP record"""
-    if supabase_client:
-        try:
-            result = supabase_client.table('otps').update(update_data).eq('id', otp_id).execute()
-            if result.data:
-                return result.data[0]
-        except Exception as e:
-            logging.error(f"Supabase OTP update failed: {e}")
-    
-    # Fall back to mock_db (or if Supabase failed)
-    if "otps" in mock_db:
-        for i, otp in enumerate(mock_db["otps"]):
-            if otp.get("id") == otp_id:
-                mock_db["otps"][i].update(update_data)
-                return mock_db["otps"][i]
-    
-    return None
+    outcome = await verify(None)
+    if outcome.get('status') == 'needs_referral_code':
+        outcome = await verify(await merchant_code_allocator.allocate())
+    if outcome.get('status') == 'ok':
+        replica_router.note_write(outcome['user']['id'])
+        merchant_code_index.add(outcome['user'])
+    return outcome
 
 async def db_create_document(doc_data: dict):
     """Create document record"""
+    replica_router.note_write(doc_data.get('user_id'))
     if supabase_client:
-        result = supabase_client.table('documents').insert(doc_data).execute()
+        # Off the event loop, so it overlaps with the other upload steps
+        result = await asyncio.to_thread(supabase_client.table('documents').insert(doc_data).execute)
         return result.data[0] if result.data else None
     else:
         mock_db["documents"].append(doc_data)
+        document_search_index.add(doc_data)
         return doc_data
 
+async def db_create_documents(docs: list):
+    """Create several document records in one insert"""
+    if not docs:
+        return []
+    for user_id in {doc.get('user_id') for doc in docs}:
+        replica_router.note_write(user_id)
+    if supabase_client:
+        result = supabase_client.table('documents').insert(docs).execute()
+        return result.data or []
+    else:
+        mock_db["documents"].extend(docs)
+        for doc in docs:
+            document_search_index.add(doc)
+        return docs
+
 async def db_get_documents_by_user(user_id: str, limit: int = 20, offset: int = 0):
     """Get user's documents"""
     if supabase_client:
-        result = supabase_client.table('documents')\
+        result = db_read(lambda db: db.table('documents')\
             .select('*')\
             .eq('user_id', user_id)\
             .eq('status', 'active')\
             .order('created_at', desc=True)\
             .range(offset, offset + limit - 1)\
-            .execute()
+            .execute(), user_id)
         return result.data
     else:
         docs = [d for d in mock_db["documents"] if d.get("user_id") == user_id and d.get("status") == "active"]
         return docs[offset:offset + limit]
 
+async def db_iter_document_history(user_id: str, page_size: int = EXPORT_PAGE_SIZE):
+    """All of a user's documents, oldest first, a page at a time
+
+    Keyset cursor on (created_at, id), so every page is an index range scan
+    and rows inserted or deleted meanwhile never shift the pages. Each page
+    is fetched in a worker thread, from a replica when one is current.
+    """
+    if supabase_client:
+        cursor = None
+        while True:
+            def fetch_page(db, cursor=cursor):
+                query = db.table('documents').select(EXPORT_SELECT).eq('user_id', user_id)
+                if cursor:
+                    created_at, doc_id = cursor
+                    query = query.or_(f'created_at.gt."{created_at}",and(created_at.eq."{created_at}",id.gt.{doc_id})')
+                return query.order('created_at').order('id').limit(page_size).execute()
+            rows = (await asyncio.to_thread(db_read, fetch_page, user_id)).data
+            if rows:
+                yield rows
+            if len(rows) < page_size:
+                return
+            cursor = (rows[-1]['created_at'], rows[-1]['id'])
+    else:
+        docs = sorted(
+            (d for d in mock_db["documents"] if d.get("user_id") == user_id),
+            key=lambda d: (d.get("created_at", ""), d.get("id", ""))
+        )
+        for start in range(0, len(docs), page_size):
+            yield docs[start:start + page_size]
+
+async def db_search_documents(user_id: str, query: str, created_after: Optional[str] = None,
+                              created_before: Optional[str] = None, limit: int = 20):
+    """A user's active documents whose customer name, phone or order details match every word of the query, newest first"""
+    if supabase_client:
+        result = db_read(lambda db: db.rpc('search_documents', {
+            'p_user_id': user_id,
+            'p_query': query,
+            'p_created_after': created_after,
+            'p_created_before': created_before,
+            'p_limit': limit
+        }).execute(), user_id)
+        return result.data
+    else:
+        docs = [
+            doc for doc in document_search_index.search(user_id, query)
+            if doc.get("status", "active") == "active"
+            and (not created_after or doc.get("created_at", "") >= created_after)
+            and (not created_before or doc.get("created_at", "") < created_before)
+        ]
+        docs.sort(key=lambda doc: doc.get("created_at", ""), reverse=True)
+        return docs[:limit]
+
 async def db_count_documents_by_user(user_id: str):
     """Count user's active documents"""
     if supabase_client:
-        result = supabase_client.table('documents')\
+        result = db_read(lambda db: db.table('documents')\
             .select('id', count='exact')\
             .eq('user_id', user_id)\
             .eq('status', 'active')\
-            .execute()
+            .execute(), user_id)
         return result.count or 0
     else:
         return len([d for d in mock_db["documents"] if d.get("user_id") == user_id and d.get("status") == "active"])
@@ -420,10 +846,12 @@ async def db_count_documents_by_user(user_id: str):
 async def db_get_document_by_id(doc_id: str, user_id: str = None):
     """Get document by ID"""
     if supabase_client:
-        query = supabase_client.table('documents').select('*').eq('id', doc_id)
-        if user_id:
-            query = query.eq('user_id', user_id)
-        result = query.execute()
+        def run(db):
+            query = db.table('documents').select('*').eq('id', doc_id)
+            if user_id:
+                query = query.eq('user_id', user_id)
+            return query.execute()
+        result = db_read(run, user_id, retry_empty=True)
         return result.data[0] if result.data else None
     else:
         for doc in mock_db["documents"]:
@@ -433,10 +861,13 @@ async def db_get_document_by_id(doc_id: str, user_id: str = None):
                 return doc
         return None
 
+@single_flight
 async def db_get_document_by_share_link(share_link: str):
-    """Get document by share link"""
+    """Get document by share link (concurrent viewers of the same link share one query)"""
     if supabase_client:
-        result = supabase_client.table('documents').select('*').eq('shared_link', share_link).execute()
+        result = await asyncio.to_thread(
+            db_read, lambda db: db.table('documents').select('*').eq('shared_link', share_link).execute(), None, True
+        )
         return result.data[0] if result.data else None
     else:
         for doc in mock_db["documents"]:
@@ -444,6 +875,22 @@ async def db_get_document_by_share_link(share_link: str):
                 return doc
         return None
 
+async def db_record_share_view(doc_id: str):
+    """Count a view of a shared document, returning the updated row, or None for a one-time document already viewed"""
+    if supabase_client:
+        result = await asyncio.to_thread(
+            supabase_client.rpc('record_share_view', {"p_document_id": doc_id}).execute
+        )
+        return result.data[0] if result.data else None
+    else:
+        for doc in mock_db["documents"]:
+            if doc.get("id") == doc_id:
+                if doc.get("one_time_view") and doc.get("share_view_count"):
+                    return None
+                doc["share_view_count"] = (doc.get("share_view_count") or 0) + 1
+                return doc
+        return None
+
 async def db_update_document(doc_id: str, update_data: dict):
     """Update document"""
     if supabase_client:
@@ -456,6 +903,121 @@ async def db_update_document(doc_id: str, update_data: dict):
                 return mock_db["documents"][i]
         return None
 
+def filter_selected_documents(query, user_id: str, selection: dict):
+    """Restrict a documents query to a merchant's active documents matching a bulk delete selection"""
+    query = query.eq('user_id', user_id).eq('status', 'active')
+    if 'document_ids' in selection:
+        query = query.in_('id', selection['document_ids'])
+    if 'created_before' in selection:
+        query = query.lt('created_at', selection['created_before'])
+    if selection.get('customer_uploaded') is True:
+        query = query.is_('customer_uploaded', 'true')
+    elif selection.get('customer_uploaded') is False:
+        query = query.not_.is_('customer_uploaded', 'true')
+    return query
+
+def is_selected_document(doc: dict, user_id: str, selection: dict) -> bool:
+    """In-memory equivalent of filter_selected_documents"""
+    return (
+        doc.get("user_id") == user_id and doc.get("status") == "active"
+        and ('document_ids' not in selection or doc.get("id") in selection['document_ids'])
+        and ('created_before' not in selection or doc.get("created_at", "") < selection['created_before'])
+        and ('customer_uploaded' not in selection or bool(doc.get("customer_uploaded")) == selection['customer_uploaded'])
+    )
+
+async def db_count_selected_documents(user_id: str, selection: dict) -> int:
+    """Count the active documents a bulk delete selection matches"""
+    if supabase_client:
+        result = filter_selected_documents(
+            supabase_client.table('documents').select('id', count='exact'), user_id, selection
+        ).execute()
+        return result.count or 0
+    else:
+        return sum(1 for doc in mock_db["documents"] if is_selected_document(doc, user_id, selection))
+
+async def db_get_selected_documents(user_id: str, selection: dict, limit: int):
+    """Next batch of active documents matching a bulk delete selection"""
+    if supabase_client:
+        result = filter_selected_documents(
+            supabase_client.table('documents').select('id, user_id, document_name, customer_uploaded, file_storage_key'),
+            user_id, selection
+        ).limit(limit).execute()
+        return result.data
+    else:
+        return [doc for doc in mock_db["documents"] if is_selected_document(doc, user_id, selection)][:limit]
+
+async def db_delete_documents(user_id: str, doc_ids: list):
+    """Mark a merchant's documents deleted in one update, returning those that were still active"""
+    replica_router.note_write(user_id)
+    update_data = {"status": "deleted", "deleted_at": datetime.now(timezone.utc).isoformat()}
+    if supabase_client:
+        result = supabase_client.table('documents')\
+            .update(update_data)\
+            .in_('id', doc_ids)\
+            .eq('user_id', user_id)\
+            .eq('status', 'active')\
+            .execute()
+        return result.data
+    else:
+        ids = set(doc_ids)
+        deleted = []
+        for doc in mock_db["documents"]:
+            if doc.get("id") in ids and doc.get("user_id") == user_id and doc.get("status") == "active":
+                doc.update(update_data)
+                deleted.append(doc)
+        return deleted
+
+async def db_expire_documents(doc_ids: list):
+    """Mark documents expired in one update, returning those that were still active"""
+    update_data = {"status": "expired", "deleted_at": datetime.now(timezone.utc).isoformat()}
+    if supabase_client:
+        result = supabase_client.table('documents')\
+            .update(update_data)\
+            .in_('id', doc_ids)\
+            .eq('status', 'active')\
+            .execute()
+        return result.data
+    else:
+        ids = set(doc_ids)
+        expired = []
+        for doc in mock_db["documents"]:
+            if doc.get("id") in ids and doc.get("status") == "active":
+                doc.update(update_data)
+                expired.append(doc)
+        return expired
+
+async def db_create_bulk_delete(operation: dict):
+    """Store a queued bulk delete"""
+    if supabase_client:
+        result = supabase_client.table('bulk_deletes').insert(operation).execute()
+        return result.data[0] if result.data else None
+    else:
+        mock_db["bulk_deletes"].append(operation)
+        return operation
+
+async def db_get_bulk_delete(operation_id: str, user_id: str):
+    """Get a merchant's bulk delete"""
+    if supabase_client:
+        result = supabase_client.table('bulk_deletes').select('*').eq('id', operation_id).eq('user_id', user_id).execute()
+        return result.data[0] if result.data else None
+    else:
+        for operation in mock_db["bulk_deletes"]:
+            if operation.get("id") == operation_id and operation.get("user_id") == user_id:
+                return operation
+        return None
+
+async def db_update_bulk_delete(operation_id: str, update_data: dict):
+    """Update a bulk delete's status and progress"""
+    if supabase_client:
+        result = supabase_client.table('bulk_deletes').update(update_data).eq('id', operation_id).execute()
+        return result.data[0] if result.data else None
+    else:
+        for operation in mock_db["bulk_deletes"]:
+            if operation.get("id") == operation_id:
+                operation.update(update_data)
+                return operation
+        return None
+
 async def db_get_expired_trials():
     """Get users with expired trials"""
     now = datetime.now(timezone.utc).isoformat()
@@ -473,8 +1035,121 @@ async def db_get_expired_trials():
             and u.get("trial_ends_at") and u.get("trial_ends_at") < now
         ]
 
+async def db_get_expired_documents(limit: int = 500):
+    """Get active documents past their auto-delete time"""
+    now = datetime.now(timezone.utc).isoformat()
+    if supabase_client:
+        result = supabase_client.table('documents')\
+            .select('id, user_id, document_name, customer_uploaded, file_storage_key')\
+            .eq('status', 'active')\
+            .lt('auto_delete_at', now)\
+            .limit(limit)\
+            .execute()
+        return result.data
+    else:
+        return [
+            d for d in mock_db["documents"]
+            if d.get("status") == "active"
+            and d.get("auto_delete_at") and d.get("auto_delete_at") < now
+        ][:limit]
+
+ARCHIVED_DOCUMENT_FIELDS = (
+    "id", "user_id", "document_type", "file_size_bytes", "content_sha256", "share_view_count",
+    "customer_uploaded", "status", "created_at", "deleted_at"
+)
+
+async def db_maintain_document_partitions():
+    """Create upcoming daily documents partitions and archive/drop the expired ones"""
+    if supabase_client:
+        result = supabase_client.rpc('maintain_document_partitions', {
+            'p_days_ahead': DOCUMENT_PARTITION_DAYS_AHEAD,
+            'p_keep_days': DOCUMENT_PARTITION_KEEP_DAYS
+        }).execute()
+        return result.data
+    else:
+        # No partitions in memory: move dead rows past the retention window to the archive
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=DOCUMENT_PARTITION_KEEP_DAYS)).date().isoformat()
+        dead, kept = [], []
+        for doc in mock_db["documents"]:
+            (dead if doc.get("status") != "active" and doc.get("created_at", "") < cutoff else kept).append(doc)
+        mock_db["documents"][:] = kept
+        for doc in dead:
+            document_search_index.remove(doc["id"])
+        mock_db["documents_archive"].extend({field: doc.get(field) for field in ARCHIVED_DOCUMENT_FIELDS} for doc in dead)
+        return {"created": 0, "dropped": [{"partition": "mock", "archivedRows": len(dead)}] if dead else []}
+
+async def db_insert_audit_logs(rows: list):
+    """Bulk insert audit events (ignoring ids already written by an earlier replay)"""
+    if supabase_client:
+        await asyncio.to_thread(
+            supabase_client.table('audit_logs').upsert(rows, on_conflict='id', ignore_duplicates=True).execute
+        )
+    else:
+        mock_db["audit_logs"].extend(rows)
+
+# Audit events are buffered and written in bulk by a background flusher
+audit_log = AuditLog(db_insert_audit_logs)
+
+def client_ip(request: Request) -> Optional[str]:
+    """Caller IP, honouring the proxy's X-Forwarded-For (None when it is not an IP address)"""
+    forwarded = request.headers.get("x-forwarded-for")
+    address = forwarded.split(",")[0].strip() if forwarded else (request.client.host if request.client else None)
+    try:
+        # Without any IPv6 zone suffix, which is free text and would not fit audit_logs.ip_address
+        return str(ipaddress.ip_address(address.partition("%")[0])) if address else None
+    except ValueError:
+        return None
+
+# ==================== BACKGROUND JOBS ====================
+
+# Durable post-request work: Postgres (SKIP LOCKED) with Supabase, local SQLite otherwise
+job_queue = JobQueue(SupabaseJobStore(supabase_client) if supabase_client else SqliteJobStore())
+
+@job_queue.job("user_stats", max_attempts=5, with_job_id=True)
+async def apply_user_stats(payload: dict, job_id: str):
+    """Add upload counters to a user's stats (once per job, however often it is retried)"""
+    await db_increment_user_stats(job_id, payload['user_id'], payload['increments'])
+
+@job_queue.job("generate_previews", max_attempts=3, retry_delay=30)
+async def generate_previews_job(payload: dict):
+    """Render and cache the preview images of a stored blob"""
+    await previews.generate_previews(blob_store, payload['storage_key'], payload['content_type'])
+
+@job_queue.job("extract_metadata", max_attempts=3, retry_delay=30)
+async def extract_metadata_job(payload: dict):
+    """Extract a new document's page count, paper sizes and colour, and store them on it"""
+    metadata = await file_metadata.extract(blob_store, payload['storage_key'], payload['content_type'])
+    if metadata is None:
+        return
+    if not await db_update_document(payload['document_id'], {"file_metadata": metadata}):
+        # Queued after the row insert, so the document has been removed since; nothing to retry
+        logging.info(f"Document {payload['document_id']} is gone, dropping its metadata")
+
+@job_queue.job("release_blob", max_attempts=8, retry_delay=30)
+async def release_blob_job(payload: dict):
+    """Drop a document's reference to its blob (deleting it from storage at zero)"""
+    await blob_store.release(payload['storage_key'])
+
+@job_queue.job("release_blobs", max_attempts=8, retry_delay=30)
+async def release_blobs_job(payload: dict):
+    """Drop the blob references of a batch of deleted documents, removing unreferenced objects in bulk"""
+    await blob_store.release_many(payload['storage_keys'])
+
 # ==================== AUTH DEPENDENCY ====================
 
+def is_admin_request(headers) -> bool:
+    """Whether the request carries the diagnostics admin token"""
+    token = headers.get("x-admin-token") or ""
+    return bool(ADMIN_API_TOKEN) and hmac.compare_digest(token.encode(), ADMIN_API_TOKEN.encode())
+
+async def require_admin(x_admin_token: str = Header(None)):
+    """Dependency guarding the admin and diagnostics endpoints"""
+    if not ADMIN_API_TOKEN:
+        raise HTTPException(status_code=503, detail="Diagnostics are disabled (ADMIN_API_TOKEN not set)")
+    if not is_admin_request({"x-admin-token": x_admin_token}):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
 async def get_current_user(authorization: str = Header(None)):
     """Dependency to get current user from JWT token"""
     if not authorization:
@@ -549,7 +1224,7 @@ async def send_otp(request: SendOTPRequest):
     
     # Generate OTP
     otp_code = generate_otp()
-    otp_hash = hash_password(otp_code)
+    otp_hash = hash_otp(phone_formatted, otp_code)
     
     # Send SMS via Twilio
     try:
@@ -637,7 +1312,7 @@ async def send_otp(request: SendOTPRequest):
     )
 
 @api_router.post("/auth/verify-otp", response_model=VerifyOTPResponse)
-async def verify_otp(request: VerifyOTPRequest):
+async def verify_otp(request: VerifyOTPRequest, http_request: Request):
     """Verify OTP and return JWT token"""
     phone = request.get_phone_number()
     otp_code = request.get_otp_code()
@@ -666,70 +1341,30 @@ async def verify_otp(request: VerifyOTPRequest):
     
     logging.info(f"Verifying OTP for phone: {phone_formatted}, OTP: {otp_code}")
     
-    # Find latest unexpired OTP using formatted phone
-    otp_record = await db_get_latest_otp(phone_formatted)
+    # Check the OTP, consume it and find or create the user in one step
+    outcome = await db_verify_otp_login(phone_formatted, otp_code, name)
+    status = outcome["status"]
     
-    if not otp_record:
+    if status == "not_found":
         logging.error(f"OTP not found for phone: {phone_formatted}")
         raise HTTPException(status_code=400, detail="OTP expired or not found")
-    
-    # Check attempts
-    if otp_record.get('attempts', 0) >= 5:
+    if status == "too_many_attempts":
         raise HTTPException(status_code=400, detail="Too many attempts. Request new OTP.")
-    
-    # Verify OTP (check both hash and plain for dev mode)
-    is_valid = verify_password(otp_code, otp_record['otp_hash']) or otp_code == otp_record.get('otp_code')
-    
-    if not is_valid:
-        await db_update_otp(otp_record['id'], {"attempts": otp_record.get('attempts', 0) + 1})
+    if status == "invalid":
         logging.error(f"Invalid OTP: {otp_code}")
         raise HTTPException(status_code=400, detail="Invalid OTP")
     
-    # Mark OTP as verified
-    await db_update_otp(otp_record['id'], {"verified_at": datetime.now(timezone.utc).isoformat()})
-    
-    # Find or create user
-    user = await db_get_user_by_phone(phone_formatted)
-    
-    is_new_user = False
-    if not user:
-        is_new_user = True
-        user_id = str(uuid.uuid4())
-        referral_code = generate_referral_code(phone_formatted)
-        
-        user = {
-            "id": user_id,
-            "phone_number": phone_formatted,
-            "owner_name": name or "",  # Save the name provided during signup
-            "phone_verified": True,
-            "shop_name": "",
-            "city": "",
-            "state": "Assam",
-            "pincode": None,
-            "business_category": "print_shop",
-            "referral_code": referral_code,
-            "documents_uploaded": 0,
-            "subscription_status": "free",
-            "monthly_upload_limit": 20,
-            "uploads_used_this_month": 0,
-            "onboarding_completed": False,
-            "trial_started_at": None,
-            "trial_ends_at": None,
-            "created_at": datetime.now(timezone.utc).isoformat(),
-            "updated_at": datetime.now(timezone.utc).isoformat()
-        }
-        await db_create_user(user)
-        logging.info(f"New user created: {user_id}")
+    user = outcome["user"]
+    is_new_user = outcome["is_new_user"]
+    if is_new_user:
+        logging.info(f"New user created: {user['id']}")
     else:
-        # Update name if provided and not already set
-        update_data = {"last_login": datetime.now(timezone.utc).isoformat()}
-        if name and not user.get('owner_name'):
-            update_data["owner_name"] = name
-        await db_update_user(user['id'], update_data)
         logging.info(f"Existing user logged in: {user['id']}")
     
     # Generate JWT token
     token = create_jwt_token(user['id'], phone_formatted)
+    audit_log.record("login", user_id=user['id'], resource_type="user", resource_id=user['id'],
+                     metadata={"new_user": is_new_user}, ip_address=client_ip(http_request))
     
     # Build user profile
     user_profile = UserProfile(
@@ -771,8 +1406,10 @@ async def register_user(request: RegisterRequest, current_user: dict = Depends(g
         "updated_at": datetime.now(timezone.utc).isoformat()
     }
     
-    await db_update_user(user_id, update_data)
-    user = await db_get_user_by_id(user_id)
+    # The updated row, rather than a read that could be served from before the write
+    user = await db_update_user(user_id, update_data)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
     
     return {
         "success": True,
@@ -788,98 +1425,248 @@ async def register_user(request: RegisterRequest, current_user: dict = Depends(g
 
 # ==================== DOCUMENT ENDPOINTS ====================
 
-@api_router.post("/documents/upload")
-async def upload_document(
-    file: UploadFile = File(...),
-    customer_name: str = Form(..., alias="customerName"),
-    customer_phone: Optional[str] = Form(None, alias="customerPhone"),
-    customer_email: Optional[str] = Form(None, alias="customerEmail"),
-    order_details: Optional[str] = Form(None, alias="orderDetails"),
-    due_date: Optional[str] = Form(None, alias="dueDate"),
-    one_time_view: bool = Form(False, alias="oneTimeView"),
-    delete_after_minutes: int = Form(5, alias="deleteAfterMinutes"),
-    allow_download: bool = Form(True, alias="allowDownload"),
-    current_user: dict = Depends(get_current_user)
-):
-    """Upload document with auto-delete"""
-    user_id = current_user['id']
-    
-    # Check upload limit
-    upload_limit = current_user.get('monthly_upload_limit', 20)
-    uploads_used = current_user.get('uploads_used_this_month', 0)
+def publish_document_event(event_type: str, doc: dict, **data):
+    """Push a document event to the owning merchant's open dashboards"""
+    event_bus.publish(doc['user_id'], event_type, {
+        "documentId": doc['id'],
+        "documentName": doc.get('document_name'),
+        "customerUploaded": doc.get('customer_uploaded', False),
+        **data
+    })
+
+def check_upload_quota(user: dict):
+    """Reject uploads once the monthly limit is used up"""
+    upload_limit = user.get('monthly_upload_limit', 20)
+    uploads_used = user.get('uploads_used_this_month', 0)
     
     if uploads_used >= upload_limit:
         raise HTTPException(status_code=400, detail="Monthly upload limit reached. Please upgrade your plan.")
-    
-    # Validate file size
-    file_content = await file.read()
-    if len(file_content) > 52428800:  # 50MB
-        raise HTTPException(status_code=400, detail="File too large. Maximum size is 50MB.")
-    
-    document_id = str(uuid.uuid4())
-    share_link_uuid = str(uuid.uuid4())
-    auto_delete_at = datetime.now(timezone.utc) + timedelta(minutes=delete_after_minutes)
-    
-    # Store file content (in production, use Supabase Storage)
-    file_storage_key = f"docs/{document_id}/{file.filename}"
-    
-    if supabase_client:
-        # Upload to Supabase Storage
-        try:
-            supabase_client.storage.from_('documents').upload(file_storage_key, file_content)
-        except Exception as e:
-            logging.error(f"Failed to upload to Supabase Storage: {e}")
-            mock_db["files"][file_storage_key] = file_content
-    else:
-        mock_db["files"][file_storage_key] = file_content
-    
-    # Create document record
-    doc_record = {
-        "id": document_id,
+
+def build_merchant_document(user_id: str, blob, document_name: str, document_type: str, details: DocumentDetails) -> dict:
+    """Document record for a stored merchant upload"""
+    auto_delete_at = datetime.now(timezone.utc) + timedelta(minutes=details.delete_after_minutes)
+    return {
+        "id": str(uuid.uuid4()),
         "user_id": user_id,
-        "document_name": file.filename,
-        "document_type": file.content_type,
-        "file_size_bytes": len(file_content),
-        "file_storage_key": file_storage_key,
-        "shared_link": share_link_uuid,
+        "document_name": document_name,
+        "document_type": document_type,
+        "file_size_bytes": blob.size_bytes,
+        "file_storage_key": blob.storage_key,
+        "content_sha256": blob.sha256,
+        "shared_link": str(uuid.uuid4()),
         "share_link_expires_at": auto_delete_at.isoformat(),
         "share_view_count": 0,
-        "one_time_view": one_time_view,
-        "allow_merchant_download": allow_download,
-        "customer_name": customer_name,
-        "customer_phone": customer_phone,
-        "customer_email": customer_email,
-        "order_details": order_details,
-        "due_date": due_date,
+        "one_time_view": details.one_time_view,
+        "allow_merchant_download": details.allow_download,
+        "customer_name": details.customer_name,
+        "customer_phone": details.customer_phone,
+        "customer_email": details.customer_email,
+        "order_details": details.order_details,
+        "due_date": details.due_date,
         "status": "active",
         "auto_delete_at": auto_delete_at.isoformat(),
         "created_at": datetime.now(timezone.utc).isoformat(),
         "updated_at": datetime.now(timezone.utc).isoformat()
     }
+
+def merchant_document_response(doc_record: dict, details: DocumentDetails, qr_code: Optional[str] = None) -> dict:
+    """API shape of a freshly uploaded merchant document, with its share QR code"""
+    share_url = f"https://bharatprint.app/view/{doc_record['shared_link']}"
+    return {
+        "id": doc_record['id'],
+        "documentName": doc_record['document_name'],
+        "sharedLink": share_url,
+        "qrCode": qr_code or generate_qr_code(share_url),
+        "expiresIn": details.delete_after_minutes * 60,
+        "shareCount": 0,
+        "createdAt": doc_record['created_at']
+    }
+
+async def run_upload_steps(blob, doc_record: dict, stats_increments: dict, share_url: Optional[str] = None) -> Optional[str]:
+    """Run the steps that follow storing an upload concurrently, undoing them if the insert fails
+
+    The row insert, the stats and preview jobs and the share QR code do not
+    depend on each other, so an upload waits for the slowest of them rather
+    than their sum; the QR code renders in a worker thread. When the insert
+    fails the blob reference is released (removing an object no other document
+    shares), queued stats are reversed and the request fails. A preview job for
+    a removed blob finds nothing and ends. The metadata job updates the row, so
+    it is queued only once the insert has succeeded. Returns the QR code, if
+    asked for.
+    """
+    steps = {
+        "insert": db_create_document(doc_record),
+        "stats": job_queue.enqueue("user_stats", {"user_id": doc_record['user_id'], "increments": stats_increments}),
+        "previews": schedule_previews(blob, doc_record['document_type'])
+    }
+    if share_url:
+        steps["qr"] = asyncio.to_thread(generate_qr_code, share_url)
+    outcomes = dict(zip(steps, await asyncio.gather(*steps.values(), return_exceptions=True)))
     
-    await db_create_document(doc_record)
+    if isinstance(outcomes["insert"], Exception):
+        logging.error(f"Document insert failed, undoing upload of {blob.storage_key}: {outcomes['insert']}")
+        try:
+            await blob_store.release(blob.storage_key)
+            if not isinstance(outcomes["stats"], Exception):
+                await job_queue.enqueue("user_stats", {
+                    "user_id": doc_record['user_id'],
+                    "increments": {field: -increment for field, increment in stats_increments.items()}
+                })
+        except Exception as e:
+            logging.error(f"Undoing upload of {blob.storage_key} failed: {e}")
+        if isinstance(outcomes["insert"], CircuitOpenError):
+            raise outcomes["insert"]
+        raise HTTPException(status_code=500, detail="Failed to save uploaded document")
     
-    # Update user stats
-    await db_update_user(user_id, {
-        "documents_uploaded": current_user.get('documents_uploaded', 0) + 1,
-        "uploads_used_this_month": uploads_used + 1
-    })
+    # The document exists from here on, so a lost side effect is logged rather than failing the upload
+    try:
+        await schedule_metadata(doc_record)
+    except Exception as e:
+        outcomes["metadata"] = e
+    for name in ("stats", "previews", "metadata"):
+        if isinstance(outcomes.get(name), Exception):
+            logging.error(f"Upload step {name} failed for document {doc_record['id']}: {outcomes[name]}")
+    if isinstance(outcomes.get("qr"), Exception):
+        logging.error(f"QR code rendering failed for document {doc_record['id']}: {outcomes['qr']}")
+        return None
+    return outcomes.get("qr")
+
+async def create_merchant_document(current_user: dict, blob, document_name: str, document_type: str, details: DocumentDetails):
+    """Create the document record for a stored merchant upload and build the API response"""
+    user_id = current_user['id']
+    doc_record = build_merchant_document(user_id, blob, document_name, document_type, details)
     
-    # Generate QR code
-    share_url = f"https://bharatprint.app/view/{share_link_uuid}"
-    qr_code = generate_qr_code(share_url)
+    qr_code = await run_upload_steps(
+        blob, doc_record, {"documents_uploaded": 1, "uploads_used_this_month": 1},
+        share_url=f"https://bharatprint.app/view/{doc_record['shared_link']}"
+    )
+    audit_log.record("document_upload", user_id=user_id, resource_type="document", resource_id=doc_record['id'],
+                     metadata={"size_bytes": blob.size_bytes, "deduplicated": blob.deduplicated})
+    publish_document_event("document.uploaded", doc_record)
     
     return {
         "success": True,
-        "document": {
-            "id": document_id,
-            "documentName": file.filename,
-            "sharedLink": share_url,
-            "qrCode": qr_code,
-            "expiresIn": delete_after_minutes * 60,
-            "shareCount": 0,
-            "createdAt": doc_record['created_at']
-        }
+        "document": merchant_document_response(doc_record, details, qr_code)
+    }
+
+@api_router.post("/documents/upload")
+async def upload_document(
+    file: UploadFile = File(...),
+    customer_name: str = Form(..., alias="customerName"),
+    customer_phone: Optional[str] = Form(None, alias="customerPhone"),
+    customer_email: Optional[str] = Form(None, alias="customerEmail"),
+    order_details: Optional[str] = Form(None, alias="orderDetails"),
+    due_date: Optional[str] = Form(None, alias="dueDate"),
+    one_time_view: bool = Form(False, alias="oneTimeView"),
+    delete_after_minutes: int = Form(5, alias="deleteAfterMinutes"),
+    allow_download: bool = Form(True, alias="allowDownload"),
+    current_user: dict = Depends(get_current_user)
+):
+    """Upload document with auto-delete"""
+    # Check upload limit
+    check_upload_quota(current_user)
+    
+    # Store file content (deduplicated by content hash, size validated while streaming)
+    try:
+        blob = await blob_store.put(file, MAX_UPLOAD_BYTES)
+    except BlobTooLargeError:
+        raise HTTPException(status_code=400, detail="File too large. Maximum size is 50MB.")
+    
+    details = DocumentDetails(
+        customer_name=customer_name,
+        customer_phone=customer_phone,
+        customer_email=customer_email,
+        order_details=order_details,
+        due_date=due_date,
+        one_time_view=one_time_view,
+        delete_after_minutes=delete_after_minutes,
+        allow_download=allow_download
+    )
+    return await create_merchant_document(current_user, blob, file.filename, file.content_type, details)
+
+def start_direct_upload(request: DirectUploadRequest, claims: dict):
+    """Validate a direct upload request and presign a PUT to a staging key"""
+    if not s3_client:
+        raise HTTPException(status_code=501, detail="Direct uploads are not enabled. Use the regular upload endpoint.")
+    if request.file_size <= 0 or request.file_size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=400, detail="File too large. Maximum size is 50MB.")
+    sha256 = request.sha256.lower()
+    if len(sha256) != 64 or any(c not in '0123456789abcdef' for c in sha256):
+        raise HTTPException(status_code=400, detail="sha256 must be a hex-encoded SHA-256 digest")
+    
+    # Staged objects that are never completed should be expired by a bucket lifecycle rule on incoming/
+    staging_key = f"incoming/{uuid.uuid4()}"
+    upload = object_storage.presign_put(
+        staging_key, request.content_type, request.file_size, sha256, DIRECT_UPLOAD_URL_TTL_SECONDS
+    )
+    token = create_upload_token({
+        **claims,
+        'key': staging_key,
+        'name': request.file_name,
+        'type': request.content_type,
+        'size': request.file_size,
+        'sha256': sha256
+    })
+    return {
+        "success": True,
+        "uploadToken": token,
+        "upload": upload,
+        "expiresIn": DIRECT_UPLOAD_URL_TTL_SECONDS
+    }
+
+async def finish_direct_upload(claims: dict):
+    """Verify a directly uploaded object and adopt it as a blob"""
+    if not s3_client:
+        raise HTTPException(status_code=501, detail="Direct uploads are not enabled. Use the regular upload endpoint.")
+    try:
+        verified = object_storage.verify(claims['key'], claims['size'], claims['sha256'])
+    except Exception as e:
+        logging.error(f"Direct upload verification failed: {e}")
+        raise HTTPException(status_code=400, detail="Uploaded file not found. Please upload it before completing.")
+    if not verified:
+        raise HTTPException(status_code=400, detail="Uploaded file does not match the declared size and hash")
+    
+    return await blob_store.adopt(claims['key'], claims['sha256'], claims['size'])
+
+@api_router.post("/documents/direct-upload")
+async def create_direct_upload(request: DirectUploadRequest, current_user: dict = Depends(get_current_user)):
+    """Phase 1 of a direct upload: check quota and return a presigned PUT URL"""
+    check_upload_quota(current_user)
+    return start_direct_upload(request, {'sub': current_user['id']})
+
+@api_router.post("/documents/direct-upload/complete")
+async def complete_direct_upload(
+    request: CompleteDirectUploadRequest,
+    current_user: dict = Depends(get_current_user)
+):
+    """Phase 2 of a direct upload: verify the stored object and create the document"""
+    claims = decode_upload_token(request.upload_token)
+    if claims.get('sub') != current_user['id']:
+        raise HTTPException(status_code=403, detail="Upload belongs to another user")
+    check_upload_quota(current_user)
+    
+    blob = await finish_direct_upload(claims)
+    return await create_merchant_document(current_user, blob, claims['name'], claims['type'], request)
+
+def document_list_item(doc: dict) -> dict:
+    """API shape of a document in lists and search results"""
+    # Handle documents that may not have shared_link (e.g., customer uploads)
+    shared_link = doc.get('shared_link')
+    shared_url = f"https://bharatprint.app/view/{shared_link}" if shared_link else None
+    
+    return {
+        "id": doc['id'],
+        "documentName": doc['document_name'],
+        "customerName": doc.get('customer_name', ''),
+        "customerPhone": doc.get('customer_phone', ''),
+        "orderDetails": doc.get('order_details'),
+        "fileSize": doc['file_size_bytes'],
+        "shareCount": doc['share_view_count'],
+        "sharedLink": shared_url,
+        "expiresAt": doc.get('share_link_expires_at'),
+        "createdAt": doc['created_at'],
+        "status": doc['status'],
+        "fileMetadata": file_metadata.metadata_response(doc.get('file_metadata'))
     }
 
 @api_router.get("/documents/list")
@@ -894,32 +1681,72 @@ async def list_documents(
     total = await db_count_documents_by_user(user_id)
     documents = await db_get_documents_by_user(user_id, limit, offset)
     
-    formatted_docs = []
-    for doc in documents:
-        # Handle documents that may not have shared_link (e.g., customer uploads)
-        shared_link = doc.get('shared_link')
-        shared_url = f"https://bharatprint.app/view/{shared_link}" if shared_link else None
-        
-        formatted_docs.append({
-            "id": doc['id'],
-            "documentName": doc['document_name'],
-            "customerName": doc.get('customer_name', ''),
-            "customerPhone": doc.get('customer_phone', ''),
-            "fileSize": doc['file_size_bytes'],
-            "shareCount": doc['share_view_count'],
-            "sharedLink": shared_url,
-            "expiresAt": doc.get('share_link_expires_at'),
-            "createdAt": doc['created_at'],
-            "status": doc['status']
-        })
-    
     return {
         "success": True,
-        "documents": formatted_docs,
+        "documents": [document_list_item(doc) for doc in documents],
         "total": total,
         "hasMore": (offset + limit) < total
     }
 
+def parse_timestamp_param(value: Optional[str], name: str) -> Optional[str]:
+    """Normalise an ISO 8601 query parameter to UTC (naive times are taken as UTC)"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{name} must be an ISO 8601 timestamp")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc).isoformat()
+
+@api_router.get("/documents/search")
+async def search_documents(
+    q: str,
+    created_after: Optional[str] = Query(None, alias="createdAfter"),
+    created_before: Optional[str] = Query(None, alias="createdBefore"),
+    limit: int = 20,
+    current_user: dict = Depends(get_current_user)
+):
+    """Find documents by customer name, phone or order details (every word must match a word prefix)"""
+    if not search_words(q):
+        raise HTTPException(status_code=400, detail="Enter a name, phone number or order detail to search for")
+    documents = await db_search_documents(
+        current_user['id'], q,
+        parse_timestamp_param(created_after, "createdAfter"),
+        parse_timestamp_param(created_before, "createdBefore"),
+        max(1, min(limit, MAX_SEARCH_RESULTS))
+    )
+    return {
+        "success": True,
+        "documents": [document_list_item(doc) for doc in documents],
+        "count": len(documents)
+    }
+
+@api_router.get("/documents/export")
+async def export_documents(
+    http_request: Request,
+    format: str = "csv",
+    gzip: bool = False,
+    current_user: dict = Depends(get_current_user)
+):
+    """Stream the merchant's whole document history as CSV or NDJSON, optionally gzipped"""
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format. Use one of: {', '.join(EXPORT_FORMATS)}")
+    user_id = current_user['id']
+    media_type, extension = EXPORT_FORMATS[format]
+    filename = f"bharatprint-documents-{datetime.now(timezone.utc):%Y%m%d}.{extension}"
+    if gzip:
+        media_type, filename = "application/gzip", f"{filename}.gz"
+    
+    audit_log.record("document_export", user_id=user_id, resource_type="document",
+                     metadata={"format": format, "gzip": gzip}, ip_address=client_ip(http_request))
+    return StreamingResponse(
+        stream_export(db_iter_document_history(user_id), format, gzip),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={filename}", "Cache-Control": "no-store"}
+    )
+
 @api_router.get("/documents/{document_id}")
 async def get_document(document_id: str, current_user: dict = Depends(get_current_user)):
     """Get single document details"""
@@ -943,12 +1770,26 @@ async def get_document(document_id: str, current_user: dict = Depends(get_curren
             "shareCount": doc['share_view_count'],
             "sharedLink": f"https://bharatprint.app/view/{doc['shared_link']}",
             "expiresAt": doc['share_link_expires_at'],
-            "createdAt": doc['created_at']
+            "createdAt": doc['created_at'],
+            "fileMetadata": file_metadata.metadata_response(doc.get('file_metadata'))
         }
     }
 
+def check_share_active(doc: dict):
+    """Reject share links of deleted or expired documents (their blob may live on for other documents)"""
+    if doc.get('status', 'active') != 'active':
+        raise HTTPException(status_code=410, detail="Document has been deleted or expired")
+
+def check_share_expiry(doc: dict) -> datetime:
+    """Reject expired share links, returning the expiry time"""
+    check_share_active(doc)
+    expires_at = datetime.fromisoformat(doc['share_link_expires_at'].replace('Z', '+00:00'))
+    if expires_at < datetime.now(timezone.utc):
+        raise HTTPException(status_code=410, detail="Document has expired")
+    return expires_at
+
 @api_router.get("/documents/public/{share_link}")
-async def view_shared_document(share_link: str):
+async def view_shared_document(share_link: str, request: Request):
     """View shared document (public, no auth)"""
     doc = await db_get_document_by_share_link(share_link)
     
@@ -956,19 +1797,19 @@ async def view_shared_document(share_link: str):
         raise HTTPException(status_code=404, detail="Document not found or expired")
     
     # Check if expired
-    expires_at = datetime.fromisoformat(doc['share_link_expires_at'].replace('Z', '+00:00'))
-    if expires_at < datetime.now(timezone.utc):
-        raise HTTPException(status_code=410, detail="Document has expired")
+    expires_at = check_share_expiry(doc)
     
-    # Check one-time view
-    if doc.get('one_time_view') and doc['share_view_count'] > 0:
+    # Increment view count; refused once a one-time view has been used
+    doc = await db_record_share_view(doc['id'])
+    if not doc:
         raise HTTPException(status_code=410, detail="Document was a one-time view and has been accessed")
-    
-    # Increment view count
-    await db_update_document(doc['id'], {"share_view_count": doc['share_view_count'] + 1})
+    audit_log.record("document_view", user_id=doc['user_id'], resource_type="document", resource_id=doc['id'],
+                     ip_address=client_ip(request))
+    publish_document_event("document.viewed", doc, viewCount=doc['share_view_count'])
     
     # Calculate remaining time in seconds
     time_remaining = int((expires_at - datetime.now(timezone.utc)).total_seconds())
+    previewable = previews.is_previewable(doc['document_type'])
     
     return {
         "success": True,
@@ -981,67 +1822,279 @@ async def view_shared_document(share_link: str):
             "oneTimeView": doc.get('one_time_view', False),
             "fileName": doc['document_name'],
             "fileType": doc['document_type'],
-            "allowDownload": doc.get('allow_merchant_download', True)
+            "allowDownload": doc.get('allow_merchant_download', True),
+            "thumbnailUrl": f"/api/documents/preview/{share_link}?variant=thumb" if previewable else None,
+            "previewUrl": f"/api/documents/preview/{share_link}" if previewable else None
         }
     }
 
-@api_router.get("/documents/download/{share_link}")
-async def download_document(share_link: str):
-    """Download shared document"""
+@api_router.get("/documents/preview/{share_link}")
+async def preview_shared_document(share_link: str, variant: str = "preview"):
+    """Small JPEG preview of a shared document (public, no auth)"""
+    if variant not in previews.VARIANTS:
+        raise HTTPException(status_code=400, detail=f"Unknown preview variant: {variant}")
+    
     doc = await db_get_document_by_share_link(share_link)
     
     if not doc:
-        raise HTTPException(status_code=404, detail="Document not found")
+        raise HTTPException(status_code=404, detail="Document not found or expired")
     
-    # Get file content
-    file_storage_key = doc.get('file_storage_key')
-    file_content = None
+    # Previews belong to the same viewing session, so one-time views don't consume them
+    check_share_expiry(doc)
     
-    if supabase_client:
-        try:
-            file_content = supabase_client.storage.from_('documents').download(file_storage_key)
-        except:
-            file_content = mock_db["files"].get(file_storage_key)
+    image = await blob_store.read_sidecar(doc['file_storage_key'], f"{variant}.jpg")
+    if not image:
+        raise HTTPException(status_code=404, detail="Preview not available")
+    
+    return Response(
+        content=image,
+        media_type=previews.PREVIEW_CONTENT_TYPE,
+        headers={"Cache-Control": "private, max-age=300"}
+    )
+
+def parse_byte_range(header: Optional[str], size: int) -> Optional[tuple]:
+    """[start, end) for a single-range Range header, None to send the whole file
+
+    Raises 416 when the range lies outside the file.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[len("bytes="):].strip().partition("-")
+    try:
+        if not first:
+            start, end = max(0, size - int(last)), size  # suffix: the last N bytes
+        else:
+            start = int(first)
+            end = min(int(last) + 1, size) if last else size
+    except ValueError:
+        return None
+    if start >= end:
+        raise HTTPException(status_code=416, detail="Requested range not satisfiable",
+                            headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+@api_router.get("/documents/download/{share_link}")
+async def download_document(share_link: str, request: Request):
+    """Download shared document (a single byte range of uncompressed files is honoured)"""
+    doc = await db_get_document_by_share_link(share_link)
+    
+    if not doc:
+        raise HTTPException(status_code=404, detail="Document not found")
+    check_share_active(doc)
+    
+    storage_key = doc.get('file_storage_key')
+    size = doc.get('file_size_bytes')
+    headers = {"Content-Disposition": f"attachment; filename={doc['document_name']}"}
+    byte_range = None
+    if blob_store.supports_ranges(storage_key) and size is not None:
+        headers["Accept-Ranges"] = "bytes"
+        byte_range = parse_byte_range(request.headers.get("range"), size)
+    
+    # Get file content (decrypted and decompressed as it streams out; a range reads only the chunks covering it)
+    if byte_range:
+        start, end = byte_range
+        file_stream = await blob_store.stream_range(storage_key, start, end)
+        headers["Content-Range"] = f"bytes {start}-{end - 1}/{size}"
+        headers["Content-Length"] = str(end - start)
     else:
-        file_content = mock_db["files"].get(file_storage_key)
+        file_stream = await blob_store.stream(storage_key)
     
-    if not file_content:
+    if not file_stream:
         raise HTTPException(status_code=404, detail="File not found")
     
+    # Follow-up range requests of the same download are not separate downloads
+    if not byte_range or byte_range[0] == 0:
+        audit_log.record("document_download", user_id=doc['user_id'], resource_type="document", resource_id=doc['id'],
+                         ip_address=client_ip(request))
     return StreamingResponse(
-        io.BytesIO(file_content),
+        file_stream,
+        status_code=206 if byte_range else 200,
         media_type=doc['document_type'],
-        headers={"Content-Disposition": f"attachment; filename={doc['document_name']}"}
+        headers=headers
     )
 
 @api_router.delete("/documents/{document_id}")
-async def delete_document(document_id: str, current_user: dict = Depends(get_current_user)):
+async def delete_document(document_id: str, request: Request, current_user: dict = Depends(get_current_user)):
     """Delete document manually"""
     doc = await db_get_document_by_id(document_id, current_user['id'])
     
     if not doc:
         raise HTTPException(status_code=404, detail="Document not found")
     
-    # Delete from storage
-    file_storage_key = doc.get('file_storage_key')
-    if supabase_client and file_storage_key:
-        try:
-            supabase_client.storage.from_('documents').remove([file_storage_key])
-        except:
-            pass
+    # Only a still-active document gives up its blob reference, so a repeated DELETE cannot release it twice
+    if not await db_delete_documents(current_user['id'], [document_id]):
+        raise HTTPException(status_code=404, detail="Document not found")
+    # Release the stored blob (removed from storage once no document references it)
+    await job_queue.enqueue("release_blob", {"storage_key": doc.get('file_storage_key')})
+    audit_log.record("document_delete", user_id=current_user['id'], resource_type="document", resource_id=document_id,
+                     ip_address=client_ip(request))
+    publish_document_event("document.deleted", doc)
     
-    if file_storage_key in mock_db["files"]:
-        del mock_db["files"][file_storage_key]
+    return {"success": True, "message": "Document deleted successfully"}
+
+# ==================== BULK DELETE ENDPOINTS ====================
+
+def bulk_delete_response(operation: dict) -> dict:
+    """API shape of a bulk delete and its progress"""
+    return {
+        "operationId": operation['id'],
+        "status": operation['status'],
+        "total": operation.get('total'),
+        "deleted": operation.get('deleted', 0),
+        "error": operation.get('error'),
+        "createdAt": operation.get('created_at'),
+        "finishedAt": operation.get('finished_at')
+    }
+
+async def report_bulk_delete(operation_id: str, user_id: str, update_data: dict):
+    """Record a bulk delete's progress and push it to the merchant's open dashboards"""
+    update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
+    operation = await db_update_bulk_delete(operation_id, update_data)
+    if operation:
+        event_bus.publish(user_id, "documents.bulk_delete", bulk_delete_response(operation))
+
+def selection_batches(selection: dict):
+    """The selection split so each query carries at most BULK_DELETE_BATCH_SIZE ids"""
+    if 'document_ids' not in selection:
+        return [selection]
+    ids = selection['document_ids']
+    return [
+        {**selection, 'document_ids': ids[start:start + BULK_DELETE_BATCH_SIZE]}
+        for start in range(0, len(ids), BULK_DELETE_BATCH_SIZE)
+    ]
+
+@job_queue.job("bulk_delete", max_attempts=3, retry_delay=30)
+async def bulk_delete_job(payload: dict):
+    """Delete the documents of a bulk delete a batch at a time, reporting progress after each batch
+
+    Each batch is one select, one set-based update and one queued release of
+    the batch's blobs. A retry picks up where the last attempt stopped: deleted
+    documents no longer match the selection.
+    """
+    operation_id, user_id, selection = payload['operation_id'], payload['user_id'], payload['selection']
+    operation = await db_get_bulk_delete(operation_id, user_id)
+    if not operation or operation['status'] == 'done':
+        return
+    deleted = operation.get('deleted') or 0
     
-    await db_update_document(document_id, {
-        "status": "deleted",
-        "deleted_at": datetime.now(timezone.utc).isoformat()
+    try:
+        batches = selection_batches(selection)
+        remaining = 0
+        for batch in batches:
+            remaining += await db_count_selected_documents(user_id, batch)
+        await report_bulk_delete(operation_id, user_id, {"status": "running", "total": deleted + remaining, "error": None})
+        
+        for batch in batches:
+            while True:
+                docs = await db_get_selected_documents(user_id, batch, BULK_DELETE_BATCH_SIZE)
+                if not docs:
+                    break
+                removed = await db_delete_documents(user_id, [doc['id'] for doc in docs])
+                if removed:
+                    await job_queue.enqueue("release_blobs", {"storage_keys": [doc.get('file_storage_key') for doc in removed]})
+                    deleted += len(removed)
+                    await report_bulk_delete(operation_id, user_id, {"deleted": deleted})
+                if len(docs) < BULK_DELETE_BATCH_SIZE:
+                    break
+    except Exception as e:
+        await report_bulk_delete(operation_id, user_id, {"status": "failed", "error": str(e)})
+        raise
+    
+    await report_bulk_delete(operation_id, user_id, {
+        "status": "done",
+        "deleted": deleted,
+        "finished_at": datetime.now(timezone.utc).isoformat()
     })
+    logging.info(f"Bulk delete {operation_id} removed {deleted} documents")
+
+@api_router.post("/documents/bulk-delete", status_code=202)
+async def bulk_delete_documents(request: BulkDeleteRequest, http_request: Request, current_user: dict = Depends(get_current_user)):
+    """Delete many documents in the background: by id, created before a time and/or customer uploads only"""
+    user_id = current_user['id']
+    selection = request.model_dump(exclude_none=True)
+    if not selection:
+        raise HTTPException(status_code=400, detail="Select documents by documentIds, createdBefore or customerUploaded")
+    if 'document_ids' in selection:
+        selection['document_ids'] = list(dict.fromkeys(selection['document_ids']))
+        if not selection['document_ids']:
+            raise HTTPException(status_code=400, detail="documentIds is empty")
+        if len(selection['document_ids']) > MAX_BULK_DELETE_IDS:
+            raise HTTPException(status_code=400, detail=f"Too many documents. Maximum is {MAX_BULK_DELETE_IDS} ids per request.")
+    if 'created_before' in selection:
+        selection['created_before'] = parse_timestamp_param(selection['created_before'], "createdBefore")
     
-    return {"success": True, "message": "Document deleted successfully"}
+    now = datetime.now(timezone.utc).isoformat()
+    operation = {
+        "id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "selection": selection,
+        "status": "queued",
+        "total": None,
+        "deleted": 0,
+        "error": None,
+        "created_at": now,
+        "updated_at": now,
+        "finished_at": None
+    }
+    await db_create_bulk_delete(operation)
+    await job_queue.enqueue("bulk_delete", {"operation_id": operation['id'], "user_id": user_id, "selection": selection})
+    audit_log.record("document_bulk_delete", user_id=user_id, resource_type="document",
+                     metadata={"operation_id": operation['id'], "ids": len(selection.get('document_ids', [])),
+                               **{key: value for key, value in selection.items() if key != 'document_ids'}},
+                     ip_address=client_ip(http_request))
+    
+    return {"success": True, **bulk_delete_response(operation)}
+
+@api_router.get("/documents/bulk-delete/{operation_id}")
+async def get_bulk_delete(operation_id: str, current_user: dict = Depends(get_current_user)):
+    """Status and progress of a bulk delete"""
+    operation = await db_get_bulk_delete(operation_id, current_user['id'])
+    if not operation:
+        raise HTTPException(status_code=404, detail="Bulk delete not found")
+    return {"success": True, **bulk_delete_response(operation)}
 
 # ==================== CUSTOMER UPLOAD ENDPOINT ====================
 
+def build_customer_document(merchant_id: str, blob, document_name: str, document_type: str, self_destruct_minutes: int, allow_merchant_download: bool) -> dict:
+    """Document record for a stored customer upload"""
+    auto_delete_at = datetime.now(timezone.utc) + timedelta(minutes=self_destruct_minutes)
+    return {
+        "id": str(uuid.uuid4()),
+        "user_id": merchant_id,
+        "document_name": document_name,
+        "document_type": document_type,
+        "file_size_bytes": blob.size_bytes,
+        "file_storage_key": blob.storage_key,
+        "content_sha256": blob.sha256,
+        "customer_uploaded": True,
+        "allow_merchant_download": allow_merchant_download,
+        "self_destruct_minutes": self_destruct_minutes,
+        "status": "active",
+        "share_view_count": 0,
+        "auto_delete_at": auto_delete_at.isoformat(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "updated_at": datetime.now(timezone.utc).isoformat()
+    }
+
+async def create_customer_document(merchant: dict, blob, document_name: str, document_type: str, self_destruct_minutes: int, allow_merchant_download: bool):
+    """Create the document record for a stored customer upload and build the API response"""
+    doc_record = build_customer_document(
+        merchant['id'], blob, document_name, document_type, self_destruct_minutes, allow_merchant_download
+    )
+    
+    await run_upload_steps(blob, doc_record, {"documents_uploaded": 1})
+    audit_log.record("document_upload", user_id=merchant['id'], resource_type="document", resource_id=doc_record['id'],
+                     metadata={"size_bytes": blob.size_bytes, "deduplicated": blob.deduplicated, "customer_uploaded": True})
+    publish_document_event("document.uploaded", doc_record)
+    
+    return {
+        "success": True,
+        "message": "Document uploaded successfully",
+        "documentId": doc_record['id'],
+        "selfDestructIn": self_destruct_minutes,
+        "merchantShop": merchant.get('shop_name', 'Print Shop')
+    }
+
 @api_router.post("/documents/customer-upload/{merchant_code}")
 async def customer_upload_document(
     merchant_code: str,
@@ -1055,57 +2108,381 @@ async def customer_upload_document(
     if not merchant:
         raise HTTPException(status_code=404, detail="Merchant not found")
     
-    # Validate file
-    file_content = await file.read()
-    if len(file_content) > 52428800:
+    # Validate and store file
+    try:
+        blob = await blob_store.put(file, MAX_UPLOAD_BYTES)
+    except BlobTooLargeError:
         raise HTTPException(status_code=400, detail="File too large. Maximum size is 50MB.")
     
-    document_id = str(uuid.uuid4())
-    auto_delete_at = datetime.now(timezone.utc) + timedelta(minutes=self_destruct_minutes)
+    return await create_customer_document(
+        merchant, blob, file.filename, file.content_type, self_destruct_minutes, allow_merchant_download
+    )
+
+@api_router.post("/documents/customer-upload/{merchant_code}/direct-upload")
+async def create_customer_direct_upload(merchant_code: str, request: DirectUploadRequest):
+    """Phase 1 of a customer direct upload: return a presigned PUT URL (no auth required)"""
+    merchant = await db_get_user_by_merchant_code(merchant_code)
+    if not merchant:
+        raise HTTPException(status_code=404, detail="Merchant not found")
+    return start_direct_upload(request, {'merchant_id': merchant['id']})
+
+@api_router.post("/documents/customer-upload/{merchant_code}/direct-upload/complete")
+async def complete_customer_direct_upload(
+    merchant_code: str,
+    request: CompleteCustomerDirectUploadRequest
+):
+    """Phase 2 of a customer direct upload: verify the stored object and create the document"""
+    claims = decode_upload_token(request.upload_token)
+    merchant = await db_get_user_by_merchant_code(merchant_code)
+    if not merchant or claims.get('merchant_id') != merchant['id']:
+        raise HTTPException(status_code=404, detail="Merchant not found")
     
-    # Store file
-    file_storage_key = f"customer-uploads/{document_id}/{file.filename}"
-    if supabase_client:
+    blob = await finish_direct_upload(claims)
+    return await create_customer_document(
+        merchant, blob, claims['name'], claims['type'],
+        request.self_destruct_minutes, request.allow_merchant_download
+    )
+
+# ==================== BATCH UPLOAD ENDPOINTS ====================
+
+async def store_batch(files: List[UploadFile]) -> list:
+    """Store files concurrently (bounded), returning a blob or an error message per file"""
+    semaphore = asyncio.Semaphore(BATCH_UPLOAD_CONCURRENCY)
+    
+    async def store(file: UploadFile):
+        async with semaphore:
+            try:
+                blob = await blob_store.put(file, MAX_UPLOAD_BYTES)
+            except BlobTooLargeError:
+                return "File too large. Maximum size is 50MB."
+            except Exception as e:
+                logging.error(f"Batch upload of {file.filename} failed: {e}")
+                return "Failed to store file"
+            await schedule_previews(blob, file.content_type)
+            return blob
+    
+    return await asyncio.gather(*(store(file) for file in files))
+
+async def insert_batch_documents(records: list, blobs: list):
+    """Bulk insert document rows, releasing the stored blobs if the insert fails"""
+    try:
+        await db_create_documents(records)
+    except Exception as e:
+        logging.error(f"Batch document insert failed: {e}")
         try:
-            supabase_client.storage.from_('documents').upload(file_storage_key, file_content)
-        except:
-            mock_db["files"][file_storage_key] = file_content
-    else:
-        mock_db["files"][file_storage_key] = file_content
-    
-    # Create document record
-    doc_record = {
-        "id": document_id,
-        "user_id": merchant['id'],
-        "document_name": file.filename,
-        "document_type": file.content_type,
-        "file_size_bytes": len(file_content),
-        "file_storage_key": file_storage_key,
-        "customer_uploaded": True,
-        "allow_merchant_download": allow_merchant_download,
-        "self_destruct_minutes": self_destruct_minutes,
-        "status": "active",
-        "share_view_count": 0,
-        "auto_delete_at": auto_delete_at.isoformat(),
-        "created_at": datetime.now(timezone.utc).isoformat(),
-        "updated_at": datetime.now(timezone.utc).isoformat()
+            await blob_store.release_many([blob.storage_key for blob in blobs])
+        except Exception as release_error:
+            logging.error(f"Undoing batch upload of {len(blobs)} blobs failed: {release_error}")
+        raise HTTPException(status_code=500, detail="Failed to save uploaded documents")
+    
+    for doc_record, blob in zip(records, blobs):
+        audit_log.record("document_upload", user_id=doc_record['user_id'], resource_type="document", resource_id=doc_record['id'],
+                         metadata={"size_bytes": blob.size_bytes, "deduplicated": blob.deduplicated,
+                                   "customer_uploaded": doc_record.get('customer_uploaded', False), "batch": True})
+        publish_document_event("document.uploaded", doc_record, batch=True)
+        await schedule_metadata(doc_record)
+
+@api_router.post("/documents/upload-batch")
+async def upload_documents_batch(
+    files: List[UploadFile] = File(...),
+    customer_name: str = Form(..., alias="customerName"),
+    customer_phone: Optional[str] = Form(None, alias="customerPhone"),
+    customer_email: Optional[str] = Form(None, alias="customerEmail"),
+    order_details: Optional[str] = Form(None, alias="orderDetails"),
+    due_date: Optional[str] = Form(None, alias="dueDate"),
+    one_time_view: bool = Form(False, alias="oneTimeView"),
+    delete_after_minutes: int = Form(5, alias="deleteAfterMinutes"),
+    allow_download: bool = Form(True, alias="allowDownload"),
+    current_user: dict = Depends(get_current_user)
+):
+    """Upload several documents for one order in a single request"""
+    user_id = current_user['id']
+    if len(files) > MAX_BATCH_FILES:
+        raise HTTPException(status_code=400, detail=f"Too many files. Maximum is {MAX_BATCH_FILES} per batch.")
+    
+    # One quota read for the whole batch; files beyond the remaining quota are rejected
+    check_upload_quota(current_user)
+    remaining = current_user.get('monthly_upload_limit', 20) - current_user.get('uploads_used_this_month', 0)
+    accepted = files[:remaining]
+    
+    details = DocumentDetails(
+        customer_name=customer_name,
+        customer_phone=customer_phone,
+        customer_email=customer_email,
+        order_details=order_details,
+        due_date=due_date,
+        one_time_view=one_time_view,
+        delete_after_minutes=delete_after_minutes,
+        allow_download=allow_download
+    )
+    stored = await store_batch(accepted)
+    
+    results = []
+    records = []
+    blobs = []
+    for file, outcome in zip(files, stored + ["Monthly upload limit reached. Please upgrade your plan."] * (len(files) - len(accepted))):
+        if isinstance(outcome, str):
+            results.append({"fileName": file.filename, "success": False, "error": outcome})
+            continue
+        doc_record = build_merchant_document(user_id, outcome, file.filename, file.content_type, details)
+        records.append(doc_record)
+        blobs.append(outcome)
+        results.append({"fileName": file.filename, "success": True, "record": doc_record})
+    
+    await insert_batch_documents(records, blobs)
+    
+    # Single stats/quota update for the batch
+    if records:
+        await job_queue.enqueue("user_stats", {
+            "user_id": user_id,
+            "increments": {"documents_uploaded": len(records), "uploads_used_this_month": len(records)}
+        })
+    
+    # QR codes render in worker threads, in parallel, off the event loop
+    uploaded = [result for result in results if result["success"]]
+    qr_codes = await asyncio.gather(*(
+        asyncio.to_thread(generate_qr_code, f"https://bharatprint.app/view/{result['record']['shared_link']}")
+        for result in uploaded
+    ))
+    for result, qr_code in zip(uploaded, qr_codes):
+        result["document"] = merchant_document_response(result.pop("record"), details, qr_code)
+    
+    return {
+        "success": bool(records),
+        "uploaded": len(records),
+        "failed": len(files) - len(records),
+        "results": results
     }
+
+@api_router.post("/documents/customer-upload/{merchant_code}/batch")
+async def customer_upload_documents_batch(
+    merchant_code: str,
+    files: List[UploadFile] = File(...),
+    self_destruct_minutes: int = Form(5),
+    allow_merchant_download: bool = Form(False)
+):
+    """Customer uploads several documents to a merchant's portal at once (no auth required)"""
+    if len(files) > MAX_BATCH_FILES:
+        raise HTTPException(status_code=400, detail=f"Too many files. Maximum is {MAX_BATCH_FILES} per batch.")
     
-    await db_create_document(doc_record)
+    # Find merchant by code (once for the whole batch)
+    merchant = await db_get_user_by_merchant_code(merchant_code)
+    if not merchant:
+        raise HTTPException(status_code=404, detail="Merchant not found")
+    
+    stored = await store_batch(files)
+    
+    results = []
+    records = []
+    blobs = []
+    for file, outcome in zip(files, stored):
+        if isinstance(outcome, str):
+            results.append({"fileName": file.filename, "success": False, "error": outcome})
+            continue
+        doc_record = build_customer_document(
+            merchant['id'], outcome, file.filename, file.content_type, self_destruct_minutes, allow_merchant_download
+        )
+        records.append(doc_record)
+        blobs.append(outcome)
+        results.append({"fileName": file.filename, "success": True, "documentId": doc_record['id']})
+    
+    await insert_batch_documents(records, blobs)
     
     # Update merchant stats
-    await db_update_user(merchant['id'], {
-        "documents_uploaded": merchant.get('documents_uploaded', 0) + 1
-    })
+    if records:
+        await job_queue.enqueue("user_stats", {
+            "user_id": merchant['id'],
+            "increments": {"documents_uploaded": len(records)}
+        })
     
     return {
-        "success": True,
-        "message": "Document uploaded successfully",
-        "documentId": document_id,
+        "success": bool(records),
+        "uploaded": len(records),
+        "failed": len(files) - len(records),
         "selfDestructIn": self_destruct_minutes,
-        "merchantShop": merchant.get('shop_name', 'Print Shop')
+        "merchantShop": merchant.get('shop_name', 'Print Shop'),
+        "results": results
     }
 
+# ==================== RESUMABLE UPLOAD ENDPOINTS (tus 1.0) ====================
+
+def tus_headers(state: dict = None) -> dict:
+    """Common tus response headers, plus offset/expiry for a known upload"""
+    headers = {"Tus-Resumable": TUS_VERSION}
+    if state:
+        headers["Upload-Offset"] = str(state["offset"])
+        headers["Upload-Length"] = str(state["length"])
+        headers["Upload-Expires"] = datetime.fromtimestamp(state["expires_at"], timezone.utc).strftime('%a, %d %b %Y %H:%M:%S GMT')
+    return headers
+
+def get_resumable_upload(upload_id: str) -> dict:
+    try:
+        return resumable_uploads.get(upload_id)
+    except UploadNotFoundError:
+        raise HTTPException(status_code=404, detail="Upload not found or expired", headers=tus_headers())
+
+async def get_owned_resumable_upload(upload_id: str, authorization: str = Header(None)) -> dict:
+    """Dependency: an upload's state, provided the caller started it
+
+    A merchant upload needs the merchant's bearer token; a customer upload
+    needs the Upload-Ticket returned when it was created, as a bearer token.
+    The merchant is in the state as "current_user".
+    """
+    state = get_resumable_upload(upload_id)
+    owner = state["owner"]
+    if owner.get('sub'):
+        current_user = await get_current_user(authorization)
+        if current_user['id'] != owner['sub']:
+            raise HTTPException(status_code=403, detail="Upload belongs to another user", headers=tus_headers())
+        state["current_user"] = current_user
+    elif decode_upload_ticket(authorization) != upload_id:
+        raise HTTPException(status_code=401, detail="Upload ticket missing or invalid", headers=tus_headers())
+    return state
+
+def validate_upload_metadata(metadata: dict, details_model):
+    """Parse an upload's metadata into its details model, rejecting invalid fields with 400"""
+    try:
+        return details_model.model_validate(metadata)
+    except ValidationError as e:
+        error = e.errors()[0]
+        field = '.'.join(str(part) for part in error['loc'])
+        raise HTTPException(status_code=400, detail=f"Invalid upload metadata: {field}: {error['msg']}", headers=tus_headers())
+
+def start_resumable_upload(upload_length: int, upload_metadata: Optional[str], owner: dict, details_model) -> Response:
+    """Validate a tus creation request and allocate the upload"""
+    if upload_length <= 0 or upload_length > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="File too large. Maximum size is 50MB.", headers=tus_headers())
+    try:
+        metadata = parse_upload_metadata(upload_metadata)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid Upload-Metadata header", headers=tus_headers())
+    validate_upload_metadata(metadata, details_model)
+    
+    state = resumable_uploads.create(upload_length, metadata, owner)
+    state["offset"] = 0
+    headers = {**tus_headers(state), "Location": f"/api/uploads/{state['id']}"}
+    if not owner.get('sub'):
+        headers["Upload-Ticket"] = create_upload_ticket(state['id'])
+    return Response(status_code=201, headers=headers)
+
+@api_router.options("/uploads")
+async def resumable_upload_options():
+    """tus capability discovery"""
+    return Response(status_code=204, headers={
+        **tus_headers(),
+        "Tus-Version": TUS_VERSION,
+        "Tus-Extension": TUS_EXTENSIONS,
+        "Tus-Max-Size": str(MAX_UPLOAD_BYTES)
+    })
+
+@api_router.post("/uploads/customer/{merchant_code}")
+async def create_customer_resumable_upload(
+    merchant_code: str,
+    upload_length: int = Header(...),
+    upload_metadata: Optional[str] = Header(None)
+):
+    """Start a resumable customer upload (no auth required)
+
+    The response's Upload-Ticket header is sent as a bearer token with the
+    upload's later requests.
+    """
+    merchant = await db_get_user_by_merchant_code(merchant_code)
+    if not merchant:
+        raise HTTPException(status_code=404, detail="Merchant not found")
+    return start_resumable_upload(upload_length, upload_metadata, {'merchant_id': merchant['id']}, CustomerUploadOptions)
+
+@api_router.post("/uploads")
+async def create_resumable_upload(
+    upload_length: int = Header(...),
+    upload_metadata: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user)
+):
+    """Start a resumable upload; document details travel in Upload-Metadata"""
+    check_upload_quota(current_user)
+    return start_resumable_upload(upload_length, upload_metadata, {'sub': current_user['id']}, DocumentDetails)
+
+@api_router.head("/uploads/{upload_id}")
+async def resumable_upload_status(state: dict = Depends(get_owned_resumable_upload)):
+    """Report how many bytes of an upload have been received"""
+    return Response(status_code=200, headers={**tus_headers(state), "Cache-Control": "no-store"})
+
+@api_router.patch("/uploads/{upload_id}")
+async def append_resumable_upload(
+    upload_id: str,
+    request: Request,
+    upload_offset: int = Header(...),
+    content_type: Optional[str] = Header(None),
+    state: dict = Depends(get_owned_resumable_upload)
+):
+    """Append a chunk at Upload-Offset"""
+    if content_type != "application/offset+octet-stream":
+        raise HTTPException(status_code=415, detail="Content-Type must be application/offset+octet-stream", headers=tus_headers())
+    
+    try:
+        await resumable_uploads.append(upload_id, upload_offset, request.stream())
+    except ClientDisconnect:
+        # Whatever arrived is kept; the client resumes from HEAD's Upload-Offset
+        logging.info(f"Client disconnected during resumable upload {upload_id}")
+    except UploadConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e), headers=tus_headers())
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e), headers=tus_headers())
+    
+    return Response(status_code=204, headers=tus_headers(get_resumable_upload(upload_id)))
+
+@api_router.delete("/uploads/{upload_id}")
+async def terminate_resumable_upload(upload_id: str, state: dict = Depends(get_owned_resumable_upload)):
+    """Abandon an upload and discard its bytes"""
+    resumable_uploads.terminate(upload_id)
+    return Response(status_code=204, headers=tus_headers())
+
+@api_router.post("/uploads/{upload_id}/complete")
+async def complete_resumable_upload(
+    upload_id: str,
+    state: dict = Depends(get_owned_resumable_upload)
+):
+    """Store a fully received upload and create its document (safe to retry)"""
+    if state["result"]:
+        return state["result"]
+    if state["offset"] != state["length"]:
+        raise HTTPException(status_code=409, detail=f"Upload incomplete: {state['offset']} of {state['length']} bytes received")
+    
+    owner = state["owner"]
+    metadata = state["metadata"]
+    # Before storing anything, so invalid metadata cannot fail the request with the blob already referenced
+    details = validate_upload_metadata(metadata, DocumentDetails if owner.get('sub') else CustomerUploadOptions)
+    if owner.get('sub'):
+        current_user = state["current_user"]
+        check_upload_quota(current_user)
+    else:
+        merchant = await db_get_user_by_id(owner['merchant_id'])
+        if not merchant:
+            raise HTTPException(status_code=404, detail="Merchant not found")
+    
+    try:
+        with resumable_uploads.finishing(upload_id) as spool:
+            state = get_resumable_upload(upload_id)
+            if state["result"]:
+                return state["result"]
+            
+            content_type = metadata.get('filetype') or "application/octet-stream"
+            file_name = metadata.get('filename') or "document"
+            upload = UploadFile(file=spool, filename=file_name, headers=Headers({"content-type": content_type}))
+            blob = await blob_store.put(upload, MAX_UPLOAD_BYTES)
+            
+            if owner.get('sub'):
+                result = await create_merchant_document(current_user, blob, file_name, content_type, details)
+            else:
+                result = await create_customer_document(
+                    merchant, blob, file_name, content_type,
+                    details.self_destruct_minutes, details.allow_merchant_download
+                )
+            resumable_uploads.mark_complete(upload_id, result)
+    except (UploadConflictError, FileNotFoundError):
+        raise HTTPException(status_code=409, detail="Upload is already being completed. Please retry.")
+    
+    return result
+
 # ==================== DASHBOARD ENDPOINTS ====================
 
 @api_router.get("/dashboard/stats")
@@ -1152,6 +2529,32 @@ async def get_dashboard_stats(current_user: dict = Depends(get_current_user)):
         }
     }
 
+# ==================== LIVE EVENTS ====================
+
+@api_router.post("/events/ticket")
+async def get_events_ticket(current_user: dict = Depends(get_current_user)):
+    """Ticket for opening the merchant's event stream"""
+    return {
+        "success": True,
+        "ticket": create_events_ticket(current_user['id']),
+        "expiresIn": EVENTS_TICKET_TTL_SECONDS
+    }
+
+@api_router.get("/events/stream")
+async def stream_events(ticket: str):
+    """Server-sent events for the merchant's documents: uploads, views, deletions and expiries"""
+    user_id = decode_events_ticket(ticket)
+    try:
+        subscription = event_bus.subscribe(user_id)
+    except TooManyStreamsError:
+        raise HTTPException(status_code=429, detail="Too many open event streams")
+    
+    return StreamingResponse(
+        subscription.stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-store", "X-Accel-Buffering": "no"}
+    )
+
 # ==================== SUBSCRIPTION ENDPOINTS ====================
 
 @api_router.get("/subscriptions/plans")
@@ -1357,6 +2760,84 @@ async def trigger_trial_check():
     count = await check_expired_trials()
     return {"success": True, "downgraded_count": count}
 
+# ==================== DOCUMENT EXPIRY (BACKGROUND TASK) ====================
+
+async def purge_expired_documents():
+    """Expire documents past auto_delete_at and release their blobs"""
+    candidates = await db_get_expired_documents()
+    
+    # Every worker sweeps: only the documents this sweep's update expired release their blobs
+    expired_docs = []
+    for start in range(0, len(candidates), BULK_DELETE_BATCH_SIZE):
+        batch = await db_expire_documents([doc['id'] for doc in candidates[start:start + BULK_DELETE_BATCH_SIZE]])
+        if batch:
+            await job_queue.enqueue("release_blobs", {"storage_keys": [doc.get('file_storage_key') for doc in batch]})
+            expired_docs += batch
+    for doc in expired_docs:
+        publish_document_event("document.expired", doc)
+    
+    if expired_docs:
+        logging.info(f"Expired {len(expired_docs)} documents")
+    
+    resumable_uploads.purge_expired()
+    return len(expired_docs)
+
+async def maintain_document_partitions():
+    """Create tomorrow's partitions and drop days whose documents have all expired"""
+    result = await db_maintain_document_partitions()
+    archived = sum(dropped['archivedRows'] for dropped in result.get('dropped', []))
+    if result.get('created') or result.get('dropped'):
+        logging.info(f"Document partitions: {result.get('created')} created, "
+                     f"{len(result.get('dropped', []))} dropped ({archived} rows archived)")
+    return result
+
+async def expiry_sweep_loop():
+    """Periodically purge expired documents (and maintain partitions) while the app is running"""
+    # Maintenance is idempotent across workers; the first sweep also creates any missing partitions
+    last_maintenance = None
+    while True:
+        await asyncio.sleep(EXPIRY_SWEEP_INTERVAL_SECONDS)
+        try:
+            await purge_expired_documents()
+        except Exception as e:
+            logging.error(f"Document expiry sweep failed: {e}")
+        
+        now = asyncio.get_running_loop().time()
+        if last_maintenance is None or now - last_maintenance >= DOCUMENT_PARTITION_MAINTENANCE_SECONDS:
+            last_maintenance = now
+            try:
+                await maintain_document_partitions()
+            except Exception as e:
+                logging.error(f"Document partition maintenance failed: {e}")
+
+@api_router.post("/admin/purge-expired", dependencies=[Depends(require_admin)])
+async def trigger_expiry_purge():
+    """Manual trigger for document expiry (for testing)"""
+    count = await purge_expired_documents()
+    return {"success": True, "expired_count": count}
+
+@api_router.post("/admin/documents/maintain-partitions", dependencies=[Depends(require_admin)])
+async def trigger_partition_maintenance():
+    """Run documents partition maintenance now"""
+    return {"success": True, **await maintain_document_partitions()}
+
+# ==================== JOB QUEUE ADMIN ====================
+
+@api_router.get("/admin/jobs", dependencies=[Depends(require_admin)])
+async def get_job_queue_status():
+    """Job queue counters and the dead-letter jobs"""
+    return {
+        "success": True,
+        "stats": await job_queue.stats(),
+        "deadJobs": await job_queue.dead_jobs()
+    }
+
+@api_router.post("/admin/jobs/requeue-dead", dependencies=[Depends(require_admin)])
+async def requeue_dead_jobs(job_id: Optional[str] = None):
+    """Give dead-letter jobs (or one of them) a fresh set of attempts"""
+    requeued = await job_queue.requeue_dead(job_id)
+    return {"success": True, "requeued": requeued}
+
 # ==================== REFERRAL ENDPOINTS (MINIMAL - FOR API COMPATIBILITY) ====================
 
 @api_router.get("/referrals/my-code")
@@ -1374,6 +2855,68 @@ async def get_my_referral_code(current_user: dict = Depends(get_current_user)):
         }
     }
 
+# ==================== DIAGNOSTICS ====================
+
+@api_router.get("/admin/diagnostics/loop", dependencies=[Depends(require_admin)])
+async def get_loop_diagnostics():
+    """Event-loop lag and the stacks of recent stalls"""
+    return {
+        "success": True,
+        "loop": loop_watchdog.stats(),
+        "stalls": list(loop_watchdog.stalls)
+    }
+
+@api_router.get("/admin/diagnostics/profile", dependencies=[Depends(require_admin)])
+async def run_cpu_profile(seconds: float = 10, hz: int = 100):
+    """Sample all threads for N seconds; returns collapsed stacks for flamegraph tools"""
+    folded = await profiler.profile(seconds, hz)
+    if folded is None:
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    return PlainTextResponse(folded)
+
+@api_router.get("/admin/diagnostics/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+async def get_request_profile(profile_id: str):
+    """Collapsed stacks of a request made with the X-Profile: 1 header"""
+    folded = profiler.request_profiles.get(profile_id)
+    if folded is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(folded)
+
+@api_router.get("/admin/diagnostics/memory", dependencies=[Depends(require_admin)])
+async def get_memory_diagnostics():
+    """Cache gauges, per-route allocation peaks and the latest tracemalloc snapshot diff"""
+    return {
+        "success": True,
+        "tracing": tracemalloc.is_tracing(),
+        "gauges": memory_accounting.read_gauges(),
+        "routes": memory_accounting.route_stats(),
+        "lastSnapshotDiff": memory_accounting.last_diff
+    }
+
+@api_router.post("/admin/diagnostics/memory/tracing", dependencies=[Depends(require_admin)])
+async def set_memory_tracing(enabled: bool = True):
+    """Switch tracemalloc on or off in this worker"""
+    memory_accounting.set_tracing(enabled)
+    return {"success": True, "tracing": tracemalloc.is_tracing()}
+
+@api_router.post("/admin/diagnostics/memory/snapshot", dependencies=[Depends(require_admin)])
+async def take_memory_snapshot():
+    """Diff a snapshot taken now against the previous one"""
+    if not tracemalloc.is_tracing():
+        raise HTTPException(status_code=409, detail="Memory tracing is off")
+    return {"success": True, "diff": await asyncio.to_thread(memory_accounting.snapshot_diff)}
+
+# ==================== DEPENDENCY OUTAGES ====================
+
+@app.exception_handler(CircuitOpenError)
+async def circuit_open_handler(request: Request, exc: CircuitOpenError):
+    """Fail fast while a dependency's circuit is open"""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Service temporarily unavailable. Please try again shortly."},
+        headers={"Retry-After": str(int(exc.retry_after + 0.5))}
+    )
+
 # ==================== HEALTH & STATUS ENDPOINTS ====================
 
 @app.get("/health", tags=["Status"])
@@ -1383,7 +2926,15 @@ async def health_check():
         "status": "healthy",
         "service": "BharatPrint API",
         "version": "1.0.0",
-        "timestamp": datetime.now(timezone.utc).isoformat()
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "eventLoop": loop_watchdog.stats(),
+        "auditLog": audit_log.stats(),
+        "replicas": replica_router.stats(),
+        "events": event_bus.stats(),
+        "circuits": {
+            "database": db_breaker.stats(),
+            "storage": storage_breaker.stats()
+        }
     }
 
 @app.get("/", tags=["Status"])
@@ -1404,6 +2955,36 @@ async def favicon():
 
 app.include_router(api_router)
 
+# Retried uploads, payment orders and payment checks with an Idempotency-Key replay the first response
+IDEMPOTENT_PATHS = ("/api/documents/upload", "/api/subscriptions/create-order", "/api/subscriptions/verify-payment")
+
+def idempotency_caller(headers) -> Optional[str]:
+    """The merchant whose idempotency keys a request uses (None without a valid token)"""
+    try:
+        token = headers.get("authorization", "").replace('Bearer ', '')
+        return jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM]).get('sub')
+    except jwt.InvalidTokenError:
+        return None
+
+app.add_middleware(
+    IdempotencyMiddleware,
+    store=SupabaseIdempotencyStore(supabase_client) if supabase_client else SqliteIdempotencyStore(),
+    paths=IDEMPOTENT_PATHS,
+    caller=idempotency_caller
+)
+
+# ETag/304, per-route Cache-Control and gzip/brotli for JSON responses
+app.add_middleware(ResponseCacheMiddleware)
+
+# Per-route allocation peaks (only while tracemalloc is on)
+app.add_middleware(MemoryAccountingMiddleware, accounting=memory_accounting, untracked_paths=("/api/events/stream",))
+
+# Read-your-writes across workers when reads are routed to replicas
+app.add_middleware(ReplicaRoutingMiddleware, router=replica_router)
+
+# Opt-in per-request profiling (X-Profile: 1 plus the admin token)
+app.add_middleware(RequestProfilingMiddleware, profiler=profiler, is_admin=is_admin_request)
+
 def _parse_cors_origins(raw: str) -> list[str]:
     """
     Parse CORS_ORIGINS env var into a normalized list.
@@ -1427,6 +3008,8 @@ app.add_middleware(
     allow_origins=_cors_origins,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Resumable upload clients read these from cross-origin responses
+    expose_headers=["ETag", "X-Profile-Id", "X-Read-Primary-Until", "Location", "Idempotent-Replayed", "Upload-Offset", "Upload-Length", "Upload-Expires", "Upload-Ticket", "Tus-Resumable"],
 )
 
 logging.basicConfig(
@@ -0,0 +1,64 @@
+"""
+Single-flight coalescing of identical concurrent lookups.
+
+When a share link goes out to a WhatsApp group, dozens of customers open it at
+the same moment. With single-flight, the first request for a key starts the
+backend call and every request for the same key that arrives while it is still
+in flight awaits that same call and gets its result (or its exception). Nothing
+is cached: once the call finishes the next request goes to the backend again.
+
+Callers receive the same result object, so they must treat it as read-only.
+"""
+import asyncio
+import functools
+from typing import Awaitable, Callable, Hashable, Optional
+
+
+class SingleFlight:
+    """Group of in-flight calls keyed by argument"""
+
+    def __init__(self, name: str = ""):
+        self.name = name
+        self.counters = {"calls": 0, "shared": 0}
+        self._in_flight: dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, fn: Callable[..., Awaitable], *args, **kwargs):
+        """Run fn(*args) unless a call for `key` is already running, then share its result"""
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.counters["shared"] += 1
+        else:
+            self.counters["calls"] += 1
+            future = asyncio.ensure_future(fn(*args, **kwargs))
+            self._in_flight[key] = future
+            future.add_done_callback(lambda done: self._forget(key, done))
+        # Shielded: one caller going away (client disconnect) must not cancel the others' call
+        return await asyncio.shield(future)
+
+    def _forget(self, key: Hashable, done: asyncio.Future):
+        if self._in_flight.get(key) is done:
+            del self._in_flight[key]
+
+    def stats(self) -> dict:
+        return {**self.counters, "inFlight": len(self._in_flight)}
+
+
+def single_flight(fn: Optional[Callable[..., Awaitable]] = None, *, bypass: Optional[Callable[..., bool]] = None):
+    """Decorator coalescing concurrent calls of an async function with equal arguments
+
+    bypass(*args, **kwargs): true for calls that must run on their own, such as
+    a read that has to see the caller's own write, which a call already in
+    flight may have started before.
+    """
+    if fn is None:
+        return functools.partial(single_flight, bypass=bypass)
+    group = SingleFlight(fn.__name__)
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        if bypass is not None and bypass(*args, **kwargs):
+            return await fn(*args, **kwargs)
+        return await group.do((args, tuple(sorted(kwargs.items()))), fn, *args, **kwargs)
+
+    wrapper.flight = group
+    return wrapper
@@ -10,6 +10,10 @@ const api = axios.create({
   timeout: 30000, // 30 seconds timeout
 });
 
+// After a write the API asks for reads from the primary database for a moment
+// (read replicas may not have the write yet); echo that back until it passes
+let readPrimaryUntil = 0;
+
 // Add auth token to requests
 api.interceptors.request.use(
   (config) => {
@@ -17,6 +21,9 @@ api.interceptors.request.use(
     if (token) {
       config.headers.Authorization = `Bearer ${token}`;
     }
+    if (readPrimaryUntil > Date.now() / 1000) {
+      config.headers['X-Read-Primary-Until'] = readPrimaryUntil;
+    }
     return config;
   },
   (error) => {
@@ -26,7 +33,13 @@ api.interceptors.request.use(
 
 // Handle auth errors
 api.interceptors.response.use(
-  (response) => response,
+  (response) => {
+    const primaryUntil = parseFloat(response.headers['x-read-primary-until']);
+    if (primaryUntil > readPrimaryUntil) {
+      readPrimaryUntil = primaryUntil;
+    }
+    return response;
+  },
   (error) => {
     if (error.response?.status === 401) {
       localStorage.removeItem('token');
@@ -39,6 +52,26 @@ api.interceptors.response.use(
 
 export default api;
 
+// Retries carry the same Idempotency-Key, so the API replays the first response
+// instead of storing an upload, creating an order or activating a plan twice
+const IDEMPOTENT_RETRIES = 2;
+
+const postIdempotent = async (url, data, config = {}) => {
+  const key = crypto.randomUUID();
+  for (let attempt = 0; ; attempt++) {
+    try {
+      return await api.post(url, data, { ...config, headers: { ...config.headers, 'Idempotency-Key': key } });
+    } catch (error) {
+      // Retry when the answer never arrived, or the first attempt is still running (409)
+      const retryable = !error.response || error.response.status === 409;
+      if (!retryable || attempt >= IDEMPOTENT_RETRIES) {
+        throw error;
+      }
+      await new Promise((resolve) => setTimeout(resolve, 1000 * 2 ** attempt));
+    }
+  }
+};
+
 // Auth API
 export const authAPI = {
   sendOTP: (data) => api.post('/auth/send-otp', data),
@@ -48,13 +81,25 @@ export const authAPI = {
 
 // Documents API
 export const documentsAPI = {
-  upload: (formData) => api.post('/documents/upload', formData, {
+  upload: (formData) => postIdempotent('/documents/upload', formData, {
     headers: { 'Content-Type': 'multipart/form-data' }
   }),
+  uploadBatch: (formData) => api.post('/documents/upload-batch', formData, {
+    headers: { 'Content-Type': 'multipart/form-data' }
+  }),
+  createDirectUpload: (data) => api.post('/documents/direct-upload', data),
+  completeDirectUpload: (data) => api.post('/documents/direct-upload/complete', data),
   list: (params) => api.get('/documents/list', { params }),
+  // params: { q, createdAfter, createdBefore, limit }
+  search: (params) => api.get('/documents/search', { params }),
   get: (id) => api.get(`/documents/${id}`),
   getPublic: (shareLink) => api.get(`/documents/public/${shareLink}`),
   delete: (id) => api.delete(`/documents/${id}`),
+  // selection: { documentIds } and/or { createdBefore, customerUploaded }; runs in the background
+  bulkDelete: (selection) => api.post('/documents/bulk-delete', selection),
+  getBulkDelete: (operationId) => api.get(`/documents/bulk-delete/${operationId}`),
+  // Whole history as a file: params { format: 'csv' | 'ndjson', gzip }
+  export: (params) => api.get('/documents/export', { params, responseType: 'blob' }),
 };
 
 // Referrals API
@@ -73,10 +118,58 @@ export const dashboardAPI = {
   getStats: () => api.get('/dashboard/stats'),
 };
 
+// Live events API (server-sent events for the merchant's documents)
+const DOCUMENT_EVENTS = [
+  'document.uploaded', 'document.viewed', 'document.deleted', 'document.expired', 'documents.bulk_delete', 'resync'
+];
+
+export const eventsAPI = {
+  getTicket: () => api.post('/events/ticket'),
+  // Calls onEvent(type, data) for each event; returns a function that closes the stream
+  subscribe: (onEvent) => {
+    let source = null;
+    let retryTimer = null;
+    let closed = false;
+    let failures = 0;
+
+    const open = async () => {
+      try {
+        const { data } = await eventsAPI.getTicket();
+        if (closed) return;
+        source = new EventSource(`${API_URL}/events/stream?ticket=${encodeURIComponent(data.ticket)}`);
+        source.addEventListener('ready', () => { failures = 0; });
+        DOCUMENT_EVENTS.forEach((type) => {
+          source.addEventListener(type, (event) => onEvent(type, JSON.parse(event.data)));
+        });
+        // The ticket expires after a minute, so reconnect with a fresh one rather than letting EventSource retry
+        source.onerror = () => {
+          source.close();
+          reconnect();
+        };
+      } catch (error) {
+        reconnect();
+      }
+    };
+
+    const reconnect = () => {
+      if (closed) return;
+      failures += 1;
+      retryTimer = setTimeout(open, Math.min(30000, 1000 * 2 ** failures));
+    };
+
+    open();
+    return () => {
+      closed = true;
+      clearTimeout(retryTimer);
+      if (source) source.close();
+    };
+  },
+};
+
 // Subscriptions API
 export const subscriptionsAPI = {
   getPlans: () => api.get('/subscriptions/plans'),
   startTrial: () => api.post('/subscriptions/start-trial'),
-  createOrder: (formData) => api.post('/subscriptions/create-order', formData),
-  verifyPayment: (formData) => api.post('/subscriptions/verify-payment', formData),
+  createOrder: (formData) => postIdempotent('/subscriptions/create-order', formData),
+  verifyPayment: (formData) => postIdempotent('/subscriptions/verify-payment', formData),
 };
\ No newline at end of file
@@ -251,7 +251,14 @@ const DocumentViewer = () => {
             <div className="bg-gray-100 rounded-lg overflow-hidden min-h-[400px] flex items-center justify-center">
               {document.fileType?.startsWith('image/') ? (
                 <img 
-                  src={`${API_URL}/documents/download/${shareLink}`} 
+                  src={`${API_URL}/documents/preview/${shareLink}`} 
+                  onError={(e) => {
+                    // Fall back to the original file while the preview is still rendering
+                    if (!e.currentTarget.dataset.fallback) {
+                      e.currentTarget.dataset.fallback = 'true';
+                      e.currentTarget.src = `${API_URL}/documents/download/${shareLink}`;
+                    }
+                  }}
                   alt="Document Preview"
                   className="max-w-full max-h-[600px] object-contain"
                   onContextMenu={(e) => !allowDownload && e.preventDefault()}
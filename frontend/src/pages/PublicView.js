@@ -331,7 +331,14 @@ const PublicView = () => {
               onContextMenu={(e) => !allowDownload && e.preventDefault()}
             >
               <img 
-                src={`${API_URL}/documents/download/${shareLink}`} 
+                src={`${API_URL}/documents/preview/${shareLink}`} 
+                onError={(e) => {
+                  // Fall back to the original file while the preview is still rendering
+                  if (!e.currentTarget.dataset.fallback) {
+                    e.currentTarget.dataset.fallback = 'true';
+                    e.currentTarget.src = `${API_URL}/documents/download/${shareLink}`;
+                  }
+                }}
                 alt="Document Preview"
                 className="max-w-full max-h-[500px] object-contain rounded"
                 style={{ pointerEvents: allowDownload ? 'auto' : 'none' }}
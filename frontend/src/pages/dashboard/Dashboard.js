@@ -1,6 +1,6 @@
 import React, { useEffect, useState } from 'react';
 import DashboardLayout from '../../components/DashboardLayout';
-import { dashboardAPI } from '../../lib/api';
+import { dashboardAPI, eventsAPI } from '../../lib/api';
 import { FileText, TrendingUp, Upload, QrCode, Clock, Eye } from 'lucide-react';
 import { useNavigate } from 'react-router-dom';
 import { LineChart, Line, XAxis, YAxis, CartesianGrid, Tooltip, ResponsiveContainer } from 'recharts';
@@ -24,6 +24,8 @@ const Dashboard = () => {
     };
 
     fetchData();
+    // Refresh when documents are uploaded, viewed or expire instead of polling
+    return eventsAPI.subscribe(() => fetchData());
   }, []);
 
   if (loading) {
@@ -1,6 +1,6 @@
 import React, { useEffect, useState } from 'react';
 import DashboardLayout from '../../components/DashboardLayout';
-import { documentsAPI } from '../../lib/api';
+import { documentsAPI, eventsAPI } from '../../lib/api';
 import { toast } from 'sonner';
 import { FileText, ExternalLink, Copy, Trash2, Eye, Calendar, Clock } from 'lucide-react';
 import { format } from 'date-fns';
@@ -12,6 +12,12 @@ const Documents = () => {
 
   useEffect(() => {
     fetchDocuments();
+    return eventsAPI.subscribe((type, data) => {
+      if (type === 'document.uploaded' && data.customerUploaded) {
+        toast.success(`New upload: ${data.documentName}`);
+      }
+      fetchDocuments();
+    });
   }, []);
 
   const fetchDocuments = async () => {
@@ -0,0 +1,24 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+
+@pytest.fixture
+def backend(monkeypatch, tmp_path):
+    """The API on the in-memory backend, emptied, with a merchant's auth headers"""
+    import server
+    from bench_memory import install_mock_backend
+    from merchant_codes import MerchantCodeIndex
+    from resumable import ResumableUploads
+
+    for table in ("users", "otps", "documents", "audit_logs", "documents_archive", "bulk_deletes"):
+        monkeypatch.setitem(server.mock_db, table, [])
+    server.mock_db["files"].clear()
+    server.mock_db["blobs"].clear()
+    monkeypatch.setattr(server, "resumable_uploads", ResumableUploads(tmp_path / "uploads"))
+    monkeypatch.setattr(server, "merchant_code_index", MerchantCodeIndex())
+    token = install_mock_backend()
+    return server, {"Authorization": f"Bearer {token}"}
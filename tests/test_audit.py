@@ -0,0 +1,99 @@
+import asyncio
+
+from audit import AuditLog
+
+
+class RowError(Exception):
+    code = "23502"
+
+
+class FakeTable:
+    def __init__(self):
+        self.rows = []
+        self.down = False
+
+    async def insert(self, events):
+        if self.down:
+            raise ConnectionError("database unreachable")
+        if any(event["action"] == "bad" for event in events):
+            raise RowError("null value in column")
+        self.rows.extend(events)
+
+
+def audit_log(table, tmp_path) -> AuditLog:
+    return AuditLog(table.insert, batch_size=10, flush_interval=3600, spool_dir=tmp_path)
+
+
+def test_flush_writes_buffered_events_and_clears_the_spool(tmp_path):
+    table = FakeTable()
+    log = audit_log(table, tmp_path)
+
+    async def scenario():
+        log.start()
+        for n in range(3):
+            log.record("document_upload", user_id="merchant", resource_id=str(n))
+        await log.flush()
+        assert [row["resource_id"] for row in table.rows] == ["0", "1", "2"]
+        assert not log.buffer
+        await log.stop()
+
+    asyncio.run(scenario())
+    assert log.stats()["written"] == 3
+    assert list(tmp_path.glob("audit-*.jsonl")) == []
+
+
+def test_events_survive_an_outage_in_the_spool(tmp_path):
+    table = FakeTable()
+    log = audit_log(table, tmp_path)
+
+    async def scenario():
+        log.start()
+        table.down = True
+        log.record("document_delete", resource_id="a")
+        log.record("document_delete", resource_id="b")
+        await log.flush()
+        assert table.rows == [] and log.counters["flush_failures"] == 1
+
+        table.down = False
+        log.record("document_delete", resource_id="c")
+        await log.flush()
+        await log.stop()
+
+    asyncio.run(scenario())
+    assert sorted(row["resource_id"] for row in table.rows) == ["a", "b", "c"]
+    assert log.counters["replayed"] == 2
+    assert list(tmp_path.glob("audit-*.jsonl")) == []
+
+
+def test_segments_of_a_dead_worker_are_replayed(tmp_path):
+    table = FakeTable()
+    crashed = audit_log(table, tmp_path)
+    crashed._open_spool()
+    crashed.record("login", user_id="merchant")
+    crashed._spool.close()  # the worker died; its lock is gone
+
+    log = audit_log(table, tmp_path)
+
+    async def scenario():
+        log.start()
+        await log.flush()
+        await log.stop()
+
+    asyncio.run(scenario())
+    assert [row["action"] for row in table.rows] == ["login"]
+
+
+def test_rejected_events_are_dropped_and_the_rest_written(tmp_path):
+    table = FakeTable()
+    log = audit_log(table, tmp_path)
+
+    async def scenario():
+        log.start()
+        for action in ("upload", "bad", "upload", "upload"):
+            log.record(action)
+        await log.flush()
+        await log.stop()
+
+    asyncio.run(scenario())
+    assert len(table.rows) == 3
+    assert log.counters["rejected"] == 1
@@ -0,0 +1,94 @@
+import asyncio
+import io
+import time
+
+from starlette.datastructures import Headers, UploadFile
+
+from blob_store import BlobStore
+
+
+def upload(content: bytes) -> UploadFile:
+    return UploadFile(io.BytesIO(content), filename="scan.txt", headers=Headers({"content-type": "text/plain"}))
+
+
+def test_same_content_is_stored_once_and_kept_until_the_last_release():
+    store = BlobStore(None, None, {})
+
+    async def scenario():
+        first = await store.put(upload(b"invoice" * 100), 10**6)
+        second = await store.put(upload(b"invoice" * 100), 10**6)
+        assert second.storage_key == first.storage_key
+        assert not first.deduplicated and second.deduplicated
+        assert store.blobs[first.sha256]["ref_count"] == 2
+
+        await store.release(first.storage_key)
+        assert store.blobs[first.sha256]["ref_count"] == 1
+        assert await store.read(second.storage_key) == b"invoice" * 100
+
+        await store.release(second.storage_key)
+        assert first.sha256 not in store.blobs
+        assert first.storage_key not in store.files
+
+    asyncio.run(scenario())
+
+
+def test_release_many_drops_one_reference_per_document():
+    store = BlobStore(None, None, {})
+
+    async def scenario():
+        shared = [await store.put(upload(b"shared"), 10**6) for _ in range(3)]
+        single = await store.put(upload(b"single"), 10**6)
+
+        removed = await store.release_many([shared[0].storage_key, shared[1].storage_key, single.storage_key, None])
+        assert removed == 1
+        assert store.blobs[shared[0].sha256]["ref_count"] == 1
+        assert single.storage_key not in store.files
+        assert await store.read(shared[2].storage_key) == b"shared"
+
+    asyncio.run(scenario())
+
+
+def test_upload_during_removal_keeps_its_object():
+    store = BlobStore(None, None, {})
+    remove_objects = store._remove_objects
+
+    def slow_remove(keys):
+        time.sleep(0.3)
+        remove_objects(keys)
+
+    async def scenario():
+        first = await store.put(upload(b"receipt"), 10**6)
+        store._remove_objects = slow_remove
+        removal = asyncio.create_task(store.release_many([first.storage_key]))
+        await asyncio.sleep(0.05)
+        second = await store.put(upload(b"receipt"), 10**6)
+        await removal
+
+        assert store.blobs[second.sha256]["ref_count"] == 1
+        assert await store.read(second.storage_key) == b"receipt"
+
+    asyncio.run(scenario())
+
+
+def test_deleted_document_is_gone_while_its_twin_still_downloads(backend):
+    from fastapi.testclient import TestClient
+
+    server, headers = backend
+    client = TestClient(server.app)
+    for name in ("a.txt", "b.txt"):
+        response = client.post(
+            "/api/documents/upload", headers=headers,
+            files={"file": (name, b"same bytes", "text/plain")}, data={"customerName": "Sharma"}
+        )
+        assert response.status_code == 200
+    deleted, kept = server.mock_db["documents"]
+    assert deleted["file_storage_key"] == kept["file_storage_key"]
+
+    assert client.delete(f"/api/documents/{deleted['id']}", headers=headers).status_code == 200
+    asyncio.run(server.job_queue.run_pending())
+
+    assert client.get(f"/api/documents/download/{deleted['shared_link']}").status_code == 410
+    assert client.get(f"/api/documents/preview/{deleted['shared_link']}").status_code == 410
+    response = client.get(f"/api/documents/download/{kept['shared_link']}")
+    assert response.status_code == 200
+    assert response.content == b"same bytes"
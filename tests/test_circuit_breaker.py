@@ -0,0 +1,90 @@
+import time
+
+import pytest
+
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError, is_outage_error
+
+
+class ConstraintError(Exception):
+    code = "23505"
+
+
+def fail():
+    raise TimeoutError("read timed out")
+
+
+def reject():
+    raise ConstraintError("duplicate key")
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """time.monotonic() that only moves when the test advances it"""
+    now = [time.monotonic()]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    return now
+
+
+def breaker() -> CircuitBreaker:
+    return CircuitBreaker("database", failure_rate=0.5, min_calls=4, window_seconds=30, open_seconds=10, half_open_calls=1)
+
+
+def test_opens_once_the_failure_rate_is_reached(clock):
+    circuit = breaker()
+    circuit.call(lambda: "ok")
+    circuit.call(lambda: "ok")
+    for _ in range(2):
+        with pytest.raises(TimeoutError):
+            circuit.call(fail)
+    assert circuit.state == OPEN
+
+    calls = []
+    with pytest.raises(CircuitOpenError) as error:
+        circuit.call(calls.append, "not attempted")
+    assert calls == []
+    assert error.value.retry_after == 10
+    assert circuit.counters["rejected"] == 1
+
+
+def test_errors_that_are_not_outages_keep_it_closed(clock):
+    circuit = breaker()
+    for _ in range(6):
+        with pytest.raises(ConstraintError):
+            circuit.call(reject)
+    assert circuit.state == CLOSED
+    assert not is_outage_error(ConstraintError()) and is_outage_error(ConnectionError())
+
+
+def test_half_open_trial_closes_or_reopens_it(clock):
+    circuit = breaker()
+    for _ in range(4):
+        with pytest.raises(TimeoutError):
+            circuit.call(fail)
+    assert circuit.state == OPEN
+
+    clock[0] += 10
+    with pytest.raises(TimeoutError):
+        circuit.call(fail)  # the trial fails
+    assert circuit.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        circuit.call(lambda: "ok")
+
+    clock[0] += 10
+    assert circuit.call(lambda: "ok") == "ok"
+    assert circuit.state == CLOSED
+    assert circuit.counters["opened"] == 2
+
+
+def test_half_open_admits_only_the_trial_calls(clock):
+    circuit = breaker()
+    for _ in range(4):
+        with pytest.raises(TimeoutError):
+            circuit.call(fail)
+    clock[0] += 10
+
+    circuit.before_call()
+    assert circuit.state == HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        circuit.before_call()
+    circuit.record(False)
+    assert circuit.state == CLOSED
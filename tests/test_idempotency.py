@@ -0,0 +1,125 @@
+import asyncio
+
+import httpx
+import pytest
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from idempotency import IdempotencyMiddleware, SqliteIdempotencyStore
+
+
+class Endpoints:
+    """Payment endpoints that count how often they really ran"""
+
+    def __init__(self):
+        self.runs = 0
+        self.fail = False
+        self.release = asyncio.Event()
+        self.release.set()
+
+    async def create_order(self, request):
+        self.runs += 1
+        await self.release.wait()
+        if self.fail:
+            return JSONResponse({"detail": "gateway error"}, status_code=502)
+        return JSONResponse({"order": self.runs})
+
+    async def check_payment(self, request):
+        return JSONResponse({"paid": True})
+
+
+def client(endpoints: Endpoints, tmp_path, wait_seconds: float = 5) -> httpx.AsyncClient:
+    app = Starlette(routes=[
+        Route("/orders", endpoints.create_order, methods=["POST"]),
+        Route("/checks", endpoints.check_payment, methods=["POST"])
+    ])
+    app = IdempotencyMiddleware(
+        app, SqliteIdempotencyStore(tmp_path / "keys.sqlite3"), ("/orders", "/checks"),
+        caller=lambda headers: headers.get("x-merchant"), wait_seconds=wait_seconds
+    )
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+
+def keyed(key: str, merchant: str = "merchant-1") -> dict:
+    return {"Idempotency-Key": key, "X-Merchant": merchant}
+
+
+@pytest.fixture
+def endpoints():
+    return Endpoints()
+
+
+def test_retry_replays_the_first_response(endpoints, tmp_path):
+    async def scenario():
+        async with client(endpoints, tmp_path) as http:
+            first = await http.post("/orders", headers=keyed("k1"))
+            retry = await http.post("/orders", headers=keyed("k1"))
+            other_merchant = await http.post("/orders", headers=keyed("k1", "merchant-2"))
+            unkeyed = await http.post("/orders")
+            return first, retry, other_merchant, unkeyed
+
+    first, retry, other_merchant, unkeyed = asyncio.run(scenario())
+    assert retry.json() == first.json() == {"order": 1}
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert "idempotent-replayed" not in first.headers
+    assert other_merchant.json() == {"order": 2}
+    assert unkeyed.json() == {"order": 3}
+    assert endpoints.runs == 3
+
+
+def test_concurrent_retry_waits_for_the_first_attempt(endpoints, tmp_path):
+    async def scenario():
+        endpoints.release.clear()
+        async with client(endpoints, tmp_path) as http:
+            first = asyncio.create_task(http.post("/orders", headers=keyed("k2")))
+            await asyncio.sleep(0.1)
+            retry = asyncio.create_task(http.post("/orders", headers=keyed("k2")))
+            await asyncio.sleep(0.3)
+            endpoints.release.set()
+            return await first, await retry
+
+    first, retry = asyncio.run(scenario())
+    assert endpoints.runs == 1
+    assert retry.status_code == 200 and retry.json() == first.json()
+    assert retry.headers["idempotent-replayed"] == "true"
+
+
+def test_retry_gets_409_when_the_first_attempt_outlasts_the_wait(endpoints, tmp_path):
+    async def scenario():
+        endpoints.release.clear()
+        async with client(endpoints, tmp_path, wait_seconds=0.3) as http:
+            first = asyncio.create_task(http.post("/orders", headers=keyed("k3")))
+            await asyncio.sleep(0.1)
+            retry = await http.post("/orders", headers=keyed("k3"))
+            endpoints.release.set()
+            await first
+            return retry
+
+    retry = asyncio.run(scenario())
+    assert retry.status_code == 409
+    assert endpoints.runs == 1
+
+
+def test_key_reused_for_another_endpoint_gets_422(endpoints, tmp_path):
+    async def scenario():
+        async with client(endpoints, tmp_path) as http:
+            await http.post("/orders", headers=keyed("k4"))
+            return await http.post("/checks", headers=keyed("k4"))
+
+    reused = asyncio.run(scenario())
+    assert reused.status_code == 422
+
+
+def test_failed_attempt_releases_the_key(endpoints, tmp_path):
+    async def scenario():
+        async with client(endpoints, tmp_path) as http:
+            endpoints.fail = True
+            failed = await http.post("/orders", headers=keyed("k5"))
+            endpoints.fail = False
+            return failed, await http.post("/orders", headers=keyed("k5"))
+
+    failed, retry = asyncio.run(scenario())
+    assert failed.status_code == 502
+    assert retry.json() == {"order": 2}
+    assert "idempotent-replayed" not in retry.headers
@@ -0,0 +1,84 @@
+import asyncio
+import time
+
+import pytest
+
+from jobs import JobQueue, SqliteJobStore
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """time.time() that only moves when the test advances it"""
+    now = [time.time()]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(SqliteJobStore(tmp_path / "jobs.sqlite3"), lease_seconds=60)
+
+
+def test_failed_job_is_retried_with_backoff_then_buried(queue, clock):
+    calls = []
+
+    @queue.job("render_preview", max_attempts=3, retry_delay=10)
+    async def render_preview(payload):
+        calls.append(payload)
+        raise ConnectionError("storage unreachable")
+
+    async def scenario():
+        await queue.enqueue("render_preview", {"document_id": "doc"})
+        assert await queue.run_pending() == 1
+        assert await queue.run_pending() == 0  # backing off for 10s
+        clock[0] += 10
+        assert await queue.run_pending() == 1
+        clock[0] += 10
+        assert await queue.run_pending() == 0  # the second delay is 20s
+        clock[0] += 10
+        assert await queue.run_pending() == 1
+        return await queue.dead_jobs()
+
+    dead = asyncio.run(scenario())
+    assert len(calls) == 3
+    assert [job["attempts"] for job in dead] == [3]
+    assert "storage unreachable" in dead[0]["last_error"]
+    assert queue.counters == {"enqueued": 1, "succeeded": 0, "retried": 2, "dead": 1}
+
+
+def test_job_succeeds_on_retry(queue, clock):
+    attempts = []
+
+    @queue.job("update_stats", retry_delay=1)
+    async def update_stats(payload):
+        attempts.append(payload)
+        if len(attempts) == 1:
+            raise TimeoutError()
+
+    async def scenario():
+        await queue.enqueue("update_stats", {"user_id": "merchant"})
+        await queue.run_pending()
+        clock[0] += 1
+        await queue.run_pending()
+        return await queue.stats()
+
+    stats = asyncio.run(scenario())
+    assert len(attempts) == 2
+    assert stats["succeeded"] == 1 and stats["jobs"] == {}
+
+
+def test_claimed_job_is_invisible_until_its_lease_runs_out(queue, clock):
+    @queue.job("cleanup")
+    async def cleanup(payload):
+        pass
+
+    asyncio.run(queue.enqueue("cleanup", {}))
+    claimed = queue.store.claim(1, 60)
+    assert len(claimed) == 1 and claimed[0]["attempts"] == 1
+    assert queue.store.claim(1, 60) == []
+
+    # The worker holding it died: another worker takes it over once the lease expires
+    clock[0] += 61
+    reclaimed = queue.store.claim(1, 60)
+    assert [job["id"] for job in reclaimed] == [claimed[0]["id"]]
+    assert reclaimed[0]["attempts"] == 2
@@ -0,0 +1,67 @@
+import asyncio
+import itertools
+import time
+
+from merchant_codes import ALPHABET, CODE_LENGTH, PREFIX, MerchantCodeAllocator, MerchantCodeIndex, is_well_formed
+
+
+def allocator(reserve_block=None) -> MerchantCodeAllocator:
+    return MerchantCodeAllocator(reserve_block, "test-secret")
+
+
+def test_distinct_numbers_give_distinct_well_formed_codes():
+    codes = allocator()
+    numbers = list(range(20_000)) + [2**40 - 1 - n for n in range(1_000)]
+    issued = {codes.encode(number) for number in numbers}
+    assert len(issued) == len(numbers)
+    assert all(len(code) == CODE_LENGTH and is_well_formed(code) for code in issued)
+    assert codes.encode(7) == allocator().encode(7)
+    assert codes.encode(7) != MerchantCodeAllocator(None, "other-secret").encode(7)
+
+
+def test_check_character_catches_any_single_mistyped_character():
+    code = allocator().encode(123_456)
+    for position in range(len(PREFIX), len(code)):
+        for char in ALPHABET:
+            if char != code[position]:
+                assert not is_well_formed(code[:position] + char + code[position + 1:])
+    assert is_well_formed("BP_12345678")  # issued before check characters
+
+
+def test_workers_never_hand_out_the_same_number():
+    sequence = itertools.count(0, 10)
+
+    async def reserve_block():
+        await asyncio.sleep(0)
+        return next(sequence), 10
+
+    async def scenario():
+        workers = [allocator(reserve_block), allocator(reserve_block), allocator(reserve_block)]
+        return await asyncio.gather(*(worker.allocate() for _ in range(25) for worker in workers))
+
+    codes = asyncio.run(scenario())
+    assert len(set(codes)) == len(codes) == 75
+
+
+def test_index_answers_lookups_until_the_user_changes(monkeypatch):
+    index = MerchantCodeIndex(max_age=60)
+    user = {"id": "merchant", "referral_code": "BP_ABCDEFGHJ", "shop_name": "Sharma Prints"}
+    index.add(user)
+    assert index.get("BP_ABCDEFGHJ") is user
+
+    index.forget_user("merchant")
+    assert index.get("BP_ABCDEFGHJ") is None
+
+    index.add(user)
+    later = time.monotonic() + 61
+    monkeypatch.setattr(time, "monotonic", lambda: later)
+    assert index.get("BP_ABCDEFGHJ") is None
+
+
+def test_index_keeps_at_most_max_entries():
+    index = MerchantCodeIndex(max_entries=2)
+    for n in range(3):
+        index.add({"id": f"merchant-{n}", "referral_code": f"BP_0000000{n}"})
+    assert index.get("BP_00000000") is None
+    assert index.get("BP_00000002")["id"] == "merchant-2"
+    assert "merchant-0" not in index.codes
@@ -0,0 +1,101 @@
+import asyncio
+import base64
+
+import pytest
+from fastapi.testclient import TestClient
+
+from resumable import ResumableUploads, UploadConflictError, UploadTooLargeError
+
+
+def metadata(**fields) -> str:
+    return ",".join(f"{key} {base64.b64encode(value.encode()).decode()}" for key, value in fields.items())
+
+
+async def body(*chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+def test_append_checks_offset_and_length(tmp_path):
+    uploads = ResumableUploads(tmp_path)
+    upload_id = uploads.create(6, {"filename": "scan.pdf"}, {"sub": "merchant"})["id"]
+
+    assert asyncio.run(uploads.append(upload_id, 0, body(b"abc"))) == 3
+    assert uploads.get(upload_id)["offset"] == 3
+    with pytest.raises(UploadConflictError):
+        asyncio.run(uploads.append(upload_id, 0, body(b"abc")))
+    with pytest.raises(UploadTooLargeError):
+        asyncio.run(uploads.append(upload_id, 3, body(b"defg")))
+    assert asyncio.run(uploads.append(upload_id, 3, body(b"def"))) == 6
+
+    uploads.mark_complete(upload_id, {"id": "document"})
+    state = uploads.get(upload_id)
+    assert state["offset"] == 6 and state["result"] == {"id": "document"}
+
+
+def test_merchant_upload_resumes_and_completes_once(backend):
+    server, headers = backend
+    client = TestClient(server.app)
+    data = bytes(range(256)) * 40
+
+    response = client.post("/api/uploads", headers={
+        **headers,
+        "Upload-Length": str(len(data)),
+        "Upload-Metadata": metadata(filename="scan.pdf", filetype="application/pdf", customerName="Sharma")
+    })
+    assert response.status_code == 201
+    location = response.headers["location"]
+
+    patch = {**headers, "Content-Type": "application/offset+octet-stream"}
+    response = client.patch(location, headers={**patch, "Upload-Offset": "0"}, content=data[:4000])
+    assert response.status_code == 204
+    assert client.patch(location, headers={**patch, "Upload-Offset": "0"}, content=b"x").status_code == 409
+    assert client.post(f"{location}/complete", headers=headers).status_code == 409
+
+    offset = int(client.head(location, headers=headers).headers["upload-offset"])
+    assert offset == 4000
+    response = client.patch(location, headers={**patch, "Upload-Offset": str(offset)}, content=data[offset:])
+    assert response.headers["upload-offset"] == str(len(data))
+
+    completed = client.post(f"{location}/complete", headers=headers)
+    assert completed.status_code == 200
+    assert client.post(f"{location}/complete", headers=headers).json() == completed.json()
+    assert len(server.mock_db["documents"]) == 1
+    document = server.mock_db["documents"][0]
+    assert client.get(f"/api/documents/download/{document['shared_link']}").content == data
+
+
+def test_upload_requests_need_the_uploader(backend):
+    server, headers = backend
+    client = TestClient(server.app)
+    location = client.post("/api/uploads", headers={
+        **headers, "Upload-Length": "3", "Upload-Metadata": metadata(filename="a.txt", customerName="Sharma")
+    }).headers["location"]
+    other = {"id": "other-merchant", "phone_number": "+919800000001", "monthly_upload_limit": 20, "uploads_used_this_month": 0}
+    server.mock_db["users"].append(other)
+    other_headers = {"Authorization": f"Bearer {server.create_jwt_token(other['id'], other['phone_number'])}"}
+
+    assert client.head(location).status_code == 401
+    assert client.head(location, headers=other_headers).status_code == 403
+    assert client.delete(location, headers=other_headers).status_code == 403
+    assert client.head(location, headers=headers).status_code == 200
+
+
+def test_customer_upload_needs_its_ticket(backend):
+    server, headers = backend
+    merchant = server.mock_db["users"][0]
+    merchant["referral_code"] = "BP_12345678"
+    client = TestClient(server.app)
+
+    response = client.post(f"/api/uploads/customer/{merchant['referral_code']}", headers={
+        "Upload-Length": "3", "Upload-Metadata": metadata(filename="c.txt", filetype="text/plain")
+    })
+    location = response.headers["location"]
+    ticket = {"Authorization": f"Bearer {response.headers['upload-ticket']}"}
+
+    patch = {"Content-Type": "application/offset+octet-stream", "Upload-Offset": "0"}
+    assert client.patch(location, headers=patch, content=b"abc").status_code == 401
+    assert client.patch(location, headers={**patch, **headers}, content=b"abc").status_code == 401
+    assert client.patch(location, headers={**patch, **ticket}, content=b"abc").status_code == 204
+    assert client.post(f"{location}/complete", headers=ticket).status_code == 200
+    assert server.mock_db["documents"][0]["user_id"] == merchant["id"]